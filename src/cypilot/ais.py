@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""AIS stream of the nmea bridge
+
+AIS is only relayed to tcp clients, the autopilot does not use it. Serial
+devices with the "ais" protocol are read by the nmea bridge process, AIS lines
+received by the autopilot on nmea devices or from tcp clients go through the
+same stream:
+    - multi-part messages are reassembled and relayed as a whole
+    - position reports of a vessel (MMSI) are relayed once per window
+    - other messages received again within the window (several receivers) are dropped
+"""
+
+import cypilot.pilot_path # pylint: disable=unused-import
+import pyjson
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+from pilot_path import PILOT_DIR
+
+AIS_DEFAULT = {'window': 3.0, 'timeout': 2.0}
+
+# message types of position reports: class A, class B, long range
+AIS_POSITION_TYPES = [1, 2, 3, 18, 19, 27]
+
+def read_ais_settings():
+    """read_ais_settings : read AIS stream settings
+
+    Returns:
+        dict: 'window' deduplication window (seconds), 'timeout' for multi-part messages (seconds)
+    """
+    settings = dict(AIS_DEFAULT)
+    aisfilename = PILOT_DIR + 'cypilot_ais.conf'
+    try:
+        file = open(aisfilename)
+        settings.update(pyjson.load(file))
+        file.close()
+    except Exception as e: # pylint: disable=broad-except
+        print('failed to read ais file:', aisfilename, e)
+        try:
+            file = open(aisfilename, 'w')
+            file.write(pyjson.dumps(settings, indent=4) + '\n')
+            file.close()
+        except Exception as ew: # pylint: disable=broad-except
+            print('Exception writing default values to ais file:', aisfilename, ew)
+    return settings
+
+def ais_header(payload):
+    """ais_header : message type and MMSI from the first 7 characters of a payload
+
+    Returns:
+        tuple: (type, mmsi), or None if the payload is too short or invalid
+    """
+    if len(payload) < 7:
+        return None
+    bits = 0
+    for c in payload[:7]:
+        v = ord(c) - 48
+        if v > 40:
+            v -= 8
+        if v < 0 or v > 63:
+            return None
+        bits = (bits << 6) | v
+    return bits >> 36, (bits >> 4) & 0x3fffffff
+
+
+class AisStream(object):
+    """AisStream : reassemble and deduplicate AIS messages
+    """
+    def __init__(self):
+        settings = read_ais_settings()
+        self.window = settings['window']
+        self.timeout = settings['timeout']
+        self.fragments = {} # (sequence id, channel) -> (time, lines, payloads)
+        self.last = {} # deduplication key -> time last relayed
+        self.purge_time = 0
+
+        self.received = 0
+        self.relayed = 0
+        self.duplicates = 0
+        self.incomplete = 0
+
+    def receive(self, line, t):
+        """receive : add a received line
+
+        Args:
+            line (string): !--VDM or !--VDO sentence
+            t (float): monotonic time
+
+        Returns:
+            list: lines of a complete message to relay, or None
+        """
+        self.received += 1
+        if t - self.purge_time > 10:
+            self.purge(t)
+
+        fields = line.split(',')
+        try:
+            count, num = int(fields[1]), int(fields[2])
+            payload = fields[5]
+        except (IndexError, ValueError):
+            return None
+
+        if count == 1:
+            return self.deduplicate([line], payload, t)
+
+        key = fields[3], fields[4]
+        if num == 1:
+            if key in self.fragments:
+                self.incomplete += 1
+            self.fragments[key] = t, [line], [payload]
+            return None
+        if key not in self.fragments or len(self.fragments[key][1]) != num - 1:
+            self.incomplete += 1
+            self.fragments.pop(key, None)
+            return None
+        lines, payloads = self.fragments[key][1], self.fragments[key][2]
+        lines.append(line)
+        payloads.append(payload)
+        if num < count:
+            return None
+        del self.fragments[key]
+        return self.deduplicate(lines, ''.join(payloads), t)
+
+    def deduplicate(self, lines, payload, t):
+        header = ais_header(payload)
+        if header and header[0] in AIS_POSITION_TYPES:
+            key = header
+        else:
+            key = payload
+        if t - self.last.get(key, t - self.window) < self.window:
+            self.duplicates += 1
+            return None
+        self.last[key] = t
+        self.relayed += 1
+        return lines
+
+    def purge(self, t):
+        # forget incomplete messages and deduplication keys out of their window
+        for key in [key for key, fragment in self.fragments.items() if t - fragment[0] > self.timeout]:
+            del self.fragments[key]
+            self.incomplete += 1
+        self.last = {key: lt for key, lt in self.last.items() if t - lt < self.window}
+        self.purge_time = t
+
+    def stats(self):
+        return {'received': self.received, 'relayed': self.relayed,
+                'duplicates': self.duplicates, 'incomplete': self.incomplete}
+
+
+def ais_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    stream = AisStream()
+    lines = ['!AIVDM,1,1,,A,13aEOK?P00PD2wVMdLDRhgvL289?,0*26',
+             '!AIVDM,1,1,,B,13aEOK?P00PD2wVMdLDRhgvL289?,0*25',
+             '!AIVDM,2,1,3,B,55P5TL01VIaAL@7WKO@mBplU@<PDhh000000001S;AJ::4A80?4i@E53,0*3E',
+             '!AIVDM,2,2,3,B,1@0000000000000,2*55']
+    for line in lines:
+        print(line, '->', stream.receive(line, 0))
+    print(stream.stats())
+
+if __name__ == '__main__':
+    ais_main()
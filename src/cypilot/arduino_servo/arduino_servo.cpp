@@ -15,9 +15,11 @@
 #include <math.h>
 
 #include <stdio.h>
+#include <string.h>
 #include <errno.h>
 
 #include <sys/time.h>
+#include <time.h>
 
 #include "arduino_servo.h"
 
@@ -105,6 +107,14 @@ static uint8_t crc8(uint8_t *pcBlock, uint8_t len)
     return crc8_with_init(0xFF, pcBlock, len);
 }
 
+// same clock as python time.monotonic()
+static double monotonic()
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
 ArduinoServo::ArduinoServo(int _fd)
     : fd(_fd)
 {
@@ -114,6 +124,14 @@ ArduinoServo::ArduinoServo(int _fd)
     max_current = 0;
     params_set = 0;
     flags = 0;
+    out_buf_len = 0;
+    out_offset = 0;
+    write_count = short_writes = dropped_packets = write_errors = backlog = 0;
+    voltage = current = 0;
+    telemetry_head = telemetry_tail = 0;
+    packet_errors = telemetry_overruns = 0;
+    amp_hours = watt_hours = 0;
+    poll_time = last_current_time = last_current = last_power = 0;
 
     // force unsync
     uint8_t reset_code[] = {0xff, 0xff, 0xff, 0xff};
@@ -142,12 +160,34 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
     if (packet_count < 255)
         packet_count++;
     uint16_t value = in_buf[1] + (in_buf[2] << 8);
+    record(in_buf[0], value, poll_time);
 
     switch (in_buf[0])
     {
     case CURRENT_CODE:
         current = value / 100.0;
         // DVG_PRINT_TV ; printf("servo current  %f\n", current);
+        {
+            // corrected like Servo.poll, trapezoidal integration between packets
+            double corrected = current, corrected_voltage = voltage;
+            if (params_set)
+            {
+                corrected *= current_factor;
+                if (current)
+                    corrected = fmax(0, corrected + current_offset);
+                corrected_voltage = voltage_factor * voltage + voltage_offset;
+            }
+            double power = corrected_voltage * corrected;
+            double dt = poll_time - last_current_time;
+            if (last_current_time && dt < 1) // not across a communication loss
+            {
+                amp_hours += (last_current + corrected) * dt / 7200;
+                watt_hours += (last_power + power) * dt / 7200;
+            }
+            last_current_time = poll_time;
+            last_current = corrected;
+            last_power = power;
+        }
         return CURRENT;
     case VOLTAGE_CODE:
         voltage = value / 100.0;
@@ -229,6 +269,10 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
 
     int ArduinoServo::poll()
     {
+        // bytes the tty did not take at the last call
+        if (out_buf_len)
+            flush();
+
         if (!(flags & SYNC))
         {
             raw_command(1000); // ensure we set the temp limits as well here
@@ -274,6 +318,7 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
             if (in_buf_len < 4)
                 return 0;
         }
+        poll_time = monotonic(); // packets of a read share its time
 
         int ret = 0;
         while (in_buf_len >= 4)
@@ -293,6 +338,8 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
             {
                 // invalid packet, shift by 1 byte
                 // DBG_PRINT_TV ; printf("invalid packet received %x %x %x %x\n", in_buf[0], in_buf[1], in_buf[2], in_buf[3]);
+                if (in_sync_count >= 2)
+                    packet_errors++;
                 in_sync_count = 0;
                 in_buf_len--;
                 for (int i = 0; i < in_buf_len; i++)
@@ -383,7 +430,76 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
         uint8_t code[4] = {command, (uint8_t)(value & 0xff), (uint8_t)((value >> 8) & 0xff), 0};
         code[3] = crc8(code, 3);
         // if( command != DISENGAGE_CODE ) { DBG_PRINT_TV ; printf("output %x %x %x %x\n", code[0], code[1], code[2], code[3]); }
-        write(fd, code, 4);
+
+        // record motor commands with the telemetry, as queued
+        if (command == COMMAND_CODE || command == ANGLE_CODE || command == DISENGAGE_CODE || command == RESET_CODE)
+            record(command, value, monotonic());
+
+        if (out_buf_len + 4 > (int)sizeof out_buf)
+        {
+            // output buffer full, drop the oldest packet not partially written
+            // so the latest command still reaches the controller
+            int start = out_offset ? 4 - out_offset : 0;
+            memmove(out_buf + start, out_buf + start + 4, out_buf_len - start - 4);
+            out_buf_len -= 4;
+            dropped_packets++;
+        }
+        memcpy(out_buf + out_buf_len, code, 4);
+        out_buf_len += 4;
+    }
+
+    void ArduinoServo::flush()
+    {
+        // single non blocking write of the pending packets, the rest is kept
+        // for the next call and completed before newer packets
+        if (!out_buf_len)
+            return;
+
+        write_count++;
+        int c = write(fd, out_buf, out_buf_len);
+        if (c < 0)
+        {
+            if (errno != EAGAIN)
+                write_errors++;
+            c = 0;
+        }
+        if (c < out_buf_len)
+        {
+            short_writes++;
+            memmove(out_buf, out_buf + c, out_buf_len - c);
+        }
+        out_buf_len -= c;
+        out_offset = (out_offset + c) % 4;
+        backlog = out_buf_len;
+    }
+
+    void ArduinoServo::record(uint8_t code, uint16_t value, double t)
+    {
+        if (telemetry_head - telemetry_tail == TELEMETRY_RING_SIZE)
+        {
+            // not drained, overwrite the oldest record
+            telemetry_tail++;
+            telemetry_overruns++;
+        }
+        servo_telemetry_record &r = telemetry[telemetry_head % TELEMETRY_RING_SIZE];
+        r.time = t;
+        r.value = value;
+        r.code = code;
+        r.reserved = 0;
+        telemetry_head++;
+    }
+
+    int ArduinoServo::drain(char *buffer, int size)
+    {
+        // copy the records written since the last drain, oldest first
+        int n = 0, max = size / sizeof(servo_telemetry_record);
+        while (n < max && telemetry_tail != telemetry_head)
+        {
+            memcpy(buffer + n * sizeof(servo_telemetry_record), &telemetry[telemetry_tail % TELEMETRY_RING_SIZE], sizeof(servo_telemetry_record));
+            telemetry_tail++;
+            n++;
+        }
+        return n;
     }
 
     void ArduinoServo::send_params()
@@ -462,26 +578,31 @@ int ArduinoServo::process_packet(uint8_t *in_buf)
     {
         send_params();
         send_value(COMMAND_CODE, value);
+        flush();
     }
 
     void ArduinoServo::raw_angle(uint16_t value)
     {
         send_params();
         send_value(ANGLE_CODE, value);
+        flush();
     }
 
     void ArduinoServo::reset()
     {
         send_value(RESET_CODE, 0);
+        flush();
     }
 
     void ArduinoServo::disengage()
     {
         send_params();
         send_value(DISENGAGE_CODE, 0);
+        flush();
     }
 
     void ArduinoServo::reprogram()
     {
         send_value(REPROGRAM_CODE, 0);
+        flush();
     }
@@ -12,6 +12,16 @@
 
 #include "arduino_servo_eeprom.h"
 
+// packet received, or command sent, with its monotonic time
+struct servo_telemetry_record {
+    double time;
+    uint16_t value;
+    uint8_t code;
+    uint8_t reserved;
+} __attribute__((packed)) ;
+
+#define TELEMETRY_RING_SIZE 4096 // about 20 seconds of telemetry
+
 class ArduinoServo
 {
     enum Telemetry {FLAGS= 1, CURRENT = 2, VOLTAGE = 4, SPEED = 8, POSITION = 16, CONTROLLER_TEMP = 32, MOTOR_TEMP = 64, RUDDER = 128, EEPROM = 256, VERSION_FIRMWARE = 512};
@@ -26,6 +36,7 @@ public:
     void reprogram();
     int poll();
     bool fault();
+    int drain(char *buffer, int size);
     void params(double _raw_max_current, double _rudder_min, double _rudder_max, double _max_current, double _max_controller_temp, double _max_motor_temp, double _rudder_range, double _rudder_offset, double _rudder_scale, double _rudder_nonlinearity, double _max_slew_speed, double _max_slew_slow, double _current_factor, double _current_offset, double _voltage_factor, double _voltage_offset, double _min_speed, double _max_speed, double _gain, double _rudder_brake);
 
     // firmware version
@@ -50,8 +61,22 @@ public:
     
     int flags;
 
+    // serial output, packets of a call are written at once
+    int write_count;     // write calls
+    int short_writes;    // writes that did not take all pending bytes
+    int dropped_packets; // packets dropped with the output buffer full
+    int write_errors;    // writes failed other than with EAGAIN
+    int backlog;         // bytes not yet taken by the tty
+
+    // telemetry
+    int packet_errors;      // sync lost on invalid data
+    int telemetry_overruns; // records overwritten before being drained
+    double amp_hours, watt_hours; // integrated over every current packet, corrected
+
 private:
     void send_value(uint8_t command, uint16_t value);
+    void flush();
+    void record(uint8_t code, uint16_t value, double t);
     void send_params();
     void raw_command(uint16_t value);
     void raw_angle(uint16_t value);
@@ -60,10 +85,18 @@ private:
     uint8_t in_buf[1024];
     int in_buf_len;
     int fd;
+    uint8_t out_buf[256];
+    int out_buf_len;
+    int out_offset; // bytes of the first pending packet already written
     int out_sync;
     int params_set;
     int packet_count;
 
+    servo_telemetry_record telemetry[TELEMETRY_RING_SIZE];
+    unsigned int telemetry_head, telemetry_tail; // records written and drained
+    double poll_time; // time of the last read
+    double last_current_time, last_current, last_power;
+
     int nosync_count, nosync_data;
 
     arduino_servo_eeprom eeprom;
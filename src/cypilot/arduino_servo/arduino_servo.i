@@ -5,6 +5,9 @@
 #include "arduino_servo.h"
 %}
 
+%include <pybuffer.i>
+%pybuffer_mutable_binary(char *buffer, int size);
+
 class ArduinoServo
 {
     enum Telemetry {FLAGS= 1, CURRENT = 2, VOLTAGE = 4, SPEED = 8, POSITION = 16, CONTROLLER_TEMP = 32, MOTOR_TEMP = 64, RUDDER = 128, MAX_CURRENT = 256, MAX_CONTROLLER_TEMP = 512, MAX_MOTOR_TEMP = 1024, RUDDER_RANGE = 2048, MAX_SLEW = 4096};
@@ -20,6 +23,7 @@ public:
     void reprogram();
     int poll();
     bool fault();
+    int drain(char *buffer, int size);
     void params(double _raw_max_current, double _rudder_min, double _rudder_max, double _max_current, double _max_controller_temp, double _max_motor_temp, double _rudder_range, double _rudder_offset, double _rudder_scale, double _rudder_nonlinearity, double _max_slew_speed, double _max_slew_slow, double _current_factor, double _current_offset, double _voltage_factor, double _voltage_offset, double _min_speed, double _max_speed, double _gain, double _rudder_brake);
 
     int version_firmware;
@@ -34,4 +38,8 @@ public:
     double rudder_brake;
 
     int flags;
+
+    int write_count, short_writes, dropped_packets, write_errors, backlog;
+    int packet_errors, telemetry_overruns;
+    double amp_hours, watt_hours;
 };
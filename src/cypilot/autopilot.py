@@ -17,9 +17,14 @@
 import sys
 import os
 import math
+import collections
 
 import cypilot.pilot_path # pylint: disable=unused-import
 
+# must be started before autopilot imports to time them
+from startup_profile import STARTUP
+STARTUP.start(sys.argv)
+
 from pilot_path import get_lock
 get_lock('autopilot')
 
@@ -27,6 +32,10 @@ import servo
 import tacking
 import pilots
 from perf import Perf
+from derived import DerivedValues
+from worker import BackgroundWorker
+from flight_recorder import FlightRecorder
+from helpers import FORKSERVER
 from sensors import Sensors
 from pilot_version import STRVERSION
 from resolv import resolv, resolv360, resolv180
@@ -38,6 +47,8 @@ from rc.receiver import RemoteControlClient
 
 from pilot_path import (dprint as print, close_autopilot_log_pipe) # pylint: disable=redefined-builtin
 
+EXTRAPOLATION_MAX = 1 # seconds, limit of sensor sample extrapolation
+
 def minmax(value, r):
     """minmax : adjust value in a range 0 to +/- rng
                 ex: 'minmax( heading_error, 60)' adjust heading error to be in range -60 to +60)
@@ -137,13 +148,20 @@ class Autopilot(object):
         super(Autopilot, self).__init__()
         self.watchdog_device = False
 
-        self.server = cypilotServer()
-        self.client = cypilotClient(self.server)
-        self.boatimu = BoatIMU(self.client)
-        self.sensors = Sensors(self.client)
-        self.servo = servo.Servo(self.client, self.sensors)
-        self.remotecontrol = RemoteControlClient()
-        self.perf = Perf()
+        with STARTUP.section('server'):
+            self.server = cypilotServer()
+        with STARTUP.section('client'):
+            self.client = cypilotClient(self.server)
+        with STARTUP.section('boatimu'):
+            self.boatimu = BoatIMU(self.client)
+        with STARTUP.section('sensors'):
+            self.sensors = Sensors(self.client)
+        with STARTUP.section('servo'):
+            self.servo = servo.Servo(self.client, self.sensors)
+        with STARTUP.section('remotecontrol'):
+            self.remotecontrol = RemoteControlClient()
+        with STARTUP.section('perf'):
+            self.perf = Perf()
 
         self.timestamp = self.client.register(TimeStamp())
         self.starttime = time.monotonic()
@@ -169,18 +187,16 @@ class Autopilot(object):
         self.speed_mode = self.register(
             EnumSetting, 'speed_mode', 'gps.speed', ['gps.speed', 'sow.speed', 'none'], persistent=True)
 
+        # pilots are only loaded when first selected, on the worker thread
         self.pilots = {}
-        for pilot_type in pilots.DEFAULT:
-            try:
-                pilot = pilot_type(self)
-                self.pilots[pilot.name] = pilot
-            except Exception as e:
-                print(f"Pilot [{pilot_type.__module__.split('.')[1]}] has not been loaded {e}'")
-
-        pilot_names = list(self.pilots)
-        print('Loaded Pilots:', pilot_names)
+        self.pilots_loading = set()
+        self.pilots_loaded = collections.deque() # (name, pilot or None) handed back by the worker
+        pilot_names = list(pilots.DEFAULT)
+        print('Available Pilots:', pilot_names)
         self.pilot = self.register(
             EnumProperty, 'pilot', 'simple', pilot_names, persistent=True)
+        with STARTUP.section('pilots'):
+            self.current_pilot = self.load_pilot('simple') # registered on the first loop
 
         # copy it to overlay
         self.heading = self.register(SensorValue, 'heading', directional=True)
@@ -218,6 +234,9 @@ class Autopilot(object):
             BooleanProperty, 'wind_noise_reduction', False, persistent=True)
         self.wind_altitude =  self.register(
             Value, 'wind_altitude', 16, persistent=True)
+        # extrapolate wind angle and gps track from their sample time to the imu read with heading rate
+        self.wind_extrapolation = self.register(
+            BooleanProperty, 'wind_extrapolation', False, persistent=True)
 
         self.vmg = self.register(
             Value, 'vmg', 0)
@@ -226,6 +245,22 @@ class Autopilot(object):
 
         self.timings = self.register(SensorValue, 'timings', False)
 
+        # derived values only recomputed when their inputs changed
+        gps, wind, sow = self.sensors.gps, self.sensors.wind, self.sensors.sow
+        self.derived = DerivedValues()
+        self.derived.add('speed_mode', self.adjust_speed_mode,
+                         [gps.source, sow.source, self.speed_mode])
+        # wind is only updated on new wind samples, gps and compass are sampled at this time
+        self.derived.add('wind', self.compute_wind,
+                         [wind.source, wind.direction, wind.speed])
+        # the compass heading changes on each IMU sample, gps speed and wind on their samples
+        self.derived.add('vmg', self.compute_vmg,
+                         [gps.source, wind.source, gps.speed, self.true_wind_direction,
+                          self.boatimu.sensor_values['heading']])
+        # the pilot heading only changes with its mode sensor, evaluated after pilot.compute_heading
+        self.derived.add('cmg', self.compute_cmg,
+                         [gps.source, gps.speed, self.heading, self.heading_command])
+
         device = '/dev/watchdog0'
         try:
             self.watchdog_device = open(device, 'w')
@@ -233,15 +268,28 @@ class Autopilot(object):
             print('warning: failed to open special file', device, 'for writing')
             print('         cannot stroke the watchdog')
 
-        self.server.poll()  # setup process before we switch main process to realtime
+        with STARTUP.section('server.setup'):
+            self.server.poll()  # setup process before we switch main process to realtime
         print('autopilot process : ', os.getpid())
-        if os.system(f"sudo chrt -pf 2 {os.getpid():d} 2>&1 > /dev/null"):
-            print('warning, failed to make autopilot process realtime')
+        with STARTUP.section('realtime'):
+            if os.system(f"sudo chrt -pf 2 {os.getpid():d} 2>&1 > /dev/null"):
+                print('warning, failed to make autopilot process realtime')
 
         self.lasttime = time.monotonic()
 
+        # non realtime processing is done by a worker thread
+        self.iterations = 0
+        self.watchdog_iterations = 0
+        self.worker = BackgroundWorker('autopilot worker')
+        self.sensors.attach_worker(self.worker)
+        self.worker.add_job(self.stroke_watchdog)
+        self.worker.start()
+
+        with STARTUP.section('recorder'):
+            self.recorder = FlightRecorder(self.client, self.worker)
+
         # setup all processes to exit on any signal
-        self.childprocesses = [self.sensors.nmea, self.sensors.gpsd, self.sensors.signalk, self.server, self.remotecontrol, self.perf]
+        self.childprocesses = [self.sensors.nmea, self.sensors.gpsd, self.sensors.signalk, self.server, self.remotecontrol, self.perf, FORKSERVER]
 
         def cleanup(signal_number, frame=None):
             if signal_number == signal.SIGCHLD:
@@ -309,6 +357,14 @@ class Autopilot(object):
 
         close_autopilot_log_pipe()
 
+    def stroke_watchdog(self):
+        """stroke_watchdog : called from the worker thread, only if the autopilot loop is running
+        """
+        if self.watchdog_device and self.iterations != self.watchdog_iterations:
+            self.watchdog_iterations = self.iterations
+            self.watchdog_device.write('c')
+            self.watchdog_device.flush()
+
     def register(self, _type, name, *args, **kwargs):
         """register : register autopilot value on server
 
@@ -321,6 +377,60 @@ class Autopilot(object):
         """
         return self.client.register(_type(*(['ap.' + name] + list(args)), **kwargs))
 
+    def load_pilot(self, name):
+        """load_pilot : import and instantiate a pilot, called by the worker thread
+        except for the startup pilot
+
+        The pilot is handed back to the realtime loop through pilots_loaded,
+        select_pilot registers its values and swaps it in.
+
+        Args:
+            name (string): pilot name
+
+        Returns:
+            AutopilotPilot: pilot, or None if the pilot failed to load
+        """
+        t0 = time.monotonic()
+        try:
+            pilot = pilots.load(name)(self)
+        except Exception as e:
+            print(f"Pilot [{name}] has not been loaded {e}'")
+            pilot = None
+        else:
+            print(f"Loaded Pilot [{name}] in {time.monotonic()-t0:.2f}s")
+        self.pilots_loaded.append((name, pilot))
+        return pilot
+
+    def select_pilot(self):
+        """select_pilot : return the pilot to run
+
+        The first time a pilot is selected it is loaded by the worker thread,
+        the current pilot keeps running until the new one is ready.
+
+        Returns:
+            AutopilotPilot: pilot
+        """
+        while self.pilots_loaded:
+            name, pilot = self.pilots_loaded.popleft()
+            self.pilots_loading.discard(name)
+            if pilot:
+                for value in pilot.values:
+                    self.client.register(value)
+                self.pilots[name] = pilot
+                continue
+            if name in self.pilot.choices:
+                self.pilot.choices.remove(name)
+            if self.pilot.value == name:
+                self.pilot.set(self.current_pilot.name)
+
+        name = self.pilot.value
+        if name in self.pilots:
+            return self.pilots[name]
+        if name not in self.pilots_loading:
+            self.pilots_loading.add(name)
+            self.worker.call(self.load_pilot, name)
+        return self.current_pilot
+
     def adjust_mode(self, pilot):
         """adjust_mode : change AutoPilot operating mode
 
@@ -353,6 +463,23 @@ class Autopilot(object):
         elif sow_source is None and speed_mode == "sow.speed":
             self.speed_mode.set("gps.speed")
 
+    def sample_heading_change(self, sensor):
+        """sample_heading_change : heading change since the last sample of a sensor
+        was measured, extrapolated with the heading rate
+
+        Args:
+            sensor (Sensor): wind or gps
+
+        Returns:
+            float: degrees, 0 if extrapolation is disabled
+        """
+        if not self.wind_extrapolation.value:
+            return 0
+        dt = min(self.boatimu.last_imuread - sensor.sample_time, EXTRAPOLATION_MAX)
+        if dt <= 0:
+            return 0
+        return self.boatimu.headingrate * dt
+
     def compute_wind(self):
         """compute_wind : compute difference between compass to gps and compass to wind
         """
@@ -370,7 +497,7 @@ class Autopilot(object):
             if self.sensors.wind.updated:
                 self.sensors.wind.updated = False
                 wind_speed = self.sensors.wind.speed.value
-                wind_angle = self.sensors.wind.angle.value
+                wind_angle = resolv180(self.sensors.wind.angle.value, self.sample_heading_change(self.sensors.wind))
 
                 if wind_noise_reduction:
                     #remove wind from pitchrate/rollrate and then correct wind du to inclination of sensor
@@ -381,47 +508,47 @@ class Autopilot(object):
                     wind_angle = math.degrees(math.atan2(l_w, f_w))
                     wind_speed = math.hypot(l_w, f_w)
 
-                self.wind_speed.set(wind_speed)
-                self.wind_angle.set(wind_angle)
-                self.wind_direction.set(resolv360(compass, -wind_angle))
-                self.wind_speed_smoothed.set(
+                self.wind_speed.update(wind_speed)
+                self.wind_angle.update(wind_angle)
+                self.wind_direction.update(resolv360(compass, -wind_angle))
+                self.wind_speed_smoothed.update(
                     (1-smooth_factor_wind)*self.wind_speed_smoothed.value + smooth_factor_wind*wind_speed
                     )
                 wind_angle_smoothed = (1-smooth_factor_wind)*self.wind_angle_smoothed.value + smooth_factor_wind*wind_angle
-                self.wind_angle_smoothed.set(resolv180(wind_angle_smoothed))#resolv180 probably unuse
+                self.wind_angle_smoothed.update(resolv180(wind_angle_smoothed))#resolv180 probably unuse
                 wind_direction = resolv360(compass, -wind_angle_smoothed)
-                self.wind_direction_smoothed.set(wind_direction)
+                self.wind_direction_smoothed.update(wind_direction)
 
                 if self.sensors.gps.source.value != 'none':
                     gps_speed = self.sensors.gps.speed.value
-                    gps_track = self.sensors.gps.track.value
+                    gps_track = resolv360(self.sensors.gps.track.value, self.sample_heading_change(self.sensors.gps))
                     true_wind = compute_true_wind(gps_speed, gps_track, wind_speed,
                                                 wind_direction)
                     true_wind_dir = resolv360(true_wind[0])
                     true_wind_speed = true_wind[1]
                     true_wind_angle = resolv180(compass, -true_wind_dir) # a vérifier le signe
 
-                    self.true_wind_angle.set(
+                    self.true_wind_angle.update(
                         (1-smooth_factor_wind)*self.true_wind_angle.value + smooth_factor_wind*true_wind_angle
                         )
-                    self.true_wind_speed.set(
+                    self.true_wind_speed.update(
                         (1-smooth_factor_wind)*self.true_wind_speed.value + smooth_factor_wind*true_wind_speed
                         )
-                    self.true_wind_direction.set(
+                    self.true_wind_direction.update(
                         (1-smooth_factor_wind)*self.true_wind_direction.value + smooth_factor_wind*true_wind_dir
                         )
 
                 else:
-                    self.true_wind_angle.set(0)
-                    self.true_wind_speed.set(0)
-                    self.true_wind_direction.set(0)
+                    self.true_wind_angle.update(0)
+                    self.true_wind_speed.update(0)
+                    self.true_wind_direction.update(0)
         else:
-            self.wind_speed.set(0)
-            self.wind_angle.set(0)
-            self.wind_direction.set(0)
-            self.true_wind_angle.set(0)
-            self.true_wind_speed.set(0)
-            self.true_wind_direction.set(0)
+            self.wind_speed.update(0)
+            self.wind_angle.update(0)
+            self.wind_direction.update(0)
+            self.true_wind_angle.update(0)
+            self.true_wind_speed.update(0)
+            self.true_wind_direction.update(0)
 
 
     def compute_vmg(self):
@@ -434,10 +561,10 @@ class Autopilot(object):
 
             vmg = math.cos(math.radians(true_wind_direction - compass)) * gps_speed
 
-            self.vmg.set(vmg)
+            self.vmg.update(vmg)
             
         else:
-            self.vmg.set(0)
+            self.vmg.update(0)
 
     def compute_cmg(self):
         """Compute cmg from heading command, heading and GPS Speed
@@ -449,10 +576,10 @@ class Autopilot(object):
 
             cmg = math.cos(math.radians(heading_command - heading)) * gps_speed
 
-            self.cmg.set(cmg)
+            self.cmg.update(cmg)
         
         else:
-            self.cmg.set(0)
+            self.cmg.update(0)
 
 
     #Copy it to def compute_heading_error_overlay(self, t)
@@ -480,7 +607,7 @@ class Autopilot(object):
         # error +- 60 degrees
         err = minmax(resolv(heading - heading_command), 60)
         #set error
-        self.heading_error.set(err)
+        self.heading_error.update(err)
 
         # compute integral for I gain
         dt = t - self.heading_error_int_time
@@ -492,10 +619,10 @@ class Autopilot(object):
         """iteration : autopilot loop processing
         """
 
-        # t0 : synchronous read of IMU values
-        # -----------------------------------
+        # t0 : read of IMU values
+        # ------------------------
         
-        # boatimu.read() should return when fresh rotation vector is available
+        # boatimu.read() returns when the acquisition thread has a fresh rotation vector
         t0 = time.monotonic()
         self.boatimu.read()
         
@@ -519,13 +646,11 @@ class Autopilot(object):
         # ---------------------------
 
         t3 = time.monotonic()
-        self.adjust_speed_mode()
-        self.compute_wind()
-        self.compute_vmg()
-        pilot = self.pilots[self.pilot.value]  # select pilot
+        self.derived.evaluate('speed_mode', 'wind', 'vmg')
+        pilot = self.current_pilot = self.select_pilot()
         self.adjust_mode(pilot)
         pilot.compute_heading()
-        self.compute_cmg()
+        self.derived.evaluate('cmg')
 
         # Process tack calculation before compute heading error
         self.tack.process()
@@ -557,10 +682,10 @@ class Autopilot(object):
         t5 = time.monotonic()
 
         self.timings.set([t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t5-t1])
+        self.recorder.record(self, t0, t1, t5)
         self.timestamp.set(t1-self.starttime)
 
-        if self.watchdog_device:
-            self.watchdog_device.write('c')
+        self.iterations += 1
 
         # imuboat time (t1-t0) is mainly sleeptime while waiting for next rotation vector
         
@@ -579,6 +704,9 @@ def autopilot_main():
     """main : main
     """
     ap = Autopilot()
+    if STARTUP.enabled:
+        # only profile startup, exit status reports the budget check
+        sys.exit(0 if STARTUP.finish() else 1)
     while True:
         ap.iteration()
 
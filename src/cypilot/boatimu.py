@@ -23,14 +23,22 @@ from adafruit_extended_bus import ExtendedI2C as I2C
 import cypilot.pilot_path
 import quaternion
 from client import cypilotClient
-from pilot_values import SensorValue, ResettableValue, EnumProperty, RangeProperty, Property
+from pilot_values import SensorValue, ResettableValue, EnumProperty, RangeProperty, Property, JSONValue
 import pyjson
 
 import devices.pilot_imu
+from imu_acquisition import IMUAcquisition, AcquisitionTiming, DecimationFilter, ACQUISITION_RATES, decimated_rate
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 from pilot_path import PILOT_DIR
 
+ACQUISITION_REPORT_PERIOD = 5 # seconds between publications of imu.acquisition
+RAD2DEG = 180 / math.pi
+
+# imu values set by read(), in the order of the values computed
+SENSOR_NAMES = ['roll', 'pitch', 'heading', 'rollrate', 'pitchrate', 'headingrate', 'heel',
+                'accel_X', 'accel_Y', 'accel_Z', 'fusionQPose']
+
 def read_deviation():
     deviationfilename = PILOT_DIR + 'cypilot_deviation.conf'
     deviation_value = []
@@ -105,6 +113,34 @@ def readable_timespan(total):
         return loop(i+1, mods[i][1]*mod) + (('%d' + mods[i][0] + ' ') % (t/(mods[i][1]*mod)))
     return loop(0, 1)
 
+def aligned_pose(q, a):
+    """aligned_pose : IMU orientation rotated by the alignment, and its euler angles,
+    quaternion.multiply, normalize and toeuler in one pass on tuples
+
+    Args:
+        q (tuple): IMU orientation quaternion
+        a (tuple): alignment quaternion
+
+    Returns:
+        tuple: (aligned quaternion, roll, pitch, heading), angles in degrees, heading in [0, 360[
+    """
+    q0, q1, q2, q3 = q
+    a0, a1, a2, a3 = a
+    w = q0*a0 - q1*a1 - q2*a2 - q3*a3
+    x = q0*a1 + q1*a0 + q2*a3 - q3*a2
+    y = q0*a2 - q1*a3 + q2*a0 + q3*a1
+    z = q0*a3 + q1*a2 - q2*a1 + q3*a0
+    d = math.sqrt(w*w + x*x + y*y + z*z)
+    if d:
+        w, x, y, z = w/d, x/d, y/d, z/d
+    roll = math.atan2(2.0 * (y*z + w*x), 1 - 2.0 * (x*x + y*y)) * RAD2DEG
+    pitch = math.asin(min(max(2.0 * (w*y - x*z), -1), 1)) * RAD2DEG
+    heading = math.atan2(2.0 * (x*y + w*z), 1 - 2.0 * (y*y + z*z)) * RAD2DEG
+    if heading < 0:
+        heading += 360
+    return (w, x, y, z), roll, pitch, heading
+
+
 class QuaternionValue(ResettableValue):
     """QuaternionValue Quaternion
 
@@ -128,6 +164,9 @@ class BoatIMU(object):
         self.client = client
 
         self.rate = self.register(EnumProperty, 'rate', 10, [10, 20], persistent=True)
+        # IMU read rate, samples are decimated to the pilot rate: the IMU is read at the
+        # highest multiple of the pilot rate not above it, see decimated_rate()
+        self.acquisition_rate = self.register(EnumProperty, 'acquisition_rate', 10, ACQUISITION_RATES, persistent=True)
 
         self.alignmentQ = self.register(QuaternionValue, 'alignmentQ', [1, 0, 0, 0], persistent=True)
         self.alignmentQ.last = False
@@ -144,25 +183,34 @@ class BoatIMU(object):
 
         self.headingrate = self.heel = 0
 
-        sensornames = ['accel_X', 'accel_Y', 'accel_Z', 'pitch', 'roll']
-        sensornames += ['pitchrate', 'rollrate', 'headingrate', 'heel']
-        directional_sensornames = ['heading']
-        sensornames += directional_sensornames
-
         self.sensor_values = {}
-        for name in sensornames:
-            self.sensor_values[name] = self.register(SensorValue, name, directional=name in directional_sensornames)
+        for name in SENSOR_NAMES[:-1]:
+            self.sensor_values[name] = self.register(SensorValue, name, directional=name == 'heading')
 
         # quaternion needs to report many more decimal places than other sensors
         self.sensor_values['fusionQPose'] = self.register(SensorValue, 'fusionQPose', fmt='%.8f')
+        self.sensor_list = [self.sensor_values[name] for name in SENSOR_NAMES]
+
+        # alignment rotation, taken from alignmentQ when it changes
+        self.alignment = tuple(self.alignmentQ.value)
+        self.alignment_generation = self.alignmentQ.generation
 
         # initialize IMU for direct access to the device data
         self.i2c = I2C(devices.pilot_imu.I2C_DEFAULT_BUS)
-        self.imu = devices.pilot_imu.PilotIMU(i2c=self.i2c, rate=self.rate.value)
+        self.imu = devices.pilot_imu.PilotIMU(i2c=self.i2c, rate=decimated_rate(self.acquisition_rate.value, self.rate.value))
         time.sleep(0.1)
 
         self.last_imuread = time.monotonic() + 4 # ignore failed readings at startup
 
+        # the IMU is read by its own thread, read() takes the samples from its ring
+        self.acquisition = IMUAcquisition(self.imu)
+        self.acquisition.start()
+        self.sample_index = 0
+        self.decimation = DecimationFilter(self.imu.rate, self.rate.value)
+        self.timing = AcquisitionTiming()
+        self.timing_value = self.register(JSONValue, 'acquisition', {})
+        self.timing_time = time.monotonic()
+
     def register(self, _type, name, *args, **kwargs):
         """register : register IMU object value on server under "imu.name"
 
@@ -189,41 +237,66 @@ class BoatIMU(object):
         self.alignmentQ.update(quaternion.normalize(quaternion.multiply(q, o)))
 
     def read(self):
-        data = self.imu.getIMUData()
+        """read : wait for the IMU samples of a pilot period, set the imu values from the
+        newest orientation and the gyro and accel averaged over the period
 
-        self.last_imuread = time.monotonic()
+        Returns:
+            dict: fusionQPose, gyro and accel, None if no sample was acquired within 2 periods
+        """
+        acquisition_rate = decimated_rate(self.acquisition_rate.value, self.rate.value)
+        if acquisition_rate != self.decimation.acquisition_rate or self.rate.value != self.decimation.pilot_rate:
+            self.acquisition.set_rate(acquisition_rate)
+            self.decimation.configure(acquisition_rate, self.rate.value)
+
+        samples, self.sample_index, lost = self.acquisition.wait(self.sample_index, 2 / self.rate.value,
+                                                                 self.decimation.decimation)
+        t = time.monotonic()
+        self.timing.add(samples, lost, t, self.decimation.decimation)
+        if t - self.timing_time > ACQUISITION_REPORT_PERIOD:
+            self.timing_value.set(self.timing.report(self.acquisition.errors, self.acquisition.cpu_time))
+            self.timing_time = t
+        if not samples:
+            return None
+
+        cpu = time.thread_time()
+        sample = samples[-1]
+        self.last_imuread = sample.time
+        gyro, accel = self.decimation.filter(samples)
+        data = {'fusionQPose': sample.quaternion, 'gyro': gyro, 'accel': accel}
 
         # alignment of the position vector to increase precision
-        p_aligned = quaternion.multiply(data['fusionQPose'], self.alignmentQ.value)
-        p_aligned = quaternion.normalize(p_aligned)
-        data['roll'], data['pitch'], data['heading'] = map(math.degrees, quaternion.toeuler(p_aligned))
-
-        # no alignment required for gyro if the installation alignment procedure has been completed
-        # we use the gyro vector directly from the IMU as precision is sufficient for pitch/roll/heading rate
-        data['rollrate'], data['pitchrate'], data['headingrate'] = map(math.degrees, data['gyro'])
-
-        if data['heading'] < 0:
-            data['heading'] += 360
+        if self.alignmentQ.generation != self.alignment_generation:
+            self.alignment = tuple(self.alignmentQ.value)
+            self.alignment_generation = self.alignmentQ.generation
+        p_aligned, roll, pitch, heading = aligned_pose(sample.quaternion, self.alignment)
 
         # apply deviation correction table on magnetic heading
-        data['heading'] += self.deviation[int(data['heading'])]
+        heading += self.deviation[int(heading) % 360]
 
-        self.headingrate = data['headingrate']
-
-        data['heel'] = self.heel = data['roll']*.03 + self.heel*.97
-
-        data['accel_X'], data['accel_Y'], data['accel_Z'] = data['accel']
-
-        # set sensors
-        for sname, svalue in self.sensor_values.items():
-            svalue.set(data[sname])
+        # no alignment required for gyro if the installation alignment procedure has been completed
+        # we use the gyro vector directly from the IMU as precision is sufficient for pitch/roll/heading rate
+        gx, gy, gz = gyro
+        self.headingrate = gz * RAD2DEG
+        self.heel = roll*.03 + self.heel*.97
+        ax, ay, az = accel
+        values = (roll, pitch, heading, gx * RAD2DEG, gy * RAD2DEG, self.headingrate, self.heel,
+                  ax, ay, az, list(sample.quaternion))
+
+        # set sensors, only values watched by clients are sent, the others are
+        # updated in place for the autopilot and derived values
+        for svalue, value in zip(self.sensor_list, values):
+            if svalue.watch:
+                svalue.set(value)
+            else:
+                svalue.value = value
+                svalue.generation += 1
 
         # count down to alignment
         if self.alignmentCounter.value != self.last_alignmentCounter:
             self.alignmentPose = [0, 0, 0, 0]
 
         if self.alignmentCounter.value > 0:
-            self.alignmentPose = list(map(lambda x, y: x + y, self.alignmentPose, p_aligned))
+            self.alignmentPose = [x + y for x, y in zip(self.alignmentPose, p_aligned)]
             self.alignmentCounter.set(self.alignmentCounter.value-1)
 
             if self.alignmentCounter.value == 0:
@@ -245,6 +318,9 @@ class BoatIMU(object):
             self.heading_off.last = self.heading_off.value
             self.alignmentQ.last = self.alignmentQ.value
 
+        self.timing.read_cpu += time.thread_time() - cpu
+        return data
+
 def boatimu_main():
     print('Version:', cypilot.pilot_path.STRVERSION)
     from server import cypilotServer
@@ -257,9 +333,8 @@ def boatimu_main():
         t0 = time.monotonic()
         server.poll()
         client.poll()
-        boatimu.read()
-        data = boatimu.imu.getIMUData()
-        if t0-lastprint > 1:
+        data = boatimu.read()
+        if data and t0-lastprint > 1:
             # pylint: disable=consider-using-f-string
             print(' Gyro (rad/sec): {:0.3f}, {:0.3f}, {:0.3f}'.format(*data['gyro']))
             print(' FusionQPose: {:0.3f}, {:0.3f}, {:0.3f}, {:0.3f}'.format(*data['fusionQPose']))
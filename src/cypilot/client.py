@@ -95,6 +95,8 @@ class ClientValues(Value):
             print('warning, registering existing value:', value.name)
         self.wvalues[value.name] = value.info
         self.values[value.name] = value
+        if self.watch: # registered after the server watched the list (pilots loaded later)
+            self.client.send('values=' + self.get_msg() + '\n')
 
     def get_msg(self):
         ret = pyjson.dumps(self.wvalues)
@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""CysPWR servo controller emulator on a pseudo-terminal
+
+Implements the controller side of the ArduinoServo packet protocol (4 bytes
+packets: code, 16 bits value, CRC8): sync, command, angle, parameters, eeprom
+read and write, and telemetry of current, voltage, temperatures, rudder and
+flags. The motor drives a ram and rudder model, faults may be injected to
+exercise the error handling of servo.Servo without the motor controller.
+
+    python cyspwr_emulator.py [LINK]          run the emulator, LINK is a symlink to its pty (default /tmp/cyspwr),
+                                              to be set as the servo device in cypilot_serial.conf
+    python cyspwr_emulator.py soak [SECONDS]  Servo.poll soak test with the faults injected in sequence
+"""
+
+import os
+import sys
+import tty
+import time
+import math
+import select
+import threading
+
+import cypilot.pilot_path # pylint: disable=unused-import
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+# packets received by the controller, see arduino_servo.cpp
+ANGLE_CODE = 0xc9
+COMMAND_CODE = 0xc7
+RESET_CODE = 0xe7
+MAX_CURRENT_CODE = 0x1e
+MAX_CONTROLLER_TEMP_CODE = 0xa4
+MAX_MOTOR_TEMP_CODE = 0x5a
+RUDDER_RANGE_CODE = 0xb6
+RUDDER_MIN_CODE = 0x2b
+RUDDER_MAX_CODE = 0x4d
+REPROGRAM_CODE = 0x19
+DISENGAGE_CODE = 0x68
+MAX_SLEW_CODE = 0x71
+EEPROM_READ_CODE = 0x91
+EEPROM_WRITE_CODE = 0x53
+
+# packets sent by the controller
+CURRENT_CODE = 0x1c
+VOLTAGE_CODE = 0xb3
+CONTROLLER_TEMP_CODE = 0xf9
+MOTOR_TEMP_CODE = 0x48
+RUDDER_SENSE_CODE = 0xa7
+FLAGS_CODE = 0x8f
+EEPROM_VALUE_CODE = 0x9a
+VERSION_CODE = 0x88
+
+# controller flags, see servo.ServoFlags
+SYNC = 1
+OVERTEMP_FAULT = 2
+OVERCURRENT_FAULT = 4
+ENGAGED = 8
+INVALID = 16
+BADVOLTAGE_FAULT = 128
+MIN_RUDDER_FAULT = 256
+MAX_RUDDER_FAULT = 512
+
+FAULTS = ['overcurrent', # current above max_current, cleared by the servo reset
+          'overtemp', # controller and motor 40 degrees hotter
+          'badvoltage', # supply at 8V
+          'driver_timeout', # motor disconnected, no current drawn
+          'no_rudder', # rudder sensor not connected
+          'crc', # one of 8 telemetry packets corrupted
+          'silent', # no telemetry
+          'nosync', # received packets ignored, never synchronized
+          'hangup'] # pty closed, the servo loses the device
+
+VERSION = 3, 10 # firmware major, minor
+EEPROM_SIZE = 32
+TELEMETRY_RATE = 200 # packets/s
+SYNC_TIMEOUT = 1 # seconds without valid packet before losing sync
+COMMAND_TIMEOUT = 1 # seconds without command before stopping the motor
+RAW_SCALE = 65472.0 # rudder raw value for the -0.5 to 0.5 range
+
+# telemetry order, current at every other packet like the firmware
+TELEMETRY = ['current', 'voltage', 'current', 'rudder', 'current', 'flags', 'current', 'controller_temp',
+             'current', 'eeprom', 'current', 'rudder', 'current', 'flags', 'current', 'motor_temp',
+             'current', 'eeprom', 'current', 'version']
+
+
+def crc8_table(poly=0x31):
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc << 1 ^ poly if crc & 0x80 else crc << 1) & 0xff
+        table.append(crc)
+    return bytes(table)
+
+CRC8_TABLE = crc8_table()
+
+def crc8(data):
+    crc = 0xff
+    for b in data:
+        crc = CRC8_TABLE[crc ^ b]
+    return crc
+
+def servo_packet(code, value):
+    data = bytes([code, value & 0xff, value >> 8 & 0xff])
+    return data + bytes([crc8(data)])
+
+def frombase255(x):
+    return (x >> 8) * 255 + (x & 0xff)
+
+
+class RudderModel(object):
+    """RudderModel : ram moving the rudder between its mechanical stops, and the
+    current drawn by the motor
+
+    Positions are rudder sensor raw values, -0.5 to 0.5 over the sensor range.
+    """
+    RATE = .1 # raw/s at full speed, 10 degrees/s with the default 100 rudder scale
+    STOP = .45 # mechanical stops
+    SLEW = 4 # speed change per second
+    IDLE_CURRENT = .3 # amps when moving
+    LOAD_CURRENT = 2.5 # amps at full speed
+    HELM_CURRENT = 6 # amps per raw unit of rudder angle
+    STALL_CURRENT = 12 # amps against a stop
+
+    def __init__(self):
+        self.position = 0
+        self.speed = 0 # -1 to 1
+        self.stalled = False
+
+    def step(self, target_speed, dt):
+        """step : move the ram
+
+        Args:
+            target_speed (float): motor command, -1 to 1
+            dt (float): seconds
+
+        Returns:
+            float: motor current (A)
+        """
+        slew = self.SLEW * dt
+        self.speed += min(max(target_speed - self.speed, -slew), slew)
+        position = self.position + self.speed * self.RATE * dt
+        self.position = min(max(position, -self.STOP), self.STOP)
+        self.stalled = bool(self.speed) and position != self.position
+        if not self.speed:
+            return 0
+        if self.stalled:
+            return self.STALL_CURRENT
+        return self.IDLE_CURRENT + self.LOAD_CURRENT * abs(self.speed) + self.HELM_CURRENT * abs(self.position)
+
+
+class CysPWREmulator(object):
+    """CysPWREmulator : controller side of the servo protocol on a pty
+
+    Args:
+        rate (int): telemetry packets/s
+    """
+    def __init__(self, rate=TELEMETRY_RATE):
+        self.rate = rate
+        self.model = RudderModel()
+        self.eeprom = bytearray(b'\xff' * EEPROM_SIZE) # blank, written by the driver at first connection
+        self.faults = set()
+        self.running = False
+        self.master = None
+        self.path = None
+
+        # statistics
+        self.packets_in = 0
+        self.packets_out = 0
+        self.crc_errors = 0
+        self.commands = 0
+        self.eeprom_writes = 0
+        self.connections = 0
+        self.amp_hours = 0 # motor consumption
+
+    def open(self):
+        """open : new pty, the controller state is reset, the eeprom is kept
+
+        Returns:
+            string: path of the pty to open as servo device
+        """
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.path = os.ttyname(slave)
+        self.slave = slave
+        self.in_buf = bytearray()
+        self.in_sync_count = 0
+        self.last_valid = self.last_command = 0
+        self.flags = 0
+        self.command = 0 # motor speed -1 to 1
+        self.angle = None # rudder raw position command
+        self.max_current = 60
+        self.max_controller_temp = self.max_motor_temp = 70
+        self.rudder_min, self.rudder_max = -.5, .5
+        self.current = self.voltage = 0
+        self.controller_temp = self.motor_temp = 25
+        self.eeprom_read = self.eeprom_end = 0
+        self.out_sync = 0
+        self.connections += 1
+        return self.path
+
+    def close(self):
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+
+    def inject(self, fault, active=True):
+        if fault not in FAULTS:
+            raise ValueError('unknown fault ' + fault)
+        if active:
+            self.faults.add(fault)
+        else:
+            self.faults.discard(fault)
+
+    def receive(self, data, t):
+        # packets are searched byte by byte like the driver does
+        buf = self.in_buf
+        buf += data
+        while len(buf) >= 4:
+            if crc8(buf[:3]) != buf[3]:
+                self.crc_errors += 1
+                if self.flags & SYNC:
+                    self.flags |= INVALID
+                self.in_sync_count = 0
+                del buf[:1]
+                continue
+            code, value = buf[0], buf[1] | buf[2] << 8
+            del buf[:4]
+            self.packets_in += 1
+            if 'nosync' in self.faults:
+                continue
+            self.last_valid = t
+            if self.in_sync_count < 2:
+                self.in_sync_count += 1
+                continue
+            self.flags |= SYNC
+            self.process(code, value, t)
+
+    def process(self, code, value, t):
+        if code == COMMAND_CODE:
+            self.commands += 1
+            self.last_command = t
+            self.angle = None
+            self.command = (value - 1000) / 1000.0
+            self.flags |= ENGAGED
+        elif code == ANGLE_CODE:
+            self.commands += 1
+            self.last_command = t
+            self.angle = value / RAW_SCALE - .5
+            self.flags |= ENGAGED
+        elif code == DISENGAGE_CODE:
+            self.command = 0
+            self.angle = None
+            self.flags &= ~ENGAGED
+        elif code == RESET_CODE:
+            self.flags &= ~(OVERCURRENT_FAULT | INVALID)
+        elif code == MAX_CURRENT_CODE:
+            self.max_current = frombase255(value) / 100.0
+        elif code == MAX_CONTROLLER_TEMP_CODE:
+            self.max_controller_temp = frombase255(value) / 100.0
+        elif code == MAX_MOTOR_TEMP_CODE:
+            self.max_motor_temp = frombase255(value) / 100.0
+        elif code == RUDDER_MIN_CODE:
+            self.rudder_min = value / RAW_SCALE - .5
+        elif code == RUDDER_MAX_CODE:
+            self.rudder_max = value / RAW_SCALE - .5
+        elif code == EEPROM_READ_CODE:
+            if self.eeprom_read == self.eeprom_end: # previous read completed
+                self.eeprom_read = value & 0xff
+                self.eeprom_end = min(value >> 8, EEPROM_SIZE)
+        elif code == EEPROM_WRITE_CODE:
+            addr = value & 0xff
+            if addr < EEPROM_SIZE:
+                self.eeprom[addr] = value >> 8
+                self.eeprom_writes += 1
+
+    def step(self, t, dt):
+        """step : motor, rudder and faults over dt seconds
+        """
+        if t - self.last_valid > SYNC_TIMEOUT:
+            self.flags &= ~SYNC
+        if t - self.last_command > COMMAND_TIMEOUT:
+            self.command = 0
+            self.angle = None
+            self.flags &= ~ENGAGED
+
+        speed = self.command
+        if self.angle is not None:
+            error = self.angle - self.model.position
+            speed = min(max(error * 20, -1), 1) if abs(error) > 1e-3 else 0
+
+        flags = self.flags & ~(MIN_RUDDER_FAULT | MAX_RUDDER_FAULT | BADVOLTAGE_FAULT)
+        if 'no_rudder' not in self.faults:
+            if self.model.position >= self.rudder_max:
+                flags |= MAX_RUDDER_FAULT
+            if self.model.position <= self.rudder_min:
+                flags |= MIN_RUDDER_FAULT
+        if flags & MAX_RUDDER_FAULT and speed > 0 or flags & MIN_RUDDER_FAULT and speed < 0:
+            speed = 0
+
+        self.voltage = 8 if 'badvoltage' in self.faults else 12.8 - .05 * self.current
+        if self.voltage < 9:
+            flags |= BADVOLTAGE_FAULT
+        if flags & (OVERCURRENT_FAULT | OVERTEMP_FAULT | BADVOLTAGE_FAULT) or not flags & ENGAGED:
+            speed = 0
+
+        if 'driver_timeout' in self.faults:
+            self.model.step(0, dt)
+            self.current = 0
+        else:
+            self.current = self.model.step(speed, dt)
+        if 'overcurrent' in self.faults and speed:
+            self.current = self.max_current + 2
+        if self.current > self.max_current:
+            flags |= OVERCURRENT_FAULT
+        self.amp_hours += self.current * dt / 3600
+
+        # first order heating, 1 minute time constant
+        lp = dt / 60
+        self.controller_temp += lp * (25 + .2 * self.current**2 - self.controller_temp)
+        self.motor_temp += lp * (25 + .4 * self.current**2 - self.motor_temp)
+        hot = 40 if 'overtemp' in self.faults else 0
+        if self.controller_temp + hot > self.max_controller_temp or self.motor_temp + hot > self.max_motor_temp:
+            flags |= OVERTEMP_FAULT
+        else:
+            flags &= ~OVERTEMP_FAULT
+        self.flags = flags
+
+    def telemetry(self):
+        item = TELEMETRY[self.out_sync % len(TELEMETRY)]
+        self.out_sync += 1
+        hot = 40 if 'overtemp' in self.faults else 0
+        if item == 'current':
+            return servo_packet(CURRENT_CODE, int(round(self.current * 100)))
+        if item == 'voltage':
+            return servo_packet(VOLTAGE_CODE, int(round(self.voltage * 100)))
+        if item == 'controller_temp':
+            return servo_packet(CONTROLLER_TEMP_CODE, int(round((self.controller_temp + hot) * 100)) & 0xffff)
+        if item == 'motor_temp':
+            return servo_packet(MOTOR_TEMP_CODE, int(round((self.motor_temp + hot) * 100)) & 0xffff)
+        if item == 'rudder':
+            if 'no_rudder' in self.faults:
+                return servo_packet(RUDDER_SENSE_CODE, 65535)
+            return servo_packet(RUDDER_SENSE_CODE, int(round((self.model.position + .5) * RAW_SCALE)))
+        if item == 'flags':
+            flags = self.flags
+            self.flags &= ~INVALID # reported once
+            return servo_packet(FLAGS_CODE, flags)
+        if item == 'version':
+            return servo_packet(VERSION_CODE, VERSION[0] << 8 | VERSION[1])
+        if self.eeprom_read < self.eeprom_end:
+            addr = self.eeprom_read
+            self.eeprom_read += 1
+            return servo_packet(EEPROM_VALUE_CODE, self.eeprom[addr] << 8 | addr)
+        return servo_packet(CURRENT_CODE, int(round(self.current * 100)))
+
+    def run(self, duration=None):
+        """run : serve the pty until stopped, hung up or after duration seconds
+        """
+        self.running = True
+        period = 1.0 / self.rate
+        t0 = last = next_out = time.monotonic()
+        while self.running and (duration is None or last - t0 < duration):
+            if 'hangup' in self.faults:
+                print('cyspwr emulator hangup', self.path)
+                self.faults.discard('hangup')
+                self.close()
+                break
+            ready, _, _ = select.select([self.master], [], [], max(next_out - time.monotonic(), 0))
+            t = time.monotonic()
+            if ready:
+                self.receive(os.read(self.master, 1024), t)
+            if t < next_out:
+                continue
+            self.step(t, t - last)
+            last = t
+            next_out = max(next_out + period, t - period)
+            if 'silent' in self.faults:
+                continue
+            packet = self.telemetry()
+            if 'crc' in self.faults and self.out_sync % 8 == 0:
+                packet = packet[:3] + bytes([packet[3] ^ 0x55])
+            try:
+                os.write(self.master, packet)
+            except BlockingIOError:
+                continue
+            self.packets_out += 1
+        self.running = False
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='cyspwr emulator', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def status(self):
+        return {'flags': self.flags, 'command': round(self.command, 3), 'rudder': round(self.model.position, 4),
+                'current': round(self.current, 2), 'voltage': round(self.voltage, 2),
+                'controller_temp': round(self.controller_temp, 1), 'motor_temp': round(self.motor_temp, 1),
+                'packets_in': self.packets_in, 'packets_out': self.packets_out, 'crc_errors': self.crc_errors,
+                'commands': self.commands, 'eeprom_writes': self.eeprom_writes, 'faults': sorted(self.faults)}
+
+
+# faults injected by the soak test, from and to fractions of its duration
+SOAK_FAULTS = [(.15, .25, 'overcurrent'), (.3, .4, 'driver_timeout'), (.45, .5, 'crc'),
+               (.55, .6, 'no_rudder'), (.65, .75, 'overtemp'), (.8, .8, 'hangup')]
+
+def servo_soak(duration=60, period=.01):
+    """servo_soak : Servo polled against the emulator while faults are injected
+
+    Args:
+        duration (float): seconds
+        period (float): Servo.poll period
+
+    Returns:
+        dict: poll timing, servo flags seen, driver losses and emulator statistics
+    """
+    from server import cypilotServer
+    from client import cypilotClient
+    from sensors import Sensors
+    from servo import Servo, ServoFlags, servo_telemetry_stats
+    import numpy as np
+
+    server = cypilotServer()
+    client = cypilotClient(server)
+    sensors = Sensors(client)
+    servo = Servo(client, sensors)
+    servo.force_engaged = True
+
+    emulator = CysPWREmulator()
+    emulator.open()
+    thread = emulator.start()
+
+    flags_seen = ServoFlags('soak.flags')
+    injected = set()
+    records = []
+    losses = polls = 0
+    poll_times = []
+    t0 = time.monotonic()
+    while True:
+        t = time.monotonic() - t0
+        if t > duration:
+            break
+        for start, end, fault in SOAK_FAULTS:
+            if start < end:
+                emulator.inject(fault, start * duration <= t <= end * duration)
+            elif t >= start * duration and fault not in injected: # once
+                injected.add(fault)
+                emulator.inject(fault)
+
+        if not servo.driver:
+            if not thread.is_alive():
+                losses += 1
+                emulator.open()
+                thread = emulator.start()
+            servo.open_driver(emulator.path, 38400)
+
+        # sweep the rudder with speed commands, then position commands
+        if int(t / 10) % 2:
+            servo.position_command.set(20 * math.sin(t / 3))
+        else:
+            servo.command.set(math.sin(t))
+
+        p0 = time.monotonic()
+        servo.poll()
+        sensors.poll()
+        poll_times.append(time.monotonic() - p0)
+        client.poll()
+        server.poll()
+        polls += 1
+        flags_seen.value |= servo.flags.value
+        if polls % 100 == 0:
+            records.append(servo.drain())
+        time.sleep(period)
+
+    emulator.stop()
+    thread.join()
+    emulator.close()
+    poll_times.sort()
+    return {'polls': polls, 'poll_rate': round(polls / duration, 1),
+            'poll_ms': round(sum(poll_times) / len(poll_times) * 1000, 3),
+            'poll_max_ms': round(poll_times[-1] * 1000, 3),
+            'flags': flags_seen.get_str(), 'faults': servo.faults.value, 'losses': losses,
+            'connections': emulator.connections, 'amp_hours': round(servo.amphours.value, 5),
+            'emulator_amp_hours': round(emulator.amp_hours, 5),
+            'short_writes': servo.short_writes.value, 'dropped_packets': servo.dropped_packets.value,
+            'packet_errors': servo.packet_errors.value, 'telemetry_overruns': servo.telemetry_overruns.value,
+            'telemetry': servo_telemetry_stats(np.concatenate([r for r in records if r is not None])),
+            'emulator': emulator.status()}
+
+def cyspwr_emulator_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) > 1 and sys.argv[1] == 'soak':
+        report = servo_soak(float(sys.argv[2]) if len(sys.argv) > 2 else 60)
+        for name, value in report.items():
+            print(name, value)
+        return
+
+    from kbhit import KBHit
+    link = sys.argv[1] if len(sys.argv) > 1 else '/tmp/cyspwr'
+    emulator = CysPWREmulator()
+    path = emulator.open()
+    if os.path.islink(link):
+        os.unlink(link)
+    os.symlink(path, link)
+    print('cyspwr emulator on', path, 'linked as', link)
+    keys = dict(zip('otvdrcsnh', FAULTS))
+    print('keys: ' + ', '.join(k + ' ' + fault for k, fault in keys.items()) + ', space status, q quit')
+
+    thread = emulator.start()
+    kb = KBHit()
+    while thread.is_alive():
+        if kb.kbhit():
+            k = kb.getch()
+            if k == 'q':
+                break
+            if k in keys:
+                fault = keys[k]
+                emulator.inject(fault, fault not in emulator.faults)
+                print('faults', sorted(emulator.faults))
+            else:
+                print(emulator.status())
+        time.sleep(.05)
+    emulator.stop()
+    thread.join()
+    emulator.close()
+    os.unlink(link)
+
+if __name__ == '__main__':
+    cyspwr_emulator_main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""derived values are recomputed only when one of their inputs changed
+
+Each Value counts the number of times it has been set (Value.generation).
+A DerivedNode records the generations of its inputs when it is computed and
+skips the computation as long as none of them has moved.
+Computations should publish their results with Value.update() so that an
+unchanged result is neither sent to watchers nor seen as a change by the
+nodes depending on it.
+"""
+
+import cypilot.pilot_path # pylint: disable=unused-import
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+
+class DerivedNode(object):
+    """DerivedNode : computation depending on a list of inputs
+
+    Args:
+        name (string): node name
+        compute (function): computation, called without argument
+        inputs (list): Value or DerivedNode objects the computation depends on
+    """
+    def __init__(self, name, compute, inputs):
+        self.name = name
+        self.compute = compute
+        self.inputs = list(inputs)
+        self.generation = 0 # number of computations, allows nodes to depend on nodes
+        self.last = None # input generations at last computation
+
+    def invalidate(self):
+        """invalidate : force computation on next evaluation
+        """
+        self.last = None
+
+    def evaluate(self):
+        """evaluate : compute node if any input changed since last computation
+
+        Returns:
+            bool: True if the node was computed
+        """
+        state = tuple(item.generation for item in self.inputs)
+        if state == self.last:
+            return False
+        self.last = state
+        self.compute()
+        self.generation += 1
+        return True
+
+
+class DerivedValues(object):
+    """DerivedValues : ordered set of derived nodes
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.computed = 0
+        self.skipped = 0
+
+    def add(self, name, compute, inputs):
+        """add : add a node, nodes must be added after the nodes they depend on
+
+        Args:
+            name (string): node name
+            compute (function): computation, called without argument
+            inputs (list): Value or DerivedNode objects the computation depends on
+
+        Returns:
+            DerivedNode: the new node
+        """
+        if name in self.nodes:
+            print('warning, replacing derived node:', name)
+        node = DerivedNode(name, compute, inputs)
+        self.nodes[name] = node
+        return node
+
+    def invalidate(self):
+        """invalidate : force computation of all nodes on next evaluation
+        """
+        for node in self.nodes.values():
+            node.invalidate()
+
+    def evaluate(self, *names):
+        """evaluate : evaluate the given nodes in the order of the names, or all
+        nodes in insertion order if no name is given
+
+        Args:
+            names (string): nodes to evaluate
+        """
+        nodes = [self.nodes[name] for name in names] if names else self.nodes.values()
+        for node in nodes:
+            if node.evaluate():
+                self.computed += 1
+            else:
+                self.skipped += 1
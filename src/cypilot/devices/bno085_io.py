@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+#
+#   Copyright (C):
+#           2021 Cybele Services (for use with cyPilot / CysBOX / CysPWR)
+#
+# Published under MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+"""
+`bno085_io`
+================================================================================
+
+Bus and interrupt line of the BNO08X, and a replay device for tests
+
+BNO08X_I2C sends and receives SHTP packets through a bus (write, readinto) and
+waits for reports on an interrupt line (wait, asserted). The INT pin of the
+BNO08X is low while the device has a packet for the host, so packets are read
+when the line is asserted instead of polling packet headers.
+
+ShtpReplay is both a bus and an interrupt line: it answers the initialization
+requests like a BNO08X and delivers recorded (or synthetic) sensor packets.
+
+    python bno085_io.py record FILE [SECONDS] [RATE]   record sensor packets of the BNO08X
+    python bno085_io.py replay FILE|synthetic [RATE]    read packets through BNO08X_I2C, with and without interrupt
+    python bno085_io.py bench FILE|synthetic            decode time per packet, struct decoder vs report slices
+"""
+
+import abc
+import sys
+import time
+import math
+import json
+import select
+import struct
+import threading
+import collections
+
+import cypilot.pilot_path # pylint: disable=unused-import
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+SHTP_HEADER = struct.Struct('<HBB')
+
+_CHANNEL_CONTROL = 2
+_CHANNEL_INPUT_SENSOR_REPORTS = 3
+_PRODUCT_ID_REQUEST = 0xF9
+_PRODUCT_ID_RESPONSE = 0xF8
+_SET_FEATURE_COMMAND = 0xFD
+_GET_FEATURE_RESPONSE = 0xFC
+
+
+class ShtpBus(abc.ABC):
+    """ShtpBus : transport of SHTP packets"""
+
+    @abc.abstractmethod
+    def write(self, buffer, end):
+        """Write buffer[:end] to the device"""
+
+    @abc.abstractmethod
+    def readinto(self, buffer, end):
+        """Read end bytes from the device into buffer"""
+
+
+class I2CBus(ShtpBus):
+    """I2CBus : SHTP packets over I2C"""
+
+    def __init__(self, i2c, address):
+        from adafruit_bus_device.i2c_device import I2CDevice
+        self.device = I2CDevice(i2c, address)
+
+    def write(self, buffer, end):
+        with self.device as i2c:
+            i2c.write(buffer, end=end)
+
+    def readinto(self, buffer, end):
+        with self.device as i2c:
+            i2c.readinto(buffer, end=end)
+
+
+class InterruptLine(abc.ABC):
+    """InterruptLine : interrupt output of the device, asserted while a packet is pending"""
+
+    @abc.abstractmethod
+    def asserted(self):
+        """True while the line is asserted"""
+
+    @abc.abstractmethod
+    def wait(self, timeout):
+        """Wait until the line is asserted
+
+        Returns:
+            bool: False on timeout
+        """
+
+    def close(self):
+        pass
+
+
+class ChardevInterrupt(InterruptLine):
+    """ChardevInterrupt : falling edge events of a GPIO character device line (libgpiod v1)"""
+
+    def __init__(self, pin, chip='gpiochip0'):
+        import gpiod
+        self.chip = gpiod.Chip(chip)
+        self.line = self.chip.get_line(pin)
+        self.line.request(consumer='cypilot', type=gpiod.LINE_REQ_EV_FALLING_EDGE,
+                          flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+        self.poller = select.poll()
+        self.poller.register(self.line.event_fd(), select.POLLIN)
+
+    def fileno(self):
+        return self.line.event_fd()
+
+    def asserted(self):
+        return self.line.get_value() == 0
+
+    def wait(self, timeout):
+        if self.asserted():
+            return True
+        # edges are queued by the kernel, none is lost between the test and the poll
+        while self.poller.poll(int(timeout * 1000)):
+            self.line.event_read()
+            timeout = 0
+        return self.asserted()
+
+    def close(self):
+        self.line.release()
+        self.chip.close()
+
+
+class GPIOInterrupt(InterruptLine):
+    """GPIOInterrupt : falling edge detection of RPi.GPIO"""
+
+    def __init__(self, pin):
+        import RPi.GPIO as gpio
+        self.gpio = gpio
+        self.pin = pin
+        self.edge = threading.Event()
+        gpio.setmode(gpio.BCM)
+        gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+        gpio.add_event_detect(pin, gpio.FALLING, callback=lambda channel: self.edge.set())
+
+    def asserted(self):
+        return self.gpio.input(self.pin) == 0
+
+    def wait(self, timeout):
+        if self.asserted():
+            return True
+        # clear before testing again, an edge in between sets the event
+        self.edge.clear()
+        if not self.asserted():
+            self.edge.wait(timeout)
+        return self.asserted()
+
+    def close(self):
+        self.gpio.remove_event_detect(self.pin)
+
+
+def open_interrupt(pin):
+    """open_interrupt : interrupt line on a GPIO pin, character device first
+
+    Returns:
+        InterruptLine: the line, or None if no GPIO access is available (polling)
+    """
+    for line_type in [ChardevInterrupt, GPIOInterrupt]:
+        try:
+            return line_type(pin)
+        except Exception as e: # pylint: disable=broad-except
+            print('BNO08X interrupt', line_type.__name__, 'not available:', e)
+    return None
+
+
+def shtp_packet(channel, sequence, payload):
+    """shtp_packet : header and payload of a SHTP packet"""
+    return SHTP_HEADER.pack(len(payload) + 4, channel, sequence) + bytes(payload)
+
+
+class ShtpReplay(ShtpBus, InterruptLine):
+    """ShtpReplay : fake BNO08X for tests
+
+    Answers the product id request and set feature commands, then delivers
+    sensor packets once the first feature is enabled, at their recorded times
+    if realtime, else one per read.
+
+    Args:
+        packets (list): (seconds, packet bytes) sensor packets
+        realtime (bool): deliver packets at their recorded times
+    """
+
+    def __init__(self, packets, realtime=True):
+        self.packets = packets
+        self.realtime = realtime
+        self.pending = collections.deque() # packets the host can read
+        self.index = 0
+        self.start = None
+        self.sequence = [0] * 6
+        self.reads = 0 # I2C read transactions
+        self.writes = 0
+        self.polls = 0 # interrupt line tests and waits
+
+    def done(self):
+        return self.index >= len(self.packets) and not self.pending
+
+    def due(self):
+        # move sensor packets due by now to the pending packets
+        if self.start is None:
+            return
+        if not self.realtime:
+            if not self.pending and self.index < len(self.packets):
+                self.pending.append(self.packets[self.index][1])
+                self.index += 1
+            return
+        t = time.monotonic() - self.start
+        while self.index < len(self.packets) and self.packets[self.index][0] <= t:
+            self.pending.append(self.packets[self.index][1])
+            self.index += 1
+
+    def respond(self, channel, payload):
+        self.pending.append(shtp_packet(channel, self.sequence[channel], payload))
+        self.sequence[channel] = (self.sequence[channel] + 1) % 256
+
+    def write(self, buffer, end):
+        self.writes += 1
+        channel, data = buffer[2], bytes(buffer[4:end])
+        if channel != _CHANNEL_CONTROL or not data:
+            return
+        if data[0] == _PRODUCT_ID_REQUEST:
+            # reset cause, version 3.2.7, part number, build
+            self.respond(channel, struct.pack('<BBBBIIHH', _PRODUCT_ID_RESPONSE, 1, 3, 2, 10004563, 7, 7, 0))
+        elif data[0] == _SET_FEATURE_COMMAND:
+            self.respond(channel, bytes([_GET_FEATURE_RESPONSE]) + data[1:17])
+            if self.start is None:
+                self.start = time.monotonic()
+
+    def readinto(self, buffer, end):
+        self.reads += 1
+        self.due()
+        if not self.pending:
+            buffer[0:4] = b'\x00\x00\x00\x00'
+            return
+        packet = self.pending[0]
+        n = min(end, len(packet))
+        buffer[0:n] = packet[:n]
+        if end >= len(packet):
+            self.pending.popleft()
+
+    def asserted(self):
+        self.polls += 1
+        self.due()
+        return bool(self.pending)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.asserted():
+            if not self.realtime:
+                return False
+            if self.start is None or self.index >= len(self.packets):
+                # nothing to deliver, time out like the INT line
+                time.sleep(timeout)
+                return False
+            dt = min(self.start + self.packets[self.index][0], deadline) - time.monotonic()
+            if dt <= 0 and time.monotonic() >= deadline:
+                return False
+            time.sleep(max(dt, 0))
+        return True
+
+
+def synthetic_packets(rate=10, seconds=10):
+    """synthetic_packets : input sensor report packets of a boat turning slowly and rolling
+
+    Each packet holds a base timestamp, accelerometer, gyroscope and rotation vector
+    report, like the batches of the BNO08X.
+
+    Returns:
+        list: (seconds, packet bytes)
+    """
+    packets = []
+    sequence = 0
+    for i in range(int(rate * seconds)):
+        t = i / rate
+        heading = math.radians(3 * t) # 3 deg/s
+        roll = math.radians(10) * math.sin(2 * math.pi * t / 4)
+        rollrate = math.radians(10) * 2 * math.pi / 4 * math.cos(2 * math.pi * t / 4)
+        cr, sr, ch, sh = math.cos(roll / 2), math.sin(roll / 2), math.cos(heading / 2), math.sin(heading / 2)
+        q = (cr * ch, sr * ch, -sr * sh, cr * sh) # real, i, j, k
+        payload = struct.pack('<BI', 0xFB, 100) # base timestamp, 100us ago
+        payload += struct.pack('<BBBBhhh', 0x01, i % 256, 3, 0,
+                               0, int(9.81 * math.sin(roll) * 256), int(9.81 * math.cos(roll) * 256))
+        payload += struct.pack('<BBBBhhh', 0x02, i % 256, 3, 0,
+                               int(rollrate * 512), 0, int(math.radians(3) * 512))
+        payload += struct.pack('<BBBBhhhhh', 0x05, i % 256, 3, 0,
+                               int(q[1] * 16384), int(q[2] * 16384), int(q[3] * 16384), int(q[0] * 16384), int(.05 * 4096))
+        packets.append((t, shtp_packet(_CHANNEL_INPUT_SENSOR_REPORTS, sequence, payload)))
+        sequence = (sequence + 1) % 256
+    return packets
+
+
+def load_packets(filename):
+    """load_packets : read packets recorded by bno085_record
+
+    Returns:
+        list: (seconds, packet bytes)
+    """
+    packets = []
+    with open(filename) as f:
+        for line in f:
+            t, data = json.loads(line)
+            packets.append((t, bytes.fromhex(data)))
+    return packets
+
+
+def bno085_record(filename, seconds=30, rate=10):
+    from adafruit_extended_bus import ExtendedI2C as I2C
+    from devices.cypilot_bno085 import BNO08X_I2C
+    from devices.pilot_imu import I2C_DEFAULT_BUS
+
+    bno = BNO08X_I2C(I2C(I2C_DEFAULT_BUS), rate=rate)
+    t0 = time.monotonic()
+    with open(filename, 'w') as f:
+        def record(packet):
+            if packet[2] == _CHANNEL_INPUT_SENSOR_REPORTS:
+                f.write(json.dumps([round(time.monotonic() - t0, 6), packet.hex()]) + '\n')
+        bno.recorder = record
+        while time.monotonic() - t0 < seconds:
+            bno.getIMUData()
+    print('recorded', filename)
+
+
+def bno085_replay(packets, rate=10):
+    """bno085_replay : read packets through BNO08X_I2C with the interrupt line and by polling
+
+    Returns:
+        dict: mode -> (samples, I2C reads, interrupt polls, seconds)
+    """
+    from devices.cypilot_bno085 import BNO08X_I2C
+
+    results = {}
+    for mode in ['interrupt', 'polling']:
+        replay = ShtpReplay(packets)
+        bno = BNO08X_I2C(None, rate=rate, bus=replay, interrupt=replay if mode == 'interrupt' else False)
+        reads, polls = replay.reads, replay.polls
+        t0 = time.monotonic()
+        samples = 0
+        while not replay.done():
+            bno.getIMUData()
+            samples += 1
+        results[mode] = samples, replay.reads - reads, replay.polls - polls, time.monotonic() - t0
+        print(f'{mode:10s} {samples} samples, {(replay.reads - reads) / samples:.2f} I2C reads/sample')
+    return results
+
+
+def bno085_bench(packets, repeat=20):
+    """bno085_bench : decode the packets with the precompiled struct decoder and with
+    the report slice parser, check both give the same readings
+
+    Returns:
+        dict: decoder -> microseconds per packet
+    """
+    from devices.cypilot_bno085 import BNO08X_I2C, Packet
+
+    replay = ShtpReplay([], realtime=False)
+    bno = BNO08X_I2C(None, bus=replay, interrupt=False)
+    buffer = bytearray(max(len(packet) for __, packet in packets))
+
+    results = {}
+    readings = {}
+    for name, handle in [('slices', bno._handle_packet_slices), ('struct', bno._handle_packet)]: # pylint: disable=protected-access
+        bno._readings = {} # pylint: disable=protected-access
+        t0 = time.perf_counter()
+        for __ in range(repeat):
+            for __, packet in packets:
+                buffer[:len(packet)] = packet
+                handle(Packet(buffer))
+        results[name] = (time.perf_counter() - t0) / (repeat * len(packets)) * 1e6
+        readings[name] = dict(bno._readings), bno.accuracy_estimate # pylint: disable=protected-access
+        print(f'{name:8s} {results[name]:6.1f} us/packet')
+
+    if readings['slices'] != readings['struct']:
+        print('readings differ', readings)
+    else:
+        print(f"struct decoder {results['slices'] / results['struct']:.1f}x faster, same readings")
+    return results
+
+
+def bno085_io_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) >= 3 and sys.argv[1] == 'record':
+        bno085_record(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 30,
+                      int(sys.argv[4]) if len(sys.argv) > 4 else 10)
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'replay':
+        rate = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        packets = synthetic_packets(rate, 5) if sys.argv[2] == 'synthetic' else load_packets(sys.argv[2])
+        bno085_replay(packets, rate)
+    elif len(sys.argv) == 3 and sys.argv[1] == 'bench':
+        bno085_bench(synthetic_packets(10, 10) if sys.argv[2] == 'synthetic' else load_packets(sys.argv[2]))
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    bno085_io_main()
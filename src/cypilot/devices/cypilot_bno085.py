@@ -28,18 +28,17 @@ Helper library for the Hillcrest Laboratories BNO08x IMUs
 
 import time
 
-from struct import unpack_from, pack_into
+from struct import Struct, unpack_from, pack_into
 from collections import namedtuple
 
 from micropython import const
-from adafruit_bus_device.i2c_device import I2CDevice
 
 from quaternion import normalize, toeuler
 
-import RPi.GPIO as gpio
-
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 
+from .bno085_io import I2CBus, open_interrupt
+
 # TODO: Remove on release
 from .debug_bno085 import channels, reports
 
@@ -114,6 +113,8 @@ _QUAT_READ_TIMEOUT = 0.500  # timeout in seconds
 _PACKET_READ_TIMEOUT = 2.000  # timeout in seconds
 _FEATURE_ENABLE_TIMEOUT = 2.0
 _DEFAULT_TIMEOUT = 2.0
+_INTERRUPT_TIMEOUTS = const(5)  # reports found by polling after interrupt timeouts before falling back to polling
+_INTERRUPT_PACKETS = const(10)  # packets read per interrupt wait
 _BNO08X_CMD_RESET = const(0x01)
 _QUAT_Q_POINT = const(14)
 _BNO_HEADER_LEN = const(4)
@@ -184,6 +185,22 @@ _INITIAL_REPORTS = {
     BNO_REPORT_GEOMAGNETIC_ROTATION_VECTOR: (0.0, 0.0, 0.0, 0.0),
 }
 
+# precompiled decoding of the sensor reports read at the autopilot rate:
+# report id -> (Struct of status, values [, accuracy], scalar, report length)
+# status is the byte at offset 2, values start at offset 4, the 16-bit accuracy
+# estimate of the rotation vectors follows the quaternion
+_VECTOR3_REPORT = Struct("<2xBx3h")
+_QUATERNION_REPORT = Struct("<2xBx4hh")
+_SENSOR_DECODERS = {
+    BNO_REPORT_ACCELEROMETER: (_VECTOR3_REPORT, _Q_POINT_8_SCALAR, 10),
+    BNO_REPORT_GYROSCOPE: (_VECTOR3_REPORT, _Q_POINT_9_SCALAR, 10),
+    BNO_REPORT_MAGNETOMETER: (_VECTOR3_REPORT, _Q_POINT_4_SCALAR, 10),
+    BNO_REPORT_LINEAR_ACCELERATION: (_VECTOR3_REPORT, _Q_POINT_8_SCALAR, 10),
+    BNO_REPORT_ROTATION_VECTOR: (_QUATERNION_REPORT, _Q_POINT_14_SCALAR, 14),
+    BNO_REPORT_GEOMAGNETIC_ROTATION_VECTOR: (_QUATERNION_REPORT, _Q_POINT_12_SCALAR, 14),
+}
+_SHTP_HEADER = Struct("<HBB")
+
 _ENABLED_ACTIVITIES = (
     0x1FF  # All activities; 1 bit set for each of 8 activities, + Unknown
 )
@@ -397,7 +414,8 @@ class Packet:
     def __init__(self, packet_bytes):
         self.header = self.header_from_buffer(packet_bytes)
         data_end_index = self.header.data_length + _BNO_HEADER_LEN
-        self.data = packet_bytes[_BNO_HEADER_LEN:data_end_index]
+        # no copy: the data is only valid until the next packet is read into the buffer
+        self.data = memoryview(packet_bytes)[_BNO_HEADER_LEN:data_end_index]
 
     def __str__(self):
 
@@ -453,10 +471,8 @@ class Packet:
     @classmethod
     def header_from_buffer(cls, packet_bytes):
         """Creates a `PacketHeader` object from a given buffer"""
-        packet_byte_count = unpack_from("<H", packet_bytes)[0]
+        packet_byte_count, channel_number, sequence_number = _SHTP_HEADER.unpack_from(packet_bytes)
         packet_byte_count &= ~0x8000
-        channel_number = unpack_from("<B", packet_bytes, offset=2)[0]
-        sequence_number = unpack_from("<B", packet_bytes, offset=3)[0]
         data_length = max(0, packet_byte_count - 4)
 
         header = PacketHeader(
@@ -508,10 +524,15 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         self._id_read = False
         self._frs_status = 0
         self._report_rotation = False
-        self.rate = rate
-        self.report_interval = int((1 / rate)*1000000) # report interval (uS)
-        self.report_timeout = int(self.report_interval/1000 + 20) # report timeout (mS) - irq gpio mode
-        self.report_polling = (1 / rate) / 10 # report polling perod (S) - polling mode
+        self._set_report_rate(rate)
+        self.interrupt = None # InterruptLine, reports are polled without
+        self._interrupt_timeouts = 0
+        # called with each packet read, if set
+        self.recorder = None
+        # host time of the last packet read, and delay of its reports before the interrupt (base timestamp)
+        self._packet_time = 0
+        self._base_delta = 0
+        self._rotation_time = 0
         # for saving the most recent reading when decoding several packets
         self._readings = {}
         self.initialize()
@@ -528,6 +549,19 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         self.enable_feature(BNO_REPORT_ROTATION_VECTOR, self.report_interval)
         self.enable_feature(BNO_REPORT_GYROSCOPE, self.report_interval)
 
+    def _set_report_rate(self, rate):
+        self.rate = rate
+        self.report_interval = int((1 / rate)*1000000) # report interval (uS)
+        self.report_timeout = int(self.report_interval/1000 + 20) # report timeout (mS) - irq gpio mode
+        self.report_polling = (1 / rate) / 10 # report polling perod (S) - polling mode
+
+    def set_rate(self, rate):
+        """Change the rate of the accelerometer, rotation vector and gyroscope reports"""
+        self._set_report_rate(rate)
+        self.enable_feature(BNO_REPORT_ACCELEROMETER, self.report_interval)
+        self.enable_feature(BNO_REPORT_ROTATION_VECTOR, self.report_interval)
+        self.enable_feature(BNO_REPORT_GYROSCOPE, self.report_interval)
+
     def send_command(self, data):
         """Send a packet to device"""
         self._send_packet(_BNO_CHANNEL_CONTROL, data)
@@ -539,34 +573,19 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
     def getIMUData(self):
         """Get IMU Data """
         t0 = time.monotonic()
-        while True:
-            ##############
-            # Begin / TODO: check CysBOX hardware version
-            # IMU interrupt is usable only with CysBOX hardware version >= 3 using buily-in BNO085
-            #
-            # In this case, it's better to wait for gpio edge as follow:
-            # gpio.wait_for_edge(BNO08X_DEFAULT_GPIO, gpio.FALLING, timeout=self.report_timeout)
-            # while gpio.input(BNO08X_DEFAULT_GPIO) == 0:
-            #    self._process_available_packets()
-            #
-            self._processed_count = 0
-            while self._processed_count == 0:
+        self._report_rotation = False
+        while not self._report_rotation:
+            if self.interrupt:
+                self._read_interrupt_packets()
+            else:
+                self._processed_count = 0
                 self._process_available_packets()
-                if self._processed_count != 0:
-                    break
-                else:
+                if self._processed_count == 0:
                     time.sleep(self.report_polling)
-            # End / TODO
-            ############
             tw = time.monotonic() - t0
-            if self._report_rotation is True:
-                # print("IMU - Rotation vector receive, reports number and time : ", self._processed_count, tw)
-                break
-            elif tw > self.report_timeout*2 :
+            if not self._report_rotation and tw > self.report_timeout / 1000 * 2:
                 print("IMU - Error, rotation report timeout : ", tw)
-            else:
-                # print("IMU - Read reports number and time : ", self._processed_count, tw)
-                continue
+                t0 = time.monotonic()
 
         IMUData = {}       
         # acceleration
@@ -582,6 +601,8 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         # euler angles
         x, y, z = toeuler(q)
         IMUData['fusionPose'] = (x, y, z)
+        # monotonic time of the rotation vector
+        IMUData['timestamp'] = self._rotation_time
 
         return IMUData
 
@@ -841,9 +862,34 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         raise RuntimeError("Could not save calibration data")
 
     ############### private/helper methods ###############
+    def _read_interrupt_packets(self):
+        # wait for the interrupt line, then read packets while it is asserted:
+        # no header is read from the bus when no packet is pending
+        if not self.interrupt.wait(self.report_timeout / 1000):
+            self._process_available_packets()
+            if self._processed_count:
+                # packets without interrupt: the line is not wired (CysBOX hardware < 3)
+                self._interrupt_timeouts += 1
+                if self._interrupt_timeouts >= _INTERRUPT_TIMEOUTS:
+                    print("IMU - No interrupt from BNO08X, polling reports")
+                    self.interrupt.close()
+                    self.interrupt = None
+            return
+        self._interrupt_timeouts = 0
+        processed_count = 0
+        while processed_count < _INTERRUPT_PACKETS and self.interrupt.asserted():
+            try:
+                new_packet = self._read_packet()
+            except PacketError:
+                continue
+            if new_packet.header.data_length == 0:
+                break
+            self._handle_packet(new_packet)
+            processed_count += 1
+        self._processed_count = processed_count
+
     # # decorator?
     def _process_available_packets(self, max_packets=None):
-        self._report_rotation = False
         processed_count = 0
         while True:
             if max_packets and processed_count > max_packets:
@@ -895,7 +941,14 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         # print("New packet -> Length, Header channel and sequence : ", header.data_length, header.channel_number, header.sequence_number)
 
     def _handle_packet(self, packet):
-        # split out reports first
+        try:
+            self._decode_batch(packet.data)
+        except Exception as error:
+            print(packet)
+            raise error
+
+    def _handle_packet_slices(self, packet):
+        # split out reports first, then parse each of them (reference decoder, see bno085_io.py bench)
         try:
             _separate_batch(packet, self._packet_slices)
             while self._packet_slices:
@@ -904,6 +957,38 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
             print(packet)
             raise error
 
+    def _decode_batch(self, data):
+        # single pass over the reports of a packet, vector and rotation reports are
+        # decoded in place with their precompiled Struct, others by _process_report
+        readings = self._readings
+        decoders = {} if self._debug else _SENSOR_DECODERS
+        data_length = len(data)
+        index = 0
+        while index < data_length:
+            report_id = data[index]
+            decoder = decoders.get(report_id)
+            report_length = decoder[2] if decoder else _report_length(report_id)
+            if data_length - index < report_length:
+                raise RuntimeError("Unprocessable Batch bytes", data_length - index)
+            if not decoder:
+                self._process_report(report_id, data[index : index + report_length])
+                index += report_length
+                continue
+
+            report, scalar, report_length = decoder
+            if report_length == 10:
+                status, x, y, z = report.unpack_from(data, index)
+                readings[report_id] = (x * scalar, y * scalar, z * scalar)
+                if report_id == BNO_REPORT_MAGNETOMETER:
+                    self._magnetometer_accuracy = status & 0b11
+            else:
+                _status, i, j, k, real, accuracy = report.unpack_from(data, index)
+                readings[report_id] = (i * scalar, j * scalar, k * scalar, real * scalar)
+                self._accuracy_estimate = accuracy * _Q_POINT_12_SCALAR
+                self._report_rotation = True
+                self._rotation_time = self._packet_time - self._base_delta
+            index += report_length
+
     def _handle_control_report(self, report_id, report_bytes):
         if report_id == _SHTP_REPORT_PRODUCT_ID_RESPONSE:
             (
@@ -932,6 +1017,10 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         if report_id == _FRS_WRITE_RESPONSE:
             self._frs_status = report_bytes[1]
 
+        if report_id == _BASE_TIMESTAMP:
+            # 100us ticks before the host interrupt, approximated by the packet read time
+            self._base_delta = unpack_from("<i", report_bytes, offset=1)[0] * 1e-4
+
     def _handle_command_response(self, report_bytes):
         (report_body, response_values) = _parse_command_response(report_bytes)
 
@@ -1001,6 +1090,7 @@ class BNO08X:  # pylint: disable=too-many-instance-attributes, too-many-public-m
         elif report_id == BNO_REPORT_ROTATION_VECTOR or report_id == BNO_REPORT_GEOMAGNETIC_ROTATION_VECTOR:
             self._accuracy_estimate = accuracy
             self._report_rotation = True
+            self._rotation_time = self._packet_time - self._base_delta
         
 
     # TODO: Make this a Packet creation
@@ -1201,34 +1291,34 @@ class BNO08X_I2C(BNO08X):
     """Library for the BNO08x IMUs from Hillcrest Laboratories
 
     :param ~busio.I2C i2c_bus: The I2C bus the BNO08x is connected to.
+    :param bus: SHTP bus, replaces the I2C device (ShtpReplay for tests)
+    :param interrupt: InterruptLine, True for the INT gpio, False to poll reports
 
     """
 
-    def __init__(self, i2c, rate=10, reset=None, address=BNO08X_DEFAULT_ADDRESS, debug=False):
-        self.bus_device_obj = I2CDevice(i2c, address)
+    def __init__(self, i2c, rate=10, reset=None, address=BNO08X_DEFAULT_ADDRESS, debug=False, bus=None, interrupt=True):
+        self.bus = bus or I2CBus(i2c, address)
         super().__init__(reset, rate, debug)
         # activate IMU irq input
-        gpio.setmode(gpio.BCM)
-        gpio.setup(BNO08X_DEFAULT_GPIO, gpio.IN, pull_up_down=gpio.PUD_UP)
+        if interrupt is True:
+            interrupt = open_interrupt(BNO08X_DEFAULT_GPIO)
+        self.interrupt = interrupt or None
 
     def _send_packet(self, channel, data):
         data_length = len(data)
         write_length = data_length + 4
 
-        pack_into("<H", self._data_buffer, 0, write_length)
-        self._data_buffer[2] = channel
-        self._data_buffer[3] = self._sequence_number[channel]
-        for idx, send_byte in enumerate(data):
-            self._data_buffer[4 + idx] = send_byte
-        packet = Packet(self._data_buffer)
-        self._dbg("Sending packet:")
-        self._dbg(packet)
-        # protocol debug:
-        if self.sh_debug:
-            print("Sending packet:")
-            print(packet)
-        with self.bus_device_obj as i2c:
-            i2c.write(self._data_buffer, end=write_length)
+        _SHTP_HEADER.pack_into(self._data_buffer, 0, write_length, channel, self._sequence_number[channel])
+        self._data_buffer[4:write_length] = data
+        if self._debug or self.sh_debug:
+            packet = Packet(self._data_buffer)
+            self._dbg("Sending packet:")
+            self._dbg(packet)
+            # protocol debug:
+            if self.sh_debug:
+                print("Sending packet:")
+                print(packet)
+        self.bus.write(self._data_buffer, write_length)
 
         self._sequence_number[channel] = (self._sequence_number[channel] + 1) % 256
         return self._sequence_number[channel]
@@ -1237,8 +1327,7 @@ class BNO08X_I2C(BNO08X):
     # the sensor will always tell us how much there is, so no need to track it ourselves
 
     def _read_packet(self):
-        with self.bus_device_obj as i2c:
-            i2c.readinto(self._data_buffer, end=4)  # this is expecting a header?
+        self.bus.readinto(self._data_buffer, 4)  # this is expecting a header?
         new_packet = Packet(self._data_buffer)
 
         header = new_packet.header
@@ -1259,11 +1348,13 @@ class BNO08X_I2C(BNO08X):
                     "!!!!!!!!!!!! ALLOCATION: increased _data_buffer to bytearray(%d) !!!!!!!!!!!!! "
                     % header.packet_byte_count
                 )
-            with self.bus_device_obj as i2c:
-                i2c.readinto(self._data_buffer, end=header.packet_byte_count)
+            self.bus.readinto(self._data_buffer, header.packet_byte_count)
+            self._packet_time = time.monotonic()
 
             new_packet = Packet(self._data_buffer)
             self._update_sequence_number(new_packet.header)
+            if self.recorder:
+                self.recorder(bytes(self._data_buffer[:header.packet_byte_count]))
 
             if self.sh_debug and header.channel_number == _BNO_CHANNEL_CONTROL:
                 print("Received packet:")
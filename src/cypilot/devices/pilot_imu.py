@@ -50,6 +50,9 @@ class NOIMU:
         self.rate = rate
         self.readtime = time.monotonic()
 
+    def set_rate(self, rate):
+        self.rate = rate
+
     def getIMUData(self):
         """Get IMU Data """
         now = time.monotonic()
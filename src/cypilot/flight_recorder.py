@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""flight recorder of the autopilot loop
+
+Every autopilot iteration writes a fixed size binary record (IMU, pilot and
+servo values, loop timings) into a memory mapped circular file covering the
+last minutes at full loop rate. Records are written to memory only, the kernel
+writes the pages back to ~/.cypilot/flight_recorder.bin, so recording costs no
+system call in the realtime loop. The file of the previous run is kept as
+flight_recorder.previous.bin for post-mortem analysis after a crash.
+
+A freeze is triggered by a new servo fault or by setting recorder.freeze: the
+recorder goes on for the post trigger time, then the whole window is saved in
+order to ~/.cypilot/flight_recorder/ by the worker thread and recording goes on.
+
+    python flight_recorder.py info FILE          header of a recorder file
+    python flight_recorder.py csv FILE [OUT]     convert records to CSV
+    python flight_recorder.py npy FILE [OUT]     convert records to a numpy structured array
+"""
+
+import os
+import sys
+import csv
+import mmap
+import time
+import struct
+
+import cypilot.pilot_path # pylint: disable=unused-import
+import pyjson
+from pilot_values import BooleanProperty, StringValue
+from servo import ServoFlags
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+from pilot_path import PILOT_DIR
+
+RECORDER_DEFAULT = {'minutes': 10, 'rate': 20, 'post_trigger': 10}
+
+RECORDER_FILE = PILOT_DIR + 'flight_recorder.bin'
+RECORDER_PREVIOUS = PILOT_DIR + 'flight_recorder.previous.bin'
+RECORDER_DIR = PILOT_DIR + 'flight_recorder/'
+
+# record fields and struct codes
+FIELDS = [('time', 'd'), ('imu_time', 'd'),
+          ('heading', 'f'), ('roll', 'f'), ('pitch', 'f'),
+          ('headingrate', 'f'), ('rollrate', 'f'), ('pitchrate', 'f'),
+          ('accel_X', 'f'), ('accel_Y', 'f'), ('accel_Z', 'f'),
+          ('heading_command', 'f'), ('heading_error', 'f'), ('heading_error_int', 'f'),
+          ('servo_command', 'f'), ('servo_raw_command', 'f'), ('servo_position', 'f'),
+          ('rudder', 'f'), ('current', 'f'), ('voltage', 'f'),
+          ('imu_wait', 'f'), ('processing', 'f'),
+          ('servo_flags', 'I'), ('enabled', 'B'), ('engaged', 'B')]
+RECORD = struct.Struct('<' + ''.join(code for __, code in FIELDS))
+
+MAGIC = b'CYPFREC1'
+HEADER_SIZE = 4096 # records start on the second page
+HEADER = struct.Struct('<8sIIQ') # magic, record size, capacity, records written
+COUNT_OFFSET = 16
+META_LENGTH = struct.Struct('<I') # length of the json metadata following HEADER
+
+# servo flags which freeze the recorder when they appear
+FAULT_FLAGS = (ServoFlags.OVERTEMP_FAULT | ServoFlags.OVERCURRENT_FAULT | ServoFlags.BADVOLTAGE_FAULT
+               | ServoFlags.PORT_PIN_FAULT | ServoFlags.STARBOARD_PIN_FAULT
+               | ServoFlags.MIN_RUDDER_FAULT | ServoFlags.MAX_RUDDER_FAULT
+               | ServoFlags.PORT_OVERCURRENT_FAULT | ServoFlags.STARBOARD_OVERCURRENT_FAULT
+               | ServoFlags.DRIVER_TIMEOUT)
+
+NAN = float('nan')
+
+def read_recorder_settings():
+    """read_recorder_settings : read flight recorder settings
+
+    Returns:
+        dict: 'minutes' recorded, maximum loop 'rate' (Hz) and 'post_trigger' recording time (seconds)
+    """
+    settings = dict(RECORDER_DEFAULT)
+    recorderfilename = PILOT_DIR + 'cypilot_flight_recorder.conf'
+    try:
+        file = open(recorderfilename)
+        settings.update(pyjson.load(file))
+        file.close()
+    except Exception as e: # pylint: disable=broad-except
+        print('failed to read flight recorder file:', recorderfilename, e)
+        try:
+            file = open(recorderfilename, 'w')
+            file.write(pyjson.dumps(settings, indent=4) + '\n')
+            file.close()
+        except Exception as ew: # pylint: disable=broad-except
+            print('Exception writing default values to flight recorder file:', recorderfilename, ew)
+    return settings
+
+def number(value):
+    # values not yet received are False or None
+    if value is False or value is None:
+        return NAN
+    return value
+
+def header_bytes(capacity, count, meta):
+    meta = pyjson.dumps(meta).encode()
+    header = HEADER.pack(MAGIC, RECORD.size, capacity, count) + META_LENGTH.pack(len(meta)) + meta
+    if len(header) > HEADER_SIZE:
+        raise ValueError('flight recorder metadata too long')
+    return header + bytes(HEADER_SIZE - len(header))
+
+
+class RecorderFile(object):
+    """RecorderFile : memory mapped circular file of records
+
+    Args:
+        filename (string): file path
+        capacity (int): number of records
+        meta (dict): metadata stored in the header
+    """
+    def __init__(self, filename, capacity, meta):
+        self.capacity = capacity
+        self.count = 0
+        self.meta = meta
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # allocate the blocks now rather than on page faults of the realtime loop
+            os.posix_fallocate(fd, 0, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.map[:HEADER_SIZE] = header_bytes(capacity, 0, meta)
+
+    def append(self, values):
+        RECORD.pack_into(self.map, HEADER_SIZE + (self.count % self.capacity) * RECORD.size, *values)
+        self.count += 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    def window(self):
+        """window : records in write order
+
+        Returns:
+            bytes: the records
+        """
+        records = self.map[HEADER_SIZE:]
+        if self.count <= self.capacity:
+            return records[:self.count * RECORD.size]
+        split = (self.count % self.capacity) * RECORD.size
+        return records[split:] + records[:split]
+
+    def close(self):
+        self.map.close()
+
+
+def read_recorder_file(filename):
+    """read_recorder_file : read the records of a live or frozen recorder file
+
+    Returns:
+        tuple: (metadata, field names, record bytes in write order)
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, record_size, capacity, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(filename + ' is not a flight recorder file')
+    length = META_LENGTH.unpack_from(data, HEADER.size)[0]
+    meta = pyjson.loads(data[HEADER.size + META_LENGTH.size:HEADER.size + META_LENGTH.size + length])
+    if record_size != struct.calcsize(meta['format']):
+        raise ValueError(filename + ' record size does not match its format')
+    records = data[HEADER_SIZE:HEADER_SIZE + capacity * record_size]
+    if count > capacity:
+        split = (count % capacity) * record_size
+        records = records[split:] + records[:split]
+    else:
+        records = records[:count * record_size]
+    meta['count'] = count
+    meta['capacity'] = capacity
+    return meta, meta['fields'], records
+
+
+class FlightRecorder(object):
+    """FlightRecorder : records each autopilot iteration, saves the window on freeze
+
+    Args:
+        client: cypilot client to register recorder values
+        worker (BackgroundWorker): thread saving frozen windows
+    """
+    def __init__(self, client, worker):
+        self.client = client
+        self.worker = worker
+        settings = read_recorder_settings()
+        self.post_trigger = settings['post_trigger']
+
+        self.freeze_value = self.register(BooleanProperty, 'freeze', False)
+        self.frozen = self.register(StringValue, 'frozen', '')
+
+        self.file = None
+        self.freeze_time = None
+        self.freeze_reason = ''
+        self.last_flags = 0
+        self.faults = ServoFlags('recorder.faults') # to name new faults
+        try:
+            if os.path.exists(RECORDER_FILE):
+                os.replace(RECORDER_FILE, RECORDER_PREVIOUS)
+            meta = {'format': RECORD.format, 'fields': [name for name, __ in FIELDS],
+                    'start': time.time(), 'monotonic': time.monotonic()}
+            self.file = RecorderFile(RECORDER_FILE, int(settings['minutes'] * 60 * settings['rate']), meta)
+        except Exception as e: # pylint: disable=broad-except
+            print('flight recorder disabled:', e)
+
+    def register(self, _type, name, *args, **kwargs):
+        return self.client.register(_type(*(['recorder.' + name] + list(args)), **kwargs))
+
+    def freeze(self, reason, t=None):
+        """freeze : save the window after the post trigger time, a freeze pending is not delayed
+
+        Args:
+            reason (string): cause of the freeze
+            t (float): monotonic time of the trigger
+        """
+        if self.freeze_time is None:
+            self.freeze_time = time.monotonic() if t is None else t
+            self.freeze_reason = reason
+            print('flight recorder freeze:', reason)
+
+    def record(self, ap, t0, t1, t5):
+        """record : write a record for an autopilot iteration, check freeze triggers
+
+        Args:
+            ap (Autopilot): the autopilot
+            t0 (float): start of the iteration, before IMU read
+            t1 (float): end of IMU read
+            t5 (float): end of servo poll
+        """
+        if not self.file:
+            return
+        imu = ap.boatimu.sensor_values
+        servo = ap.servo
+        flags = servo.flags.value
+        self.file.append((t0, ap.boatimu.last_imuread,
+                          number(imu['heading'].value), number(imu['roll'].value), number(imu['pitch'].value),
+                          number(imu['headingrate'].value), number(imu['rollrate'].value), number(imu['pitchrate'].value),
+                          number(imu['accel_X'].value), number(imu['accel_Y'].value), number(imu['accel_Z'].value),
+                          number(ap.heading_command.value), number(ap.heading_error.value), number(ap.heading_error_int.value),
+                          number(servo.command.value), number(servo.rawcommand.value), number(servo.position.value),
+                          number(ap.sensors.rudder.angle.value), number(servo.current.value), number(servo.voltage.value),
+                          t1 - t0, t5 - t1, flags, bool(ap.enabled.value), bool(servo.engaged.value)))
+
+        faults = flags & FAULT_FLAGS & ~self.last_flags
+        self.last_flags = flags
+        if faults:
+            self.faults.value = faults
+            self.freeze('servo fault ' + self.faults.get_str().strip(), t0)
+        if self.freeze_value.value:
+            self.freeze_value.set(False)
+            self.freeze('freeze requested', t0)
+
+        if self.freeze_time is not None and t0 - self.freeze_time >= self.post_trigger:
+            meta = dict(self.file.meta, reason=self.freeze_reason, freeze=self.freeze_time)
+            # copy in the loop (memory only), written by the worker
+            self.worker.call(self.save, self.file.window(), meta)
+            self.freeze_time = None
+
+    def save(self, records, meta):
+        # called by the worker thread
+        filename = RECORDER_DIR + time.strftime('%Y%m%d-%H%M%S') + '.bin'
+        try:
+            os.makedirs(RECORDER_DIR, exist_ok=True)
+            count = len(records) // RECORD.size
+            with open(filename, 'wb') as f:
+                f.write(header_bytes(count, count, meta))
+                f.write(records)
+            print('flight recorder saved', filename, count, 'records,', meta['reason'])
+            self.frozen.set(filename + ' ' + meta['reason'])
+        except Exception as e: # pylint: disable=broad-except
+            print('flight recorder failed to save', filename, e)
+
+
+def recorder_csv(filename, output=None):
+    meta, fields, records = read_recorder_file(filename)
+    output = output or os.path.splitext(filename)[0] + '.csv'
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        # single precision fields with their significant digits only
+        single = [code == 'f' for code in meta['format'][1:]]
+        for record in struct.iter_unpack(meta['format'], records):
+            writer.writerow(['%.7g' % v if f else v for v, f in zip(record, single)])
+    print('wrote', output, len(records) // struct.calcsize(meta['format']), 'records')
+
+def recorder_numpy(filename, output=None):
+    import numpy as np
+    meta, fields, records = read_recorder_file(filename)
+    codes = meta['format'][1:]
+    dtype = np.dtype([(name, '<' + code.replace('I', 'u4').replace('B', 'u1').replace('d', 'f8').replace('f', 'f4'))
+                      for name, code in zip(fields, codes)])
+    array = np.frombuffer(records, dtype=dtype)
+    output = output or os.path.splitext(filename)[0] + '.npy'
+    np.save(output, array)
+    print('wrote', output, len(array), 'records')
+    return array
+
+def recorder_info(filename):
+    meta, fields, records = read_recorder_file(filename)
+    count = len(records) // struct.calcsize(meta['format'])
+    print(filename, f"{count} records of {meta['count']} written, capacity {meta['capacity']}")
+    print('started', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['start'])))
+    if 'reason' in meta:
+        print('frozen:', meta['reason'])
+    if count:
+        first = struct.unpack_from(meta['format'], records)
+        last = struct.unpack_from(meta['format'], records, len(records) - struct.calcsize(meta['format']))
+        duration = last[0] - first[0]
+        print(f'window {duration:.1f}s, {(count - 1) / max(duration, 1e-3):.1f} records/s')
+        if 'reason' in meta:
+            print(f"trigger {meta['freeze'] - first[0]:.1f}s after the first record")
+    print('fields:', ' '.join(fields))
+
+def flight_recorder_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) == 3 and sys.argv[1] == 'info':
+        recorder_info(sys.argv[2])
+    elif len(sys.argv) >= 3 and sys.argv[1] in ['csv', 'npy']:
+        command = recorder_csv if sys.argv[1] == 'csv' else recorder_numpy
+        command(*sys.argv[2:4])
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    flight_recorder_main()
@@ -12,7 +12,6 @@
 # Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
 
 import os
-import multiprocessing
 import time
 import socket
 import select
@@ -22,8 +21,10 @@ import cypilot.pilot_path
 from nonblockingpipe import non_blocking_pipe
 from bufferedsocket import LineBufferedNonBlockingSocket
 import serials
+from helpers import ForkedHelper
 # import serialprobe
 import pyjson
+from pilot_values import EnumProperty
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 
@@ -80,7 +81,7 @@ def gpsd_restart():
         except:
             print('gpsd: unable to restart device ', device)
 
-class gpsProcess(multiprocessing.Process):
+class gpsProcess(ForkedHelper):
     def __init__(self):
         # split pipe ends
         self.pipe, pipe = non_blocking_pipe('gps_pipe')
@@ -168,6 +169,10 @@ class gpsProcess(multiprocessing.Process):
                     if key in msg:
                         fix[key] = msg[key]
                 fix['speed'] *= 1.944  # knots
+                fix['rx'] = time.monotonic()
+                if 'time' in msg:
+                    from sensors import parse_iso_time # sensors imports gpsd
+                    fix['stamp'] = parse_iso_time(msg['time'])
                 device = msg['device']
                 if not device in self.devices:
                     self.devices.append(device)
@@ -213,25 +218,48 @@ class gpsd(object):
     def __init__(self, sensors):
         self.sensors = sensors
         self.devices = False  # list of devices used by gpsd, or False if not connected
+        self.rate = None
+        self.sent_rate = None
 
-        self.process = gpsProcess()
+        # a "ubx" serial device is read directly instead of through gpsd
+        list_ubx = serials.list_serials("ubx")
+        if list_ubx:
+            from ubx import ubxProcess, UBX_RATES
+            self.rate = sensors.client.register(EnumProperty('gps.rate', 5, UBX_RATES, persistent=True))
+            self.sent_rate = self.rate.value
+            self.process = ubxProcess(list_ubx[0], self.rate.value)
+        else:
+            self.process = gpsProcess()
         self.process.start()
 
         read_only = select.POLLIN | select.POLLHUP | select.POLLERR
         self.poller = select.poll()
         self.poller.register(self.process.pipe.fileno(), read_only)
 
-    def read(self):
+    def receive(self):
+        # drain the pipe from the gps process, may be called from the worker thread
+        if self.rate and self.rate.value != self.sent_rate:
+            self.sent_rate = self.rate.value
+            self.process.pipe.send({'rate': self.sent_rate})
+        msgs = []
         data = self.process.pipe.recv()
         while data:
-            if 'devices' in data:
-                print('GPSD devices', data['devices'])
-                if self.devices and not data['devices']:
-                    self.sensors.lostgpsd()
-                self.devices = data['devices']
-            else:
-                self.sensors.write('gps', data, 'gpsd')
+            msgs.append(data)
             data = self.process.pipe.recv()
+        return msgs
+
+    def apply(self, data):
+        if 'devices' in data:
+            print('GPSD devices', data['devices'])
+            if self.devices and not data['devices']:
+                self.sensors.lostgpsd()
+            self.devices = data['devices']
+        else:
+            self.sensors.write('gps', data, 'gpsd')
+
+    def read(self):
+        for data in self.receive():
+            self.apply(data)
 
     def poll(self):
         while True:
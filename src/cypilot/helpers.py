@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""helper processes of the autopilot
+
+When a helper is forked from the autopilot process, it gets a copy of everything
+the autopilot has imported, the hardware devices it has opened (I2C, serial ports,
+watchdog) and, once the autopilot is realtime, its SCHED_FIFO scheduling class.
+
+Helpers which only talk to the autopilot through the server (perf, autotune,
+remote control) are forked by a lean fork server instead: a fresh python
+interpreter executed on first use, preloading only the modules shared by all
+helpers. Each helper then imports its own module after the fork.
+
+Helpers which need objects of the autopilot process (pipes, queues) are still
+forked from the autopilot, as ForkedHelper, and drop the realtime scheduling
+and the hardware devices before running.
+
+    python -m cypilot.helpers --forkserver FD   (started by ForkServer)
+"""
+
+import os
+import sys
+import time
+import select
+import signal
+import socket
+import threading
+import importlib
+import subprocess
+import multiprocessing
+
+import cypilot.pilot_path # pylint: disable=unused-import
+import pyjson
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+# modules imported by the fork server before forking helpers
+PRELOAD = ['pilot_values', 'client', 'pyjson']
+
+# devices held by the autopilot process which helpers must not keep open
+HARDWARE_DEVICES = ['/dev/i2c', '/dev/watchdog', '/dev/spidev', '/dev/gpiochip',
+                    '/dev/ttyAMA', '/dev/ttyS', '/dev/ttyUSB', '/dev/ttyACM', '/dev/serial']
+
+
+def release_inherited():
+    """release_inherited : called first in a helper forked from the autopilot process,
+    leave realtime scheduling and replace hardware device descriptors with /dev/null
+
+    /dev/null is duplicated over the descriptors rather than closing them so that
+    their numbers are not reused while python objects of the parent still refer to them.
+    """
+    try:
+        if os.sched_getscheduler(0) != os.SCHED_OTHER:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    except Exception as e: # pylint: disable=broad-except
+        print('helper failed to leave realtime scheduling', e)
+
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return
+    devnull = None
+    for name in fds:
+        fd = int(name)
+        try:
+            path = os.readlink('/proc/self/fd/' + name)
+        except OSError:
+            continue
+        if not any(path.startswith(device) for device in HARDWARE_DEVICES):
+            continue
+        if devnull is None:
+            devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, fd, inheritable=False)
+    if devnull is not None:
+        os.close(devnull)
+
+
+class ForkedHelper(multiprocessing.Process):
+    """ForkedHelper : multiprocessing.Process dropping realtime scheduling and hardware
+    devices inherited from the autopilot process
+    """
+    def run(self):
+        release_inherited()
+        super(ForkedHelper, self).run()
+
+
+class Helper(object):
+    """Helper : handle on a process forked by the fork server, same use as
+    multiprocessing.Process for the autopilot (pid, is_alive, terminate)
+    """
+    def __init__(self, pid, name):
+        self.pid = pid
+        self.name = name
+
+    def is_alive(self):
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return f'<Helper {self.name} {self.pid}>'
+
+
+class ForkServer(object):
+    """ForkServer : client side of the fork server, started on first launch
+    """
+    def __init__(self):
+        self.process = None
+        self.socket = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.socket, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.process = subprocess.Popen([sys.executable, '-m', 'cypilot.helpers', '--forkserver', str(child.fileno())],
+                                        pass_fds=[child.fileno()], close_fds=True)
+        child.close()
+        print('helper fork server process', self.process.pid)
+
+    def launch(self, module, function, args=(), name=None):
+        """launch : fork a helper running function(*args) from module
+
+        Args:
+            module (string): module name, imported by the helper
+            function (string): name of the function run by the helper
+            args (tuple): function arguments, must be json serializable
+            name (string): helper name
+
+        Returns:
+            Helper: the helper process
+        """
+        name = name or function
+        with self.lock:
+            if not self.process or self.process.poll() is not None:
+                self.start()
+            request = {'module': module, 'function': function, 'args': list(args), 'name': name}
+            self.socket.send(pyjson.dumps(request).encode())
+            self.socket.settimeout(10)
+            reply = pyjson.loads(self.socket.recv(4096))
+        if 'error' in reply:
+            raise RuntimeError(f'failed to launch helper {name}: {reply["error"]}')
+        print('helper', name, 'process', reply['pid'])
+        return Helper(reply['pid'], name)
+
+
+FORKSERVER = ForkServer()
+
+def launch(module, function, args=(), name=None):
+    """launch : fork a helper from the shared fork server, see ForkServer.launch
+    """
+    return FORKSERVER.launch(module, function, args, name)
+
+
+def run_helper(module, function, args):
+    # runs in the forked helper
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    try:
+        getattr(importlib.import_module(module), function)(*args)
+        status = 0
+    except Exception as e: # pylint: disable=broad-except
+        print('helper', module + '.' + function, 'failed', e)
+        status = 1
+    sys.stdout.flush()
+    os._exit(status)
+
+def forkserver_main(fd):
+    """forkserver_main : fork helpers on request until the autopilot closes the socket
+    """
+    release_inherited()
+    for module in PRELOAD:
+        try:
+            importlib.import_module(module)
+        except Exception as e: # pylint: disable=broad-except
+            print('fork server failed to preload', module, e)
+
+    sock = socket.socket(fileno=fd)
+    children = {}
+
+    def stop(signal_number, frame=None):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    try:
+        while True:
+            events = poller.poll(1000)
+
+            # reap helpers
+            while children:
+                pid, __ = os.waitpid(-1, os.WNOHANG)
+                if not pid:
+                    break
+                print('helper', children.pop(pid, ''), pid, 'exited')
+
+            if not events:
+                continue
+            data = sock.recv(4096)
+            if not data: # autopilot exited
+                break
+            try:
+                request = pyjson.loads(data)
+                module, function, args = request['module'], request['function'], request['args']
+            except Exception as e: # pylint: disable=broad-except
+                sock.send(pyjson.dumps({'error': str(e)}).encode())
+                continue
+
+            pid = os.fork()
+            if pid == 0:
+                sock.close()
+                run_helper(module, function, args)
+            children[pid] = request['name']
+            sock.send(pyjson.dumps({'pid': pid}).encode())
+    except KeyboardInterrupt:
+        pass
+
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    t0 = time.monotonic()
+    while children and time.monotonic() - t0 < 1:
+        pid, __ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(.05)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--forkserver':
+        forkserver_main(int(sys.argv[2]))
+    else:
+        print('usage: python -m cypilot.helpers --forkserver FD')
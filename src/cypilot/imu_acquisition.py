@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""IMU acquisition thread of the autopilot process
+
+The IMU is read by a dedicated thread so that I2C stalls, packet errors and
+report timeouts do not land in the autopilot loop. Each sample is stored with
+its monotonic time in a preallocated ring, the autopilot loop takes the newest
+sample or all samples written since its last iteration.
+
+The IMU may be read faster than the autopilot loop (imu.acquisition_rate 50 or
+100Hz for a pilot rate of 10 or 20Hz): each loop iteration then waits for the
+samples of one pilot period and averages their gyro and accel (DecimationFilter).
+The IMU rate is rounded down to a multiple of the pilot rate (decimated_rate).
+
+The ring has a single writer: a slot is written before the write count is
+incremented, both are atomic under the GIL, so the reader never takes a lock
+and never sees a partially written sample.
+
+    python imu_acquisition.py [RATE] [LOAD]   acquisition and loop timing on replayed BNO08X packets,
+                                               LOAD seconds of processing per loop iteration
+    python imu_acquisition.py cpu             cpu use at each acquisition rate, 10Hz pilot
+"""
+
+import os
+import sys
+import time
+import math
+import threading
+import collections
+
+import cypilot.pilot_path # pylint: disable=unused-import
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+IMUSample = collections.namedtuple('IMUSample', ['time', 'quaternion', 'gyro', 'accel'])
+
+ACQUISITION_RATES = [10, 20, 50, 100] # Hz
+
+RING_SIZE = 128 # samples, more than one second at the highest acquisition rate
+ERROR_RETRY = .1 # seconds before reading again after an IMU error
+REALTIME_PRIORITY = 2 # SCHED_FIFO priority, same as the autopilot loop
+
+
+class SampleRing(object):
+    """SampleRing : preallocated ring of samples, one writer and one reader
+
+    Args:
+        size (int): number of samples kept
+    """
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.slots = [None] * size
+        self.count = 0 # samples written since start
+
+    def append(self, sample):
+        # only called by the writer thread
+        self.slots[self.count % self.size] = sample
+        self.count += 1
+
+    def newest(self):
+        count = self.count
+        return self.slots[(count - 1) % self.size] if count else None
+
+    def since(self, index):
+        """since : samples written after a previous read
+
+        Args:
+            index (int): write count returned by the previous read, 0 at first
+
+        Returns:
+            tuple: (samples, write count, lost samples overwritten before being read)
+        """
+        count = self.count
+        start = max(index, count - self.size + 1)
+        samples = [self.slots[i % self.size] for i in range(start, count)]
+        # samples overwritten by the writer while copying
+        overwritten = self.count - self.size + 1 - start
+        if overwritten > 0:
+            samples = samples[overwritten:]
+            start += overwritten
+        return samples, count, start - index
+
+
+class IMUAcquisition(threading.Thread):
+    """IMUAcquisition : thread reading the IMU into a SampleRing
+
+    The thread is created before the autopilot process is made realtime and
+    chrt only changes the main thread, so the thread sets its own SCHED_FIFO
+    priority. It is blocked waiting for the IMU reports most of the time.
+
+    Args:
+        imu: IMU device with getIMUData()
+        size (int): ring size
+    """
+    def __init__(self, imu, size=RING_SIZE):
+        super(IMUAcquisition, self).__init__(name='imu acquisition', daemon=True)
+        self.imu = imu
+        self.rate = imu.rate # requested rate, applied by the thread
+        self.ring = SampleRing(size)
+        self.event = threading.Event()
+        self.errors = 0
+        self.cpu_time = 0 # cpu seconds used by the thread
+        self.running = True
+
+    def set_realtime(self):
+        # the process is usually not root, fall back on sudo chrt like the autopilot loop
+        tid = threading.get_native_id()
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+        except Exception: # pylint: disable=broad-except
+            if os.system(f"sudo -n chrt -pf {REALTIME_PRIORITY:d} {tid:d} > /dev/null 2>&1"):
+                print('warning, failed to make imu acquisition thread realtime')
+                return
+        print('imu acquisition thread', tid, 'realtime')
+
+    def run(self):
+        print('imu acquisition thread', threading.get_native_id())
+        self.set_realtime()
+        while self.running:
+            self.cpu_time = time.thread_time()
+            try:
+                if self.imu.rate != self.rate:
+                    print('imu acquisition rate', self.rate)
+                    self.imu.set_rate(self.rate)
+                data = self.imu.getIMUData()
+            except Exception as e: # pylint: disable=broad-except
+                self.errors += 1
+                print('imu acquisition failed', e)
+                time.sleep(ERROR_RETRY)
+                continue
+            t = data.get('timestamp') or time.monotonic()
+            self.ring.append(IMUSample(t, data['fusionQPose'], data['gyro'], data['accel']))
+            self.event.set()
+
+    def stop(self):
+        self.running = False
+
+    def set_rate(self, rate):
+        self.rate = rate
+
+    def wait(self, index, timeout, count=1):
+        """wait : wait for samples written after a previous read
+
+        Args:
+            index (int): write count returned by the previous read
+            timeout (float): seconds
+            count (int): number of samples to wait for
+
+        Returns:
+            tuple: see SampleRing.since, less than count samples on timeout
+        """
+        deadline = time.monotonic() + timeout
+        samples, lost = [], 0
+        while True:
+            if self.ring.count == index:
+                # clear before testing again, a sample written in between sets the event
+                self.event.clear()
+                if self.ring.count == index:
+                    self.event.wait(max(deadline - time.monotonic(), 0))
+            new, index, n = self.ring.since(index)
+            samples += new
+            lost += n
+            if len(samples) >= count or time.monotonic() >= deadline:
+                return samples, index, lost
+
+
+def decimated_rate(acquisition_rate, pilot_rate):
+    """decimated_rate : IMU rate used for a requested acquisition rate
+
+    Samples are decimated by count, so the IMU rate must be an integer multiple
+    of the pilot rate: the highest multiple not above the request, at least the
+    pilot rate (50Hz requested at a 20Hz pilot rate reads at 40Hz).
+
+    Args:
+        acquisition_rate (int): requested IMU rate (Hz)
+        pilot_rate (int): autopilot loop rate (Hz)
+
+    Returns:
+        int: IMU rate (Hz)
+    """
+    return pilot_rate * max(acquisition_rate // pilot_rate, 1)
+
+
+class DecimationFilter(object):
+    """DecimationFilter : mean of the gyro and accel over the last pilot period
+
+    The moving average over the decimation factor has its zeros at the pilot rate
+    and its multiples, the frequencies folded onto 0 when only one sample of each
+    pilot period is used. Without decimation the samples are used as is.
+
+    Args:
+        acquisition_rate (int): IMU rate (Hz), an integer multiple of the pilot rate
+        pilot_rate (int): autopilot loop rate (Hz)
+    """
+    def __init__(self, acquisition_rate=10, pilot_rate=10):
+        self.configure(acquisition_rate, pilot_rate)
+
+    def configure(self, acquisition_rate, pilot_rate):
+        if acquisition_rate % pilot_rate:
+            raise ValueError(f'acquisition rate {acquisition_rate} is not a multiple of the pilot rate {pilot_rate}')
+        self.acquisition_rate = acquisition_rate
+        self.pilot_rate = pilot_rate
+        self.decimation = acquisition_rate // pilot_rate
+        self.window = collections.deque(maxlen=self.decimation)
+
+    def filter(self, samples):
+        """filter : add the samples of a loop iteration
+
+        Returns:
+            tuple: (gyro, accel) averaged over the last decimation samples
+        """
+        window = self.window
+        window.extend(samples[-self.decimation:])
+        n = len(window)
+        if n == 1:
+            return window[0].gyro, window[0].accel
+        gx = gy = gz = ax = ay = az = 0
+        for sample in window:
+            x, y, z = sample.gyro
+            gx += x
+            gy += y
+            gz += z
+            x, y, z = sample.accel
+            ax += x
+            ay += y
+            az += z
+        return (gx / n, gy / n, gz / n), (ax / n, ay / n, az / n)
+
+
+class AcquisitionTiming(object):
+    """AcquisitionTiming : interval between samples (acquisition jitter) and age of
+    the samples when the autopilot loop uses them, in ms, and cpu use
+    """
+    def __init__(self):
+        self.report_time = time.monotonic()
+        self.acquisition_cpu = 0 # acquisition thread cpu time at the last report
+        self.read_cpu = 0 # cpu time of the loop processing the samples since the last report
+        self.reset()
+
+    def reset(self):
+        self.last_time = None
+        self.intervals = []
+        self.latencies = []
+        self.samples = 0
+        self.skipped = 0 # samples not used because a newer one was available
+        self.lost = 0 # samples overwritten before the loop read them
+        self.timeouts = 0 # loop iterations without sample
+
+    def add(self, samples, lost, t, decimation=1):
+        """add : account for the samples read by a loop iteration
+
+        Args:
+            samples (list): IMUSample read
+            lost (int): lost samples
+            t (float): monotonic time of the read
+            decimation (int): samples expected per iteration
+        """
+        self.lost += lost
+        if not samples:
+            self.timeouts += 1
+            return
+        for sample in samples:
+            if self.last_time is not None:
+                self.intervals.append(sample.time - self.last_time)
+            self.last_time = sample.time
+        self.samples += len(samples)
+        self.skipped += max(len(samples) - decimation, 0)
+        self.latencies.append(t - samples[-1].time)
+
+    def report(self, errors=0, acquisition_cpu=0):
+        """report : statistics since the last report
+
+        Args:
+            errors (int): acquisition errors
+            acquisition_cpu (float): cpu time of the acquisition thread
+
+        Returns:
+            dict: interval mean, jitter (standard deviation) and max, latency mean and max in ms,
+                  counters, cpu use (%) of the acquisition thread and of the loop processing the samples
+        """
+        def ms(v):
+            return round(v * 1000, 2)
+        t = time.monotonic()
+        dt = max(t - self.report_time, 1e-3)
+        report = {'samples': self.samples, 'skipped': self.skipped, 'lost': self.lost,
+                  'timeouts': self.timeouts, 'errors': errors,
+                  'cpu': round((acquisition_cpu - self.acquisition_cpu) / dt * 100, 2),
+                  'read_cpu': round(self.read_cpu / dt * 100, 2)}
+        self.report_time = t
+        self.acquisition_cpu = acquisition_cpu
+        self.read_cpu = 0
+        if self.intervals:
+            mean = sum(self.intervals) / len(self.intervals)
+            jitter = math.sqrt(sum((i - mean)**2 for i in self.intervals) / len(self.intervals))
+            report.update({'interval': ms(mean), 'jitter': ms(jitter), 'max_interval': ms(max(self.intervals))})
+        if self.latencies:
+            report.update({'latency': ms(sum(self.latencies) / len(self.latencies)), 'max_latency': ms(max(self.latencies))})
+        last_time = self.last_time
+        self.reset()
+        self.last_time = last_time
+        return report
+
+
+def acquisition_replay(rate, pilot_rate, seconds=10, load=0):
+    """acquisition_replay : acquisition thread on synthetic BNO08X packets, with a loop
+    decimating the samples like BoatIMU.read
+
+    Args:
+        rate (int): acquisition rate
+        pilot_rate (int): loop rate
+        seconds (float): replay duration
+        load (float): processing time of the loop, 3 times longer every 10 iterations
+
+    Returns:
+        tuple: (loop iterations, timing report)
+    """
+    from devices.bno085_io import ShtpReplay, synthetic_packets
+    from devices.cypilot_bno085 import BNO08X_I2C
+
+    replay = ShtpReplay(synthetic_packets(rate, seconds))
+    acquisition = IMUAcquisition(BNO08X_I2C(None, rate=rate, bus=replay, interrupt=replay))
+    acquisition.start()
+    decimation = DecimationFilter(rate, pilot_rate)
+    timing = AcquisitionTiming()
+    index = 0
+    iterations = 0
+    while not replay.done():
+        samples, index, lost = acquisition.wait(index, 2 / pilot_rate, decimation.decimation)
+        timing.add(samples, lost, time.monotonic(), decimation.decimation)
+        cpu = time.thread_time()
+        if samples:
+            decimation.filter(samples)
+        timing.read_cpu += time.thread_time() - cpu
+        time.sleep(load * (1 + 2 * (iterations % 10 == 0)))
+        iterations += 1
+    acquisition.stop()
+    return iterations, timing.report(acquisition.errors, acquisition.cpu_time)
+
+def imu_acquisition_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) > 1 and sys.argv[1] == 'cpu':
+        # the acquisition thread cpu includes the replayed bus
+        for rate in ACQUISITION_RATES:
+            iterations, report = acquisition_replay(rate, 10, 10)
+            print(f"{rate:3d} Hz: {iterations} loop iterations, acquisition cpu {report['cpu']:.2f}%,"
+                  f" loop read cpu {report['read_cpu']:.3f}%, jitter {report['jitter']:.2f}ms")
+        return
+    pilot_rate = min(int(sys.argv[1]) if len(sys.argv) > 1 else 10, 20)
+    rate = decimated_rate(int(sys.argv[1]) if len(sys.argv) > 1 else 10, pilot_rate)
+    load = float(sys.argv[2]) if len(sys.argv) > 2 else .3 / rate
+    iterations, report = acquisition_replay(rate, pilot_rate, 10, load)
+    print(iterations, 'loop iterations', report)
+
+if __name__ == '__main__':
+    imu_acquisition_main()
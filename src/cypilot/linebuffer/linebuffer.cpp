@@ -22,7 +22,7 @@
 LineBuffer::LineBuffer(int _fd) 
     : fd(_fd)
 {
-    pos = len = b = 0;
+    pos = len = b = dropped = 0;
 }
 
 const char *LineBuffer::line()
@@ -42,8 +42,12 @@ const char *LineBuffer::line_nmea()
 bool LineBuffer::recv()
 {
     if(len == sizeof buf[0]) {
-        printf("linebuffer overflow!!!!\n");
-        len = 0;
+        // complete lines are kept, more data is read once they are consumed
+        if(pos < len)
+            return true;
+        // no newline in the whole buffer, the line is too long
+        dropped += len;
+        pos = len = 0;
     }
     int c = read(fd, buf[b] + len, sizeof buf[0] - len);
     if(c <= 0)
@@ -122,3 +126,60 @@ int LineBuffer::readline_buf()
     }
     return 0;
 }
+
+// split a sentence with a valid checksum into fields
+bool nmea_tokenize(const char *line, NmeaFields &fields)
+{
+    int len = strlen(line);
+    while(len && (line[len-1] == '\r' || line[len-1] == '\n'))
+        len--;
+
+    // $ or ! then address, '*' and two hex digits
+    if(len < 7 || (line[0] != '$' && line[0] != '!') || line[len-3] != '*')
+        return false;
+
+    char *end;
+    char cksum[3] = {line[len-2], line[len-1], 0};
+    int value = strtol(cksum, &end, 16);
+    if(end != cksum + 2 || value != nmea_cksum(line+1, len-4))
+        return false;
+
+    fields.count = 0;
+    const char *p = line+1, *star = line+len-3;
+    for(;;) {
+        if(fields.count == NMEA_MAX_FIELDS)
+            return false;
+        const char *comma = p;
+        while(comma < star && *comma != ',')
+            comma++;
+        fields.start[fields.count] = p;
+        fields.len[fields.count] = comma - p;
+        fields.count++;
+        if(comma == star)
+            return true;
+        p = comma+1;
+    }
+}
+
+// convert a field to a number, empty or partly numeric fields are rejected
+bool nmea_field_float(const NmeaFields &fields, int i, double &value)
+{
+    if(i >= fields.count)
+        return false;
+    int len = fields.len[i];
+    char field[32];
+    if(len == 0 || len >= (int)sizeof field)
+        return false;
+    memcpy(field, fields.start[i], len);
+    field[len] = 0;
+
+    char *end;
+    value = strtod(field, &end);
+    return end == field + len;
+}
+
+bool nmea_field_is(const NmeaFields &fields, int i, const char *s)
+{
+    return i < fields.count && (int)strlen(s) == fields.len[i] &&
+        !memcmp(fields.start[i], s, fields.len[i]);
+}
@@ -8,6 +8,20 @@
  * version 3 of the License, or (at your option) any later version.
  */
 
+// fields of a nmea sentence, from the address field to the field before the checksum
+// fields point into the sentence and are not null terminated
+#define NMEA_MAX_FIELDS 40
+
+struct NmeaFields {
+    int count;
+    const char *start[NMEA_MAX_FIELDS];
+    int len[NMEA_MAX_FIELDS];
+};
+
+bool nmea_tokenize(const char *line, NmeaFields &fields);
+bool nmea_field_float(const NmeaFields &fields, int i, double &value);
+bool nmea_field_is(const NmeaFields &fields, int i, const char *s);
+
 class LineBuffer {
 public:
     LineBuffer(int _fd);
@@ -15,6 +29,7 @@ public:
     const char *line_nmea();
     bool recv();
     const char *readline_nmea();
+    int dropped; // bytes of lines longer than the buffer
 private:
     bool next_nmea();
     bool readline_buf_nmea();
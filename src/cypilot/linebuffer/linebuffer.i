@@ -20,6 +20,148 @@ int nmea_cksum(char *msg) {
 }
 %}
 
+%inline %{
+// nmea_tokenize : fields of a sentence with a valid checksum, None if invalid
+PyObject *nmea_tokenize(const char *line) {
+    NmeaFields fields;
+    if(!nmea_tokenize(line, fields))
+        Py_RETURN_NONE;
+    PyObject *result = PyTuple_New(fields.count);
+    for(int i=0; i<fields.count; i++)
+        PyTuple_SET_ITEM(result, i, PyUnicode_FromStringAndSize(fields.start[i], fields.len[i]));
+    return result;
+}
+%}
+
+%{
+// typed decoders, same results as the python parsers in nmea.py
+
+static double degrees_minutes_to_decimal(double n) {
+    n /= 100;
+    int degrees = (int)n;
+    double minutes = n - degrees;
+    return degrees + minutes*10/6;
+}
+
+static PyObject *nmea_decode_rmc(const NmeaFields &f) {
+    double timestamp = 0, lat, lon, speed = 0, track;
+    if(f.count < 9 || nmea_field_is(f, 2, "V"))
+        return NULL;
+    if(f.len[1] && !nmea_field_float(f, 1, timestamp))
+        return NULL;
+    if(!nmea_field_float(f, 3, lat) || !nmea_field_float(f, 5, lon))
+        return NULL;
+    lat = degrees_minutes_to_decimal(lat);
+    if(nmea_field_is(f, 4, "S"))
+        lat = -lat;
+    lon = degrees_minutes_to_decimal(lon);
+    if(nmea_field_is(f, 6, "W"))
+        lon = -lon;
+    if(f.len[7] && !nmea_field_float(f, 7, speed))
+        return NULL;
+
+    PyObject *gps = Py_BuildValue("{s:d,s:d,s:d,s:d}", "timestamp", timestamp,
+                                  "speed", speed, "lat", lat, "lon", lon);
+    if(f.len[8]) {
+        if(!nmea_field_float(f, 8, track)) {
+            Py_DECREF(gps);
+            return NULL;
+        }
+        PyObject *value = PyFloat_FromDouble(track);
+        PyDict_SetItemString(gps, "track", value);
+        Py_DECREF(value);
+    }
+    return Py_BuildValue("(sN)", "gps", gps);
+}
+
+static PyObject *nmea_decode_mwv(const NmeaFields &f) {
+    double direction, speed;
+    if(f.count < 5 || !nmea_field_float(f, 1, direction) || !nmea_field_float(f, 3, speed))
+        return NULL;
+    if(nmea_field_is(f, 4, "K")) // km/h
+        speed *= .53995;
+    else if(nmea_field_is(f, 4, "M")) // m/s
+        speed *= 1.94384;
+    return Py_BuildValue("(s{s:d,s:d})", "wind", "direction", direction, "speed", speed);
+}
+
+static PyObject *nmea_decode_vwr(const NmeaFields &f) {
+    double angle, speed;
+    if(f.count < 4 || !nmea_field_float(f, 1, angle) || !nmea_field_float(f, 3, speed))
+        return NULL;
+    if(nmea_field_is(f, 2, "L") && angle > 0)
+        angle = 360.0 - angle;
+    return Py_BuildValue("(s{s:d,s:d})", "wind", "direction", angle, "speed", speed);
+}
+
+static PyObject *nmea_decode_rsa(const NmeaFields &f) {
+    double angle;
+    if(!nmea_field_float(f, 1, angle))
+        return Py_BuildValue("(s{s:O})", "rudder", "angle", Py_False);
+    return Py_BuildValue("(s{s:d})", "rudder", "angle", angle);
+}
+
+static PyObject *nmea_decode_apb(const NmeaFields &f) {
+    double xte, track;
+    bool isgp = f.len[0] >= 2 && f.start[0][0] == 'G' && f.start[0][1] == 'P';
+    if(f.count < (isgp ? 14 : 15))
+        return NULL;
+    const char *mode = (isgp || !nmea_field_is(f, 14, "M")) ? "gps" : "compass";
+    if(!nmea_field_float(f, 13, track) || !nmea_field_float(f, 3, xte))
+        return NULL;
+    if(xte > 0.15) // maximum 0.15 miles
+        xte = 0.15;
+    if(nmea_field_is(f, 4, "L"))
+        xte = -xte;
+    return Py_BuildValue("(s{s:s,s:d,s:d,s:s#})", "apb", "mode", mode, "track", track,
+                         "xte", xte, "isgp", f.start[0], (Py_ssize_t)(f.len[0] < 2 ? f.len[0] : 2));
+}
+
+static PyObject *nmea_decode_vhw(const NmeaFields &f) {
+    double speed;
+    if(!nmea_field_float(f, 5, speed))
+        return NULL;
+    return Py_BuildValue("(s{s:d})", "sow", "speed", speed);
+}
+
+static PyObject *nmea_decode_lwy(const NmeaFields &f) {
+    double leeway;
+    if(!nmea_field_is(f, 1, "A") || !nmea_field_float(f, 2, leeway))
+        return NULL;
+    return Py_BuildValue("(s{s:d})", "sow", "leeway", leeway);
+}
+%}
+
+%inline %{
+// nmea_decode : (sensor name, data) for supported sentences, None otherwise
+PyObject *nmea_decode(const char *line) {
+    NmeaFields f;
+    if(!nmea_tokenize(line, f) || f.len[0] != 5)
+        Py_RETURN_NONE;
+
+    const char *id = f.start[0] + 2;
+    PyObject *result = NULL;
+    if(!memcmp(id, "RMC", 3))
+        result = nmea_decode_rmc(f);
+    else if(!memcmp(id, "MWV", 3))
+        result = nmea_decode_mwv(f);
+    else if(!memcmp(id, "VWR", 3))
+        result = nmea_decode_vwr(f);
+    else if(!memcmp(id, "RSA", 3))
+        result = nmea_decode_rsa(f);
+    else if(!memcmp(id, "APB", 3))
+        result = nmea_decode_apb(f);
+    else if(!memcmp(id, "VHW", 3))
+        result = nmea_decode_vhw(f);
+    else if(!memcmp(id, "LWY", 3))
+        result = nmea_decode_lwy(f);
+
+    if(!result)
+        Py_RETURN_NONE;
+    return result;
+}
+%}
+
 class LineBuffer {
 public:
     LineBuffer(int _fd);
@@ -28,4 +170,5 @@ public:
     const char *line_nmea();
     bool recv();
     const char *readline_nmea();
+    int dropped;
 };
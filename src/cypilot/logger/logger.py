@@ -25,6 +25,7 @@ from multiprocessing import Process, Queue
 
 import cypilot.pilot_path # pylint: disable=unused-import
 from client import cypilotClient
+from helpers import release_inherited
 from kbhit import KBHit
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
@@ -319,6 +320,7 @@ class ProcessLogger(BaseLogger, Process):
     def run(self):
         """[summary]
         """
+        release_inherited()
         self.initialisation()
         
         while True:
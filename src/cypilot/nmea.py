@@ -24,22 +24,29 @@
 import os
 import select
 import time
-import datetime
 import socket
-import multiprocessing
 import fcntl
+import random
+import errno
+import threading
+import itertools
+import collections
 import serial
 
 import cypilot.pilot_path
 from client import cypilotClient
-from pilot_values import Property
+from pilot_values import Property, Value, JSONValue, StringValue
 from nonblockingpipe import non_blocking_pipe
 from bufferedsocket import LineBufferedNonBlockingSocket
 from sensors import init_source_priority
 import serials
+import pyjson
 from linebuffer import linebuffer
+from helpers import ForkedHelper
+from ais import AisStream
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
+from pilot_path import PILOT_DIR
 
 DEFAULT_PORT = 20220
 
@@ -53,10 +60,34 @@ TALKER_GPS = 'GP'
 TALKER_WIND = 'AG'
 TALKER_RUDDER = 'AG'
 
-NMEA_TXPERIOD_IMU = 0.5
-NMEA_TXPERIOD_GPS = 1.0
-NMEA_TXPERIOD_WIND = 0.25
-NMEA_TXPERIOD_RUDDER = 0.25
+# default output periods (seconds) per sentence, see read_output_periods()
+NMEA_OUTPUT_PERIODS = {'XDR': 0.5, 'HDM': 0.5, 'RMC': 1.0, 'GLL': 1.0, 'MWV': 0.25, 'RSA': 0.25}
+# sentences with unchanged inputs are still sent at this period
+NMEA_OUTPUT_REFRESH = 5.0
+
+# serial input budgets per autopilot iteration, lines left in the device buffers
+# are processed on the next iteration and counted as backlog
+NMEA_DEVICE_LINES = 20
+NMEA_DEVICE_TIME = 0.005
+NMEA_LINES = 50
+NMEA_TIME = 0.015
+
+# tcp client settings, per client ip address or 'default'
+#   include/exclude : sentence ids relayed or not ('RMC', 'VDM' for AIS, ...), all if include is empty
+#   periods : minimum period in seconds per sentence id
+#   backlog : maximum bytes queued for the client
+#   drop : 'newest' drops lines when the backlog is full, 'disconnect' closes the client
+#   ais_rate : maximum AIS messages per second, 0 for no limit
+NMEA_CLIENT_DEFAULT = {'include': [], 'exclude': [], 'periods': {}, 'backlog': 65536, 'drop': 'newest', 'ais_rate': 0}
+NMEA_IOV_MAX = 1024
+# lines relayed to the bridge are batched in pipe messages up to PIPE_BUF bytes,
+# larger writes to the non-blocking pipe may be partial (json quotes and newline)
+NMEA_PIPE_MSG_SIZE = select.PIPE_BUF - 3
+
+# outbound tcp client (nmea.client) : connection timeout and retry backoff in seconds
+NMEA_CLIENT_TIMEOUT = 10
+NMEA_CLIENT_BACKOFF_MIN = 1
+NMEA_CLIENT_BACKOFF_MAX = 60
 
 TIOCEXCL = 0x540C
 SOURCE_PRIORITY = {}
@@ -150,7 +181,7 @@ def parse_nmea_wind(line):
         return 'wind', msg
 
     if line[3:6] == 'MWV':
-        data = line.split(',')
+        data = line[:len(line)-3].split(',') # the unit may be the last field, without status
         msg = {}
 
         try:
@@ -277,7 +308,7 @@ def parse_nmea_sow(line):
 
     elif line[3:6] == 'LWY':
         try:
-            data = line.split(',')
+            data = line[:len(line)-3].split(',') # leeway is the last field
             if data[1] == 'A':
                 leeway = float(data[2])
                 return 'sow', {'leeway': leeway}
@@ -286,9 +317,222 @@ def parse_nmea_sow(line):
 
     return False
 
-NMEA_PARSERS = {'gps': parse_nmea_gps, 'wind': parse_nmea_wind,
-                'rudder': parse_nmea_rudder, 'apb': parse_nmea_apb,
-                'sow' : parse_nmea_sow }
+# sentence id -> (sensor name, parser)
+NMEA_DISPATCH = {'RMC': ('gps', parse_nmea_gps),
+                 'MWV': ('wind', parse_nmea_wind), 'VWR': ('wind', parse_nmea_wind),
+                 'RSA': ('rudder', parse_nmea_rudder),
+                 'APB': ('apb', parse_nmea_apb),
+                 'VHW': ('sow', parse_nmea_sow), 'LWY': ('sow', parse_nmea_sow)}
+
+NMEA_SENSORS = sorted(set(name for name, __ in NMEA_DISPATCH.values()))
+
+# typed decoders of the linebuffer extension, same results as the parsers above
+NMEA_DECODE = getattr(linebuffer, 'nmea_decode', None)
+
+
+class NmeaDispatcher(object):
+    """NmeaDispatcher : parse a sentence with the only parser registered for its id
+
+    Whether data from a device may be used by a sensor depends on the source of the
+    sensor: it is cached and must be invalidated when a sensor source or device changes.
+
+    Args:
+        eligible (function): eligible(sensor name, device) returns True if the sensor
+            may use data from the device
+    """
+    def __init__(self, eligible, native=True):
+        self.eligible = eligible
+        self.cache = {} # (sensor name, device) -> eligible
+        self.decode = NMEA_DECODE if native else None
+
+    def invalidate(self, name=None):
+        """invalidate : forget cached eligibility
+
+        Args:
+            name (string): sensor name, all sensors if None
+        """
+        if name is None:
+            self.cache = {}
+        else:
+            for key in [key for key in self.cache if key[0] == name]:
+                del self.cache[key]
+
+    def parse(self, line, device):
+        """parse : parse a sentence received from a device
+
+        Args:
+            line (string): NMEA sentence
+            device (string): device name
+
+        Returns:
+            tuple: (sensor name, data) or False if the sentence is unknown, invalid
+                   or not used by its sensor
+        """
+        entry = NMEA_DISPATCH.get(line[3:6])
+        if not entry:
+            return False
+        name, parser = entry
+
+        key = (name, device)
+        eligible = self.cache.get(key)
+        if eligible is None:
+            eligible = self.cache[key] = self.eligible(name, device)
+        if not eligible:
+            return False
+
+        result = self.decode(line) if self.decode else parser(line)
+        if not result:
+            return False
+        name, msg = result
+        msg['device'] = line[1:3] + device
+        return name, msg
+
+
+def read_output_periods():
+    """read_output_periods : read nmea output periods (seconds) per sentence
+
+    Returns:
+        dict: sentence id -> period, a period of 0 disables the sentence
+    """
+    periods = dict(NMEA_OUTPUT_PERIODS)
+    outputfilename = PILOT_DIR + 'cypilot_nmea_output.conf'
+    try:
+        file = open(outputfilename)
+        periods.update(pyjson.load(file))
+        file.close()
+    except Exception as e: # pylint: disable=broad-except
+        print('failed to read nmea output file:', outputfilename, e)
+        try:
+            file = open(outputfilename, 'w')
+            file.write(pyjson.dumps(periods, indent=4) + '\n')
+            file.close()
+        except Exception as ew: # pylint: disable=broad-except
+            print('Exception writing default values to nmea output file:', outputfilename, ew)
+    return periods
+
+def nmea_degrees_minutes(degrees, hemispheres, width):
+    return f"{int(abs(degrees)):0{width}d}{(abs(degrees) % 1) * 60:07.4f},{hemispheres[degrees < 0]}"
+
+def format_nmea_xdr(stamp, pitch, roll):
+    if not (pitch and roll):
+        return []
+    return [TALKER_IMU + f"XDR,A,{pitch:.3f},D,PTCH", TALKER_IMU + f"XDR,A,{roll:.3f},D,ROLL"]
+
+def format_nmea_hdm(stamp, heading):
+    if not heading:
+        return []
+    return [TALKER_IMU + f"HDM,{heading:.3f},M"]
+
+def format_nmea_rmc(stamp, lat, lon, speed, track):
+    if not (lat and lon):
+        return []
+    utc, date = stamp
+    track = track if track > 0 else 360 + track
+    return [TALKER_GPS + f"RMC,{utc},A,{nmea_degrees_minutes(lat, 'NS', 2)},{nmea_degrees_minutes(lon, 'EW', 3)}," \
+                         f"{speed:.2f},{track:.2f},{date},,,A"]
+
+def format_nmea_gll(stamp, lat, lon):
+    if not (lat and lon):
+        return []
+    return [TALKER_GPS + f"GLL,{nmea_degrees_minutes(lat, 'NS', 2)},{nmea_degrees_minutes(lon, 'EW', 3)},{stamp[0]},A"]
+
+def format_nmea_mwv(stamp, direction, speed):
+    if not (direction and speed):
+        return []
+    return [TALKER_WIND + f"MWV,{direction:.3f},R,{speed:.3f},N,A"]
+
+def format_nmea_rsa(stamp, angle):
+    if not angle:
+        return []
+    return [TALKER_RUDDER + f"RSA,{angle:.3f},A,,"]
+
+# sentence id -> (values the sentence is formatted from, formatter)
+NMEA_OUTPUTS = {'XDR': (['imu.pitch', 'imu.roll'], format_nmea_xdr),
+                'HDM': (['imu.heading'], format_nmea_hdm),
+                'RMC': (['gps.lat', 'gps.lon', 'gps.speed', 'gps.track'], format_nmea_rmc),
+                'GLL': (['gps.lat', 'gps.lon'], format_nmea_gll),
+                'MWV': (['wind.direction', 'wind.speed'], format_nmea_mwv),
+                'RSA': (['rudder.angle'], format_nmea_rsa)}
+
+
+class NmeaOutput(object):
+    """NmeaOutput : sentence formatted from values, evaluated once per period and
+    sent only if one of its values was set since it was last sent
+
+    Args:
+        sentence (string): sentence id
+        names (list): names of the values the sentence is formatted from
+        format (function): format(stamp, *values) returns a list of sentence bodies
+        period (float): period in seconds
+    """
+    def __init__(self, sentence, names, format, period): # pylint: disable=redefined-builtin
+        self.sentence = sentence
+        self.names = names
+        self.format = format
+        self.period = period
+        self.values = None # Value objects, bound on first use
+        self.time = 0 # last evaluation
+        self.sent = 0 # last send
+        self.last = None # value generations at last evaluation
+
+    def bind(self, values):
+        if all(name in values for name in self.names):
+            self.values = [values[name] for name in self.names]
+        return self.values
+
+
+class NmeaOutputScheduler(object):
+    """NmeaOutputScheduler : format the due sentences in one batch
+
+    Args:
+        values (dict): name -> Value of the autopilot client
+    """
+    def __init__(self, values):
+        self.values = values
+        periods = read_output_periods()
+        self.outputs = []
+        for sentence, (names, format) in NMEA_OUTPUTS.items(): # pylint: disable=redefined-builtin
+            if periods.get(sentence):
+                self.outputs.append(NmeaOutput(sentence, names, format, periods[sentence]))
+        self.sent = 0
+        self.skipped = 0
+
+    def poll(self, t, enabled):
+        """poll : format the sentences due at time t
+
+        Args:
+            t (float): monotonic time
+            enabled (function): enabled(sentence id) returns True if the sentence has a destination
+
+        Returns:
+            list: complete sentences, with checksum and without line terminator
+        """
+        bodies = []
+        stamp = None
+        for output in self.outputs:
+            if t - output.time < output.period or not enabled(output.sentence):
+                continue
+            if not output.values and not output.bind(self.values):
+                continue
+            output.time = t
+
+            state = tuple(value.generation for value in output.values)
+            if state == output.last and t - output.sent < NMEA_OUTPUT_REFRESH:
+                self.skipped += 1
+                continue
+            output.last = state
+
+            if not stamp: # utc time and date, once per batch
+                now = time.time()
+                utc = time.gmtime(now)
+                stamp = (time.strftime('%H%M%S', utc) + f".{int(now % 1 * 100):02d}", time.strftime('%d%m%y', utc))
+            sentences = output.format(stamp, *[value.value for value in output.values])
+            if sentences:
+                output.sent = t
+                bodies += sentences
+
+        self.sent += len(bodies)
+        return [f"${body}*{linebuffer.nmea_cksum(body):02X}" for body in bodies]
 
 
 class NMEASerialDevice(object):
@@ -298,9 +542,18 @@ class NMEASerialDevice(object):
         self.device.timeout = 0  # nonblocking
         fcntl.ioctl(self.device.fileno(), TIOCEXCL)
         self.b = linebuffer.LineBuffer(self.device.fileno())
+        self.lines = 0 # lines read
+        self.backlog = 0 # iterations ended with lines left in the buffer
+        self.recv_time = 0 # monotonic time of the last read
+
+    def recv(self):
+        # read all available data into the line buffer
+        self.recv_time = time.monotonic()
+        return self.b.recv()
 
     def readline(self):
-        return self.b.readline_nmea()
+        # next buffered line, does not read the device
+        return self.b.line_nmea()
 
     def close(self):
         self.device.close()
@@ -308,10 +561,37 @@ class NMEASerialDevice(object):
     def write(self,msg):
         self.device.write(msg.encode())
 
+def read_client_settings():
+    """read_client_settings : read tcp client settings
+
+    Returns:
+        dict: client ip address or 'default' -> settings, see NMEA_CLIENT_DEFAULT
+    """
+    settings = {'default': NMEA_CLIENT_DEFAULT}
+    clientsfilename = PILOT_DIR + 'cypilot_nmea_clients.conf'
+    try:
+        file = open(clientsfilename)
+        settings.update(pyjson.load(file))
+        file.close()
+    except Exception as e: # pylint: disable=broad-except
+        print('failed to read nmea clients file:', clientsfilename, e)
+        try:
+            file = open(clientsfilename, 'w')
+            file.write(pyjson.dumps(settings, indent=4) + '\n')
+            file.close()
+        except Exception as ew: # pylint: disable=broad-except
+            print('Exception writing default values to nmea clients file:', clientsfilename, ew)
+    return settings
+
 NMEASOCKETUID = 0
 
 class NMEASocket(LineBufferedNonBlockingSocket):
-    def __init__(self, connection, address):
+    """NMEASocket : tcp client of the nmea bridge
+
+    Lines relayed to the clients are encoded once and the same bytes object is
+    queued for every client, the queue is sent with one sendmsg (writev) call.
+    """
+    def __init__(self, connection, address, settings=None):
         super(NMEASocket, self).__init__(connection, address)
 
         global NMEASOCKETUID
@@ -319,9 +599,99 @@ class NMEASocket(LineBufferedNonBlockingSocket):
         NMEASOCKETUID += 1
         self.nmea_client = None
 
+        settings = dict(NMEA_CLIENT_DEFAULT, **(settings or {}))
+        self.include = set(settings['include'])
+        self.exclude = set(settings['exclude'])
+        self.periods = dict(settings['periods'])
+        self.backlog = settings['backlog']
+        self.drop = settings['drop']
+        self.relay_times = {}
+        self.ais_rate = settings['ais_rate']
+        self.ais_tokens = self.ais_rate
+        self.ais_time = 0
+
+        self.out = collections.deque() # bytes, the first one may be partly sent
+        self.out_bytes = 0
+        self.bytes_sent = 0
+        self.lines_dropped = 0
+        self.lines_filtered = 0
+
     def readline(self):
         return self.b.readline_nmea()
 
+    def relay(self, data, sentence, t):
+        """relay : queue an encoded line unless filtered out
+
+        Args:
+            data (bytes): line with terminator, shared with the other clients
+            sentence (string): sentence id, None to bypass the filters
+            t (float): monotonic time
+        """
+        if sentence is not None:
+            if (self.include and sentence not in self.include) or sentence in self.exclude:
+                self.lines_filtered += 1
+                return
+            period = self.periods.get(sentence)
+            if period:
+                if t - self.relay_times.get(sentence, -period) < period:
+                    self.lines_filtered += 1
+                    return
+                self.relay_times[sentence] = t
+
+        if self.out_bytes + len(data) > self.backlog:
+            if self.drop == 'disconnect':
+                print('overflow in nmea socket', self.address, self.out_bytes)
+                self.close()
+            self.lines_dropped += 1
+            return
+        self.out.append(data)
+        self.out_bytes += len(data)
+
+    def relay_ais(self, data, t):
+        """relay_ais : queue a complete AIS message within the client AIS rate
+
+        Args:
+            data (bytes): message lines with terminators, shared with the other clients
+            t (float): monotonic time
+        """
+        if self.ais_rate:
+            self.ais_tokens = min(self.ais_rate, self.ais_tokens + (t - self.ais_time) * self.ais_rate)
+            self.ais_time = t
+            if self.ais_tokens < 1:
+                self.lines_filtered += 1
+                return
+            self.ais_tokens -= 1
+        self.relay(data, 'VDM', t)
+
+    def write(self, data):
+        self.relay(data.encode(), None, 0)
+
+    def flush(self):
+        if not self.out or not self.socket:
+            return
+        try:
+            count = self.socket.sendmsg(list(itertools.islice(self.out, NMEA_IOV_MAX)))
+        except BlockingIOError:
+            return
+        except Exception as e:
+            print('nmea socket exception', self.address, e, os.getpid())
+            self.close()
+            return
+
+        self.bytes_sent += count
+        self.out_bytes -= count
+        while count:
+            data = self.out[0]
+            if count < len(data):
+                self.out[0] = memoryview(data)[count:]
+                break
+            count -= len(data)
+            self.out.popleft()
+
+    def stats(self):
+        return {'sent': self.bytes_sent, 'queued': self.out_bytes,
+                'dropped': self.lines_dropped, 'filtered': self.lines_filtered}
+
 class Nmea(object):
     def __init__(self, sensors):
         global SOURCE_PRIORITY
@@ -339,8 +709,17 @@ class Nmea(object):
         self.poller.register(self.process_fd, select.POLLIN)
 
         self.device_fd = {}
+        self.pending = [] # devices with lines left in their buffer
+        self.backlog = self.client.register(Value('nmea.backlog', 0))
+        self.dropped = self.client.register(Value('nmea.dropped', 0)) # bytes of overlong lines
+
+        self.dispatcher = NmeaDispatcher(self.serial_eligible)
+        for name in NMEA_SENSORS:
+            sensors.sensors[name].source_listeners.append(self.dispatcher.invalidate)
 
-        self.nmea_times = {'wind':0, 'rudder':0, 'imu':0, 'gps':0, 'sow':0}
+        self.output = NmeaOutputScheduler(self.client.values.values)
+        self.relay_times = {}
+        self.relay_lines = []
 
         self.list_serials = serials.list_serials("nmea")
         self.devices = []
@@ -391,16 +770,33 @@ class Nmea(object):
                 for name in msgs:
                     self.sensors.write(name, msgs[name], 'tcp')
 
-    def read_serial_device(self, device, serial_msgs):
-        t = time.monotonic()
-        line = device.readline()
-        if not line:
-            return
+    def read_serial_device(self, device, serial_msgs, lines, deadline):
+        # process buffered lines of a pending device within budgets,
+        # return the number of lines processed
+        deadline = min(deadline, time.monotonic() + NMEA_DEVICE_TIME)
+        lines = min(lines, NMEA_DEVICE_LINES)
+        count = 0
+        self.pending.remove(device)
+        while count < lines:
+            line = device.readline()
+            if not line:
+                break
+            count += 1
+            t = time.monotonic()
+            self.read_serial_line(device, line, serial_msgs, t)
+            if t > deadline:
+                self.pending.append(device) # other devices first next time
+                break
+        else:
+            self.pending.append(device)
+        device.lines += count
+        return count
 
+    def read_serial_line(self, device, line, serial_msgs, t):
         # AIS
         if line[0] == '!' :
             if self.sockets:
-                self.pipe.send(line)
+                self.relay(line)
             return
         
         # NMEA
@@ -410,155 +806,280 @@ class Nmea(object):
             return
         
         if self.sockets:
-            dt = t - self.nmea_times[nmea_name] if nmea_name in self.nmea_times else 1
+            dt = t - self.relay_times[nmea_name] if nmea_name in self.relay_times else 1
             if dt > .25:
-                self.pipe.send(line)
-                self.nmea_times[nmea_name] = t
+                self.relay(line)
+                self.relay_times[nmea_name] = t
 
-        parsers = []
+        # parse the nmea line, and update serial messages
+        result = self.dispatcher.parse(line, device.path[0])
+        if result:
+            name, msg = result
+            msg['rx'] = device.recv_time
+            serial_msgs[name] = msg
 
+    def serial_eligible(self, name, device):
         # only process if
         # 1) current source is lower priority
         # 2) we do not have a source yet
         # 3) this the correct device for this data
-        for name, parser in NMEA_PARSERS.items():
-            name_device = self.sensors.sensors[name].device
-            current_source = self.sensors.sensors[name].source.value
-            if SOURCE_PRIORITY[current_source] > SOURCE_PRIORITY['serial'] or not name_device or name_device[2:] == device.path[0]:
-                parsers.append(parser)
-
-        # parse the nmea line, and update serial messages
-        for parser in parsers:
-            result = parser(line)
-            if result:
-                name, msg = result
-                if name:
-                    msg['device'] = line[1:3]+device.path[0]
-                    serial_msgs[name] = msg
-                break
+        sensor = self.sensors.sensors[name]
+        return SOURCE_PRIORITY[sensor.source.value] > SOURCE_PRIORITY['serial'] or \
+            not sensor.device or sensor.device[2:] == device
+
+    def relay(self, line):
+        # relay a received line to tcp sockets, lines are sent in one message per poll
+        self.relay_lines.append(line)
+
+    def send_relay_lines(self):
+        lines = self.relay_lines
+        self.relay_lines = []
+        # from the worker thread if any
+        worker = self.sensors.worker
+        if worker:
+            worker.call(self.send_lines, lines)
+        else:
+            self.send_lines(lines)
+
+    def send_lines(self, lines):
+        """send_lines : send lines to the tcp bridge, batched in pipe messages
+
+        A write of at most PIPE_BUF bytes to the pipe is atomic: the batch is
+        either written whole or dropped if the pipe is full, never cut.
+
+        Args:
+            lines (list): lines without terminator
+        """
+        batch, size = [], 0
+        for line in lines:
+            length = len(line) + line.count('\\') + 4 # json escapes and \r\n separator
+            if batch and size + length > NMEA_PIPE_MSG_SIZE:
+                self.pipe.send('\r\n'.join(batch))
+                batch, size = [], 0
+            batch.append(line)
+            size += length
+        if batch:
+            self.pipe.send('\r\n'.join(batch))
 
     def poll(self):
 
         # 1- read nmea serial messages
         t1 = time.monotonic()
         serial_msgs = {}
-        while True:
-            events = self.poller.poll(0)
-            if not events:
+        for fd, flag in self.poller.poll(0):
+            if fd == self.process_fd:
+                if flag != select.POLLIN:
+                    print('nmea got flag for process pipe:', flag)
+                else:
+                    self.read_process_pipe()
+            elif flag == select.POLLIN:
+                device = self.device_fd[fd]
+                device.recv()
+                if device not in self.pending:
+                    self.pending.append(device)
+
+        # lines of all devices, oldest backlog first, within the iteration budget
+        lines, deadline = NMEA_LINES, t1 + NMEA_TIME
+        for device in list(self.pending):
+            if lines <= 0 or time.monotonic() > deadline:
                 break
-            while events:
-                event = events.pop()
-                fd, flag = event
-                if fd == self.process_fd:
-                    if flag != select.POLLIN:
-                        print('nmea got flag for process pipe:', flag)
-                    else:
-                        self.read_process_pipe()
-                elif flag == select.POLLIN:
-                    self.read_serial_device(self.device_fd[fd], serial_msgs)
+            lines -= self.read_serial_device(device, serial_msgs, lines, deadline)
+        for device in self.pending:
+            device.backlog += 1
+        self.backlog.update(len(self.pending))
+        self.dropped.update(sum(device.b.dropped for device in self.device_fd.values()))
+        if self.relay_lines:
+            self.send_relay_lines()
 
         # 2- write messages to sensors
         t2 = time.monotonic()
         for name, msg in serial_msgs.items():
             self.sensors.write(name, msg, 'serial')
 
-        # 3- encode IMU/GPS/WIND/RUDDER data and send messages to TCP and optionaly to serial ports
+        # 3- check nmea poll time
         t3 = time.monotonic()
-        nt = time.monotonic()
-
-        # Send IMU messages
-        dt = nt - self.nmea_times['imu']
-        values = self.client.values.values
-        if dt > NMEA_TXPERIOD_IMU:
-            # pitch and roll
-            if self.sockets or 'XDR' in self.mdevices and 'imu.pitch' in values:
-                pitch = values['imu.pitch'].value
-                roll = values['imu.roll'].value
-                if pitch and roll:
-                    self.send_nmea((TALKER_IMU + 'XDR,A,%.3f,D,PTCH') % pitch)
-                    self.send_nmea((TALKER_IMU + 'XDR,A,%.3f,D,ROLL') % roll)
-            # heading
-            if self.sockets or 'HDM' in self.mdevices and 'imu.heading' in values:
-                heading = values['imu.heading'].value
-                if heading:
-                    self.send_nmea((TALKER_IMU + 'HDM,%.3f,M') % heading)
-            self.nmea_times['imu'] = nt
-
-        # Send GPS to sockets
-        dt = nt - self.nmea_times['gps']
-        if dt > NMEA_TXPERIOD_GPS:
-            if self.sockets or 'RMC' in self.mdevices:
-                lat = self.sensors.gps.lat.value
-                lon = self.sensors.gps.lon.value
-                speed = self.sensors.gps.speed.value
-                track = self.sensors.gps.track.value
-                if lat and lon:
-                    today = datetime.datetime.today()
-                    utc = datetime.datetime.utcnow().strftime("%H%M%S.%f")[:-4]
-                    lat_min = (abs(lat) - abs(int(lat))) * 60
-                    lon_min = (abs(lon) - abs(int(lon))) * 60
-                    self.send_nmea((TALKER_GPS + 'RMC,%s,A,%02d%07.4f,%c,%03d%07.4f,%c,%.2f,%.2f,%02d%02d%02d,,,A') % ( \
-                        utc, \
-                        abs(lat), lat_min, 'N' if lat >= 0 else 'S', \
-                        abs(lon), lon_min, 'E' if lat >= 0 else 'W', \
-                        speed, (track if track > 0 else 360 + track), \
-                        today.day, today.month, today.year % 100))
-                    self.send_nmea((TALKER_GPS + 'GLL,%02d%07.4f,%c,%03d%07.4f,%c,%s,A') % ( \
-                        abs(lat), lat_min, 'N' if lat >= 0 else 'S', \
-                        abs(lon), lon_min, 'E' if lat >= 0 else 'W', \
-                        utc ))
-            self.nmea_times['gps'] = nt
-
-        # Send wind messages
-        dt = nt - self.nmea_times['wind']
-        if dt > NMEA_TXPERIOD_WIND:
-            if self.sockets or 'MWV' in self.mdevices:
-                wind = self.sensors.wind
-                direction = wind.direction.value
-                speed = wind.speed.value
-                if direction and speed:
-                    self.send_nmea((TALKER_WIND + 'MWV,%.3f,R,%.3f,N,A') % (direction, speed))
-            self.nmea_times['wind'] = nt
-
-        # Send rudder messages
-        dt = nt - self.nmea_times['rudder']
-        if dt > NMEA_TXPERIOD_RUDDER:
-            if self.sockets or 'RSA' in self.mdevices:
-                angle = self.sensors.rudder.angle.value
-                if angle:
-                    self.send_nmea((TALKER_RUDDER + 'RSA,%.3f,A,,') % angle)
-            self.nmea_times['rudder'] = nt
-
-        # 4- check nmea poll time
-        t4 = time.monotonic()
-        if t4 - t1 > .1 and self.start_time - t1 > 1:
-            print('nmea poll times', self.start_time-t1, t2-t1, t3-t2, t4-t3)
-
-    def send_nmea(self, msg):
-        # Complete message with header and checksum
-        msg = f"${msg}*{linebuffer.nmea_cksum(msg):02X}"
-
-        # Send messages to serial ports
-        mtype = msg[3:6]
-        if mtype in self.mdevices:
-            for sdevice in self.mdevices[mtype]:
-                try:
-                    sdevice.write(msg + '\r\n')
-                except Exception as e:
-                    print('failed to send on serial port nmea message', mtype, e)
-        # Send messages to TCP
+        if t3 - t1 > .1 and self.start_time - t1 > 1:
+            print('nmea poll times', self.start_time-t1, t2-t1, t3-t2)
+
+    def poll_output(self):
+        # encode IMU/GPS/WIND/RUDDER data and send messages to TCP and optionaly to serial ports
+        # this does not need realtime priority : called from the worker thread if any
+        t0 = time.monotonic()
+        msgs = self.output.poll(t0, lambda sentence: self.sockets or sentence in self.mdevices)
+        if not msgs:
+            return
+
+        # one write per serial port
+        device_msgs = {}
+        for msg in msgs:
+            for sdevice in self.mdevices.get(msg[3:6], []):
+                device_msgs.setdefault(sdevice, []).append(msg)
+        for sdevice, dmsgs in device_msgs.items():
+            try:
+                sdevice.write('\r\n'.join(dmsgs) + '\r\n')
+            except Exception as e:
+                print('failed to send on serial port nmea messages', sdevice.path[0], e)
+
+        # as few pipe messages as possible to TCP, the bridge appends the last line terminator
         if self.sockets:
-            self.pipe.send(msg)
+            self.send_lines(msgs)
+
+        t1 = time.monotonic()
+        if t1 - t0 > .1:
+            print('nmea output time', t1-t0)
+
+class NmeaClientConnector(object):
+    """NmeaClientConnector : outbound connection to the nmea.client host:port
+
+    The host name is resolved by a thread and the socket connects without blocking,
+    registered for POLLOUT on the bridge poller. Failed attempts are retried with an
+    exponential backoff and jitter. The connection state is published as a value:
+    disabled, resolving, connecting, connected or backoff.
+
+    Args:
+        poller (select.poll): poller of the bridge
+        fd_to_socket (dict): fd -> object of the bridge poller
+        state (Value): connection state
+        timeout (float): resolution and connection timeout in seconds
+    """
+    def __init__(self, poller, fd_to_socket, state, timeout=NMEA_CLIENT_TIMEOUT):
+        self.poller = poller
+        self.fd_to_socket = fd_to_socket
+        self.state = state
+        self.timeout = timeout
+        self.address = '' # host:port
+        self.socket = None
+        self.resolved = None # address tuple or exception, set by the resolver thread
+        self.start_time = 0
+        self.retry_time = 0
+        self.backoff = NMEA_CLIENT_BACKOFF_MIN
+        self.state.update('disabled')
+
+    def busy(self):
+        return self.state.value not in ['disabled', 'connected']
+
+    def poll(self, address, t):
+        """poll : advance the connection, called on each bridge poll while not connected
+
+        Args:
+            address (string): host:port to connect to
+            t (float): monotonic time
+
+        Returns:
+            socket: connected socket, or None
+        """
+        if address != self.address:
+            self.cancel()
+            self.address = address
+            self.backoff = NMEA_CLIENT_BACKOFF_MIN
+            self.retry_time = t
+            self.state.update('disabled')
+
+        if ':' not in address:
+            return None
+
+        state = self.state.value
+        if state in ['disabled', 'backoff', 'connected']: # connected: the connection was lost
+            if t >= self.retry_time:
+                self.resolve(t)
+        elif state == 'resolving':
+            if self.resolved is None:
+                if t - self.start_time > self.timeout:
+                    self.failed(t, 'resolution timeout')
+            elif isinstance(self.resolved, Exception):
+                self.failed(t, self.resolved)
+            else:
+                return self.connect(t)
+        elif state == 'connecting':
+            if t - self.start_time > self.timeout:
+                self.failed(t, 'connection timeout')
+        return None
+
+    def resolve(self, t):
+        self.state.update('resolving')
+        self.start_time = t
+        self.resolved = None
+        try:
+            host, port = self.address.rsplit(':', 1)
+            port = int(port)
+        except ValueError as e:
+            self.failed(t, e)
+            return
+
+        def resolver():
+            try:
+                self.resolved = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+            except Exception as e:
+                self.resolved = e
+        threading.Thread(target=resolver, daemon=True).start()
+
+    def connect(self, t):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        err = self.socket.connect_ex(self.resolved)
+        if err == 0:
+            return self.connected()
+        if err != errno.EINPROGRESS:
+            self.failed(t, os.strerror(err))
+            return None
+        self.state.update('connecting')
+        self.start_time = t
+        self.fd_to_socket[self.socket.fileno()] = self
+        self.poller.register(self.socket, select.POLLOUT)
+        return None
+
+    def event(self, t):
+        """event : poller event on the connecting socket
+
+        Returns:
+            socket: connected socket, or None
+        """
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self.unregister()
+        if err:
+            self.failed(t, os.strerror(err))
+            return None
+        return self.connected()
+
+    def connected(self):
+        sock, self.socket = self.socket, None
+        self.state.update('connected')
+        self.backoff = NMEA_CLIENT_BACKOFF_MIN
+        print('nmea client connected to', self.address)
+        return sock
+
+    def failed(self, t, reason):
+        print('nmea client failed to connect to', self.address, ':', reason)
+        self.cancel()
+        self.lost(t)
+
+    def lost(self, t):
+        # retry after a random delay around the current backoff, then double it
+        self.state.update('backoff')
+        self.retry_time = t + self.backoff * (.5 + random.random())
+        self.backoff = min(2 * self.backoff, NMEA_CLIENT_BACKOFF_MAX)
+
+    def unregister(self):
+        fd = self.socket.fileno()
+        if fd in self.fd_to_socket:
+            self.poller.unregister(fd)
+            del self.fd_to_socket[fd]
+
+    def cancel(self):
+        if self.socket:
+            self.unregister()
+            self.socket.close()
+            self.socket = None
+
 
 class nmeaBridge(object):
     def __init__(self, server):
         self.client = cypilotClient(server)
         self.pipe, self.pipe_out = non_blocking_pipe('nmea pipe')
-        self.process = multiprocessing.Process(target=self.nmea_process, daemon=True, name='nmeaBridge')
-        self.process.start()
+        self.process = ForkedHelper(target=self.nmea_process, daemon=True, name='nmeaBridge')
         self.client_socket = None
         self.nmea_client = None
-        self.failed_nmea_client_time = 0
+        self.connector = None
         self.msgs = None
         self.sockets = []
         self.server = None
@@ -566,11 +1087,24 @@ class nmeaBridge(object):
         self.addresses = {}
         self.poller = None
         self.fd_to_socket = {}
+        self.dispatcher = NmeaDispatcher(self.tcp_eligible)
+        self.client_settings = {}
+        self.relay_stats = None
+        self.relay_stats_time = 0
+        self.ais = None
+        self.ais_stats = None
+        self.ais_devices = {}
+        # forked last, the process needs all attributes
+        self.process.start()
 
     def setup(self):
         self.sockets = []
 
         self.nmea_client = self.client.register(Property('nmea.client', '', persistent=True))
+        self.relay_stats = self.client.register(JSONValue('nmea.clients', {}))
+        self.client_settings = read_client_settings()
+        self.ais = AisStream()
+        self.ais_stats = self.client.register(JSONValue('nmea.ais', {}))
 
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.setblocking(0)
@@ -589,7 +1123,6 @@ class nmeaBridge(object):
 
         self.server.listen(5)
 
-        self.failed_nmea_client_time = 0
         self.last_values = {'gps.source': 'none', 'wind.source': 'none', 'rudder.source': 'none', 'apb.source': 'none', 'sow.source': 'none'}
         for name in self.last_values:
             self.client.watch(name)
@@ -606,6 +1139,22 @@ class nmeaBridge(object):
         self.poller.register(self.pipe, select.POLLIN)
         self.fd_to_socket[self.pipe.fileno()] = self.pipe
 
+        self.connector = NmeaClientConnector(self.poller, self.fd_to_socket,
+                                             self.client.register(StringValue('nmea.client_state', 'disabled')))
+
+        # AIS receivers are read here, AIS data never goes through the autopilot process
+        self.ais_devices = {}
+        for serial_device in serials.list_serials('ais'):
+            try:
+                device = NMEASerialDevice((serial_device.path, serial_device.baudrate))
+            except Exception as e:
+                print('failed to open', serial_device.path, 'for ais data', e)
+                continue
+            fd = device.device.fileno()
+            self.ais_devices[fd] = device
+            self.fd_to_socket[fd] = device
+            self.poller.register(fd, select.POLLIN)
+
         self.msgs = {}
 
     def setup_watches(self, watch=True):
@@ -613,24 +1162,42 @@ class nmeaBridge(object):
         for name in watchlist:
             self.client.watch(name, watch)
 
-    def receive_nmea(self, line, device):
-        parsers = []
-
+    def tcp_eligible(self, name, device):
         # Optimization : avoid parsing sentences here that would be discarded
         # in the main process anyway because they are already handled by a source
         # with a higher priority than tcp
-        tcp_priority = SOURCE_PRIORITY['tcp']
-        for name, parser in NMEA_PARSERS.items():
-            if SOURCE_PRIORITY[self.last_values[name + '.source']] >= tcp_priority:
-                parsers.append(parser)
-
-        for parser in parsers:
-            result = parser(line)
-            if result:
-                name, msg = result
-                msg['device'] = line[1:3] + device
-                self.msgs[name] = msg
-                return
+        return SOURCE_PRIORITY[self.last_values[name + '.source']] >= SOURCE_PRIORITY['tcp']
+
+    def receive_nmea(self, line, device):
+        result = self.dispatcher.parse(line, device)
+        if result:
+            name, msg = result
+            msg['rx'] = time.monotonic()
+            self.msgs[name] = msg
+
+    def relay_nmea(self, line, t, source=None):
+        # relay a line to all tcp sockets but its source, encoded once for all of them
+        if len(self.sockets) > (source is not None):
+            data = (line + '\r\n').encode()
+            for sock in self.sockets:
+                if sock != source:
+                    sock.relay(data, line[3:6], t)
+
+    def receive_ais(self, line, t, source=None):
+        lines = self.ais.receive(line, t)
+        if not lines:
+            return
+        data = ''.join(line + '\r\n' for line in lines).encode()
+        for sock in self.sockets:
+            if sock != source:
+                sock.relay_ais(data, t)
+
+    def lost_ais_device(self, device, fd):
+        print('lost ais device', device.path[0])
+        self.poller.unregister(fd)
+        del self.ais_devices[fd]
+        del self.fd_to_socket[fd]
+        device.close()
 
     def new_socket_connection(self, connection, address):
         max_connections = 10
@@ -643,7 +1210,8 @@ class nmeaBridge(object):
             self.setup_watches()
             self.pipe.send('sockets')
 
-        sock = NMEASocket(connection, address)
+        host = address[0] if isinstance(address, tuple) else address.split(':')[0]
+        sock = NMEASocket(connection, address, self.client_settings.get(host, self.client_settings.get('default')))
         self.sockets.append(sock)
 
         self.addresses[sock] = address
@@ -656,6 +1224,7 @@ class nmeaBridge(object):
     def socket_lost(self, sock, fd):
         if sock == self.client_socket:
             self.client_socket = False
+            self.connector.lost(time.monotonic())
         try:
             self.sockets.remove(sock)
         except:
@@ -663,6 +1232,7 @@ class nmeaBridge(object):
             return
 
         self.pipe.send('lostsocket' + str(sock.uid))
+        self.dispatcher.invalidate()
         if not self.sockets:
             self.setup_watches(False)
             self.pipe.send('nosockets')
@@ -684,27 +1254,19 @@ class nmeaBridge(object):
 
         sock.close()
 
-    def connect_client(self):
-        if ':' not in self.nmea_client.value:
-            return
-        host, port = self.nmea_client.value.split(':')
-        port = int(port)
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tc0 = time.monotonic()
-            s.connect((host, port))
-            print('connected to', host, port, 'in', time.monotonic() - tc0, 'seconds')
-            self.client_socket = self.new_socket_connection(s, self.nmea_client.value)
+    def connect_client(self, s):
+        self.client_socket = self.new_socket_connection(s, self.nmea_client.value)
+        if self.client_socket:
             self.client_socket.nmea_client = self.nmea_client.value
-        except Exception as e:
-            print('nmea client failed to connect to', self.nmea_client.value, ':', e)
+        else:
             self.client_socket = False
+            self.connector.lost(time.monotonic())
 
     def nmea_process(self):
         print('nmea process', os.getpid())
         self.setup()
         while True:
-            timeout = 100 if self.sockets else 10000
+            timeout = 100 if self.sockets or self.connector.busy() else 10000
             self.poll(timeout)
 
     def receive_pipe(self):
@@ -712,9 +1274,15 @@ class nmeaBridge(object):
             msg = self.pipe.recv()
             if not msg:
                 return
-            # relay nmea message from server to all tcp sockets
-            for sock in self.sockets:
-                sock.write(msg + '\r\n')
+            # relay nmea messages from server to all tcp sockets, a message may hold several lines
+            t = time.monotonic()
+            for line in msg.split('\r\n'):
+                if line[:1] == '!':
+                    self.receive_ais(line, t)
+                    continue
+                data = (line + '\r\n').encode()
+                for sock in self.sockets:
+                    sock.relay(data, line[3:6], t)
 
     def poll(self, timeout=0):
         t0 = time.monotonic()
@@ -727,7 +1295,30 @@ class nmeaBridge(object):
         while events:
             fd, flag = events.pop()
             sock = self.fd_to_socket[fd]
-            if flag & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+            if fd in self.ais_devices:
+                if flag & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+                    self.lost_ais_device(sock, fd)
+                    continue
+                sock.recv()
+                t = time.monotonic()
+                while True:
+                    line = sock.readline()
+                    if not line:
+                        break
+                    if line[0] == '!':
+                        if self.sockets:
+                            self.receive_ais(line, t)
+                        continue
+                    # AIS receivers may also output their GPS, used as tcp data
+                    self.receive_nmea(line, sock.path[0])
+                    self.relay_nmea(line, t)
+            elif sock == self.connector:
+                # before the error flags: a refused connection reports POLLERR|POLLHUP,
+                # the connector fails and unregisters its socket
+                s = self.connector.event(time.monotonic())
+                if s:
+                    self.connect_client(s)
+            elif flag & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
                 if sock == self.server:
                     print('nmea bridge lost server connection')
                     exit(2)
@@ -745,16 +1336,17 @@ class nmeaBridge(object):
                 if not sock.recvdata():
                     self.socket_lost(sock, fd)
                 else:
+                    t = time.monotonic()
                     while True:
                         line = sock.readline()
                         if not line:
                             break
+                        if line[0] == '!':
+                            self.receive_ais(line, t, sock)
+                            continue
                         self.receive_nmea(line, 'socket' + str(sock.uid))
                         # relay nmea message from incoming socket to all other tcp sockets
-                        # this could be time consuming, we should make that optionnal (TBD)
-                        for tsock in self.sockets:
-                            if tsock != sock:
-                                tsock.write(line + '\r\n')
+                        self.relay_nmea(line, t, sock)
             else:
                 print('nmea bridge unhandled poll flag', flag)
 
@@ -770,6 +1362,8 @@ class nmeaBridge(object):
         # receive cypilot messages
         cypilot_msgs = self.client.receive()
         for name, value in cypilot_msgs.items():
+            if name.endswith('.source') and self.last_values.get(name) != value:
+                self.dispatcher.invalidate(name[:-7])
             self.last_values[name] = value
 
         t4 = time.monotonic()
@@ -779,25 +1373,130 @@ class nmeaBridge(object):
             sock.flush()
 
         t5 = time.monotonic()
+        if t5 - self.relay_stats_time > 5:
+            self.relay_stats.update({str(self.addresses.get(sock)): sock.stats() for sock in self.sockets})
+            self.ais_stats.update(self.ais.stats())
+            self.relay_stats_time = t5
 
         # reconnect client tcp socket
         if self.client_socket:
             if self.client_socket.nmea_client != self.nmea_client.value:
                 self.client_socket.socket.close()  # address has changed, close connection
-        elif t5 - self.failed_nmea_client_time > 20:
-            try:
-                self.connect_client()
-            except Exception as e:
-                print('failed to create nmea socket as host:port', self.nmea_client.value, e)
-                self.failed_nmea_client_time = t5
+        else:
+            s = self.connector.poll(self.nmea_client.value, t5)
+            if s:
+                self.connect_client(s)
 
         t6 = time.monotonic()
 
         if t6-t1 > .1:
             print(f"NMEA process overtime {t6-t1:.2f} : poll={t1-t0:.2f}, event={t2-t1:.2f}, send={t3-t2:.2f}, receive={t4-t3:.2f}, flush={t5-t4:.2f}, connect={t6-t5:.2f}")
 
+NMEA_BENCHMARK_LINES = ['$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A',
+                        '$WIMWV,214.8,R,0.1,K,A*28',
+                        '$WIMWV,214.8,R,0.1,K*28',
+                        '$IIVWR,045.0,L,12.6,N,6.5,M,23.3,K*52',
+                        '$AGRSA,-3.500,A,,*7C',
+                        '$GPAPB,A,A,0.10,R,N,V,V,011,M,DEST,011,M,011,M*3C',
+                        '$VWVHW,,T,,M,6.50,N,12.04,K*47',
+                        '$IILWY,A,2.5*3E']
+
+def nmea_benchmark(count=20000):
+    """nmea_benchmark : compare python parsers and native decoders
+
+    Args:
+        count (int): number of times each sentence is parsed
+    """
+    lines = [add_nmea_cksum(line[1:line.index('*')]) for line in NMEA_BENCHMARK_LINES]
+    if not NMEA_DECODE:
+        print('linebuffer extension built without native nmea decoders')
+        return
+
+    for line in lines:
+        result, expected = NMEA_DECODE(line), NMEA_DISPATCH[line[3:6]][1](line)
+        if result != expected:
+            print('native decoder mismatch', line, result, expected)
+
+    parsers = [(line, NMEA_DISPATCH[line[3:6]][1]) for line in lines]
+    t0 = time.monotonic()
+    for __ in range(count):
+        for line, parser in parsers:
+            parser(line)
+    t1 = time.monotonic()
+    for __ in range(count):
+        for line in lines:
+            NMEA_DECODE(line)
+    t2 = time.monotonic()
+
+    n = count * len(lines)
+    print(f"python parsers : {(t1-t0)*1e6/n:.2f} us per sentence")
+    print(f"native decoders : {(t2-t1)*1e6/n:.2f} us per sentence, {(t1-t0)/(t2-t1):.1f} times faster")
+
+def nmea_client_check(timeout=1):
+    """nmea_client_check : connect to a local listening socket which never accepts,
+    then to a closed port
+
+    The listen backlog is filled first so that the connection stays in progress: the
+    connector must never block, time out, then retry with backoff. A refused
+    connection must fail at once and leave no socket registered on the poller.
+
+    Returns:
+        bool: True if the check passed
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    address = '127.0.0.1:%d' % server.getsockname()[1]
+    backlog = []
+    for __ in range(4):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(0)
+        s.connect_ex(server.getsockname())
+        backlog.append(s)
+
+    def check(address, duration):
+        # connector states, longest poll and poller events while connecting to address
+        fd_to_socket = {}
+        poller = select.poll()
+        connector = NmeaClientConnector(poller, fd_to_socket, StringValue('nmea.client_state', 'disabled'), timeout)
+        states, maxdt, events = [], 0, 0
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < duration:
+            t = time.monotonic()
+            if connector.poll(address, t):
+                print('nmea client check: connected to', address)
+                return None
+            for fd, __ in poller.poll(10):
+                events += 1
+                if fd_to_socket[fd].event(time.monotonic()):
+                    print('nmea client check: connected to', address)
+                    return None
+            maxdt = max(maxdt, time.monotonic() - t)
+            if not states or states[-1] != connector.state.value:
+                states.append(connector.state.value)
+            if connector.state.value == 'backoff' and fd_to_socket:
+                print('nmea client check: socket still registered in backoff')
+                return None
+        connector.cancel()
+        return states, maxdt, events
+
+    result = check(address, 3 * timeout)
+    passed = bool(result) and 'connecting' in result[0] and 'backoff' in result[0] and result[1] < .1
+    print('nmea client check, no accept:', 'passed' if passed else 'FAILED', result)
+    for s in backlog + [server]:
+        s.close()
+
+    # the port is closed now: a single refused attempt within the shortest backoff,
+    # a busy loop would report many events
+    result = check(address, .4 * NMEA_CLIENT_BACKOFF_MIN)
+    refused = bool(result) and 'backoff' in result[0] and result[1] < .1 and result[2] <= 1
+    print('nmea client check, refused:', 'passed' if refused else 'FAILED', result)
+    return passed and refused
+
 def nmea_main():
     print('Version:', cypilot.pilot_path.STRVERSION)
+    nmea_benchmark()
+    nmea_client_check()
 
 
 if __name__ == '__main__':
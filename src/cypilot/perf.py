@@ -21,14 +21,12 @@ renvoyer les valeur sur le serveur
 import cypilot.pilot_path # pylint: disable=unused-import
 from client import cypilotClient
 from cypilot.pilot_values import Property, SensorValue, EnumSetting, BooleanSetting
-from multiprocessing import Process
+import os
 import time
 import json
-import pandas as pd
 import csv
-from scipy import interpolate
-from scipy.spatial.qhull import QhullError
 import math
+import helpers
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 from pilot_path import PILOT_DIR
@@ -36,21 +34,28 @@ from pilot_path import PILOT_DIR
 
 class Perf():
 
-    def __init__(self):
+    def __init__(self, launch=True):
         self.polar_path = PILOT_DIR + 'interpolate_polar.csv'
         self.sailect_path = PILOT_DIR + 'interpolate_sailect.sailselect'
         self.process = None # allow to gracefully terminate autopilot if process creation was not successful (missing csv, etc.)
 
+        if not launch:
+            return
+        # pandas and scipy are only imported by the helper process
         try:
-            self.polar_f = self.create_polar_function()
-            self.sailect_data = self.sailect_data_extract()
-            self.process = Process(target=self.tprocess, daemon=True, name='Perf')
-            self.process.start()
+            for path in [self.polar_path, self.sailect_path]:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+            self.process = helpers.launch('perf', 'perf_process', name='Perf')
 
         except Exception as e:
             print(e)
             print("Performance data won't be available")
 
+    def load(self):
+        self.polar_f = self.create_polar_function()
+        self.sailect_data = self.sailect_data_extract()
+
     def saildef_data_extract(self):
         saildef = {}
         with open(PILOT_DIR + "boat_config.json", 'r') as file:
@@ -58,6 +63,7 @@ class Perf():
         return saildef
 
     def sailect_data_extract(self):
+        import pandas as pd
         with open(self.sailect_path) as f:
             sailect = pd.read_csv(f, delimiter=";")
             sailect.rename(columns={"TWA\\TWS": "TWA"}, inplace=True)
@@ -86,9 +92,12 @@ class Perf():
                                 if polar[i][j] != None: 
                                     #remove all None value
                                     speed_list.append([float(polar[i][0]),float(polar[0][j]),float(polar[i][j])])
+        import pandas as pd
         return pd.DataFrame(speed_list, columns=["TWA","TWS","BSP"])
 
     def create_polar_function(self):
+        from scipy import interpolate
+        from scipy.spatial.qhull import QhullError
         df = self.polar_data_extract()
         twatws = df[['TWA', 'TWS']].to_numpy()
         bsp = df["BSP"].to_numpy()
@@ -236,6 +245,18 @@ class Perf():
                 except (KeyError, AttributeError):
                     pass
 
+def perf_process():
+    """perf_process : performance helper process, launched by Perf
+    """
+    perf = Perf(launch=False)
+    try:
+        perf.load()
+    except Exception as e:
+        print(e)
+        print("Performance data won't be available")
+        return
+    perf.tprocess()
+
 if __name__ == "__main__":
     p = Perf()
     print(p.process.pid)
@@ -33,6 +33,7 @@ class Value(object):
         self.watch = None
         self.client = None
         self.pwatch = False
+        self.generation = 0 # incremented on each set, see derived.py
         self.set(initial)
 
         self.info = {'type': 'Value'}
@@ -55,6 +56,7 @@ class Value(object):
         if isinstance(value, tuple):
             value = list(value)
         self.value = value
+        self.generation += 1
         if self.watch:
             if self.watch.period == 0:  # and False:   # disable immediate
                 self.client.send(self.name+'='+self.get_msg()+'\n')
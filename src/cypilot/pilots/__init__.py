@@ -1,16 +1,41 @@
-# import all scripts in this directory
+# discover pilot scripts in this directory without importing them
+#
+# importing a pilot may be expensive (learning and autotune pilots import
+# numpy/scipy/sklearn and start extra processes), so only the module source is
+# read at startup. A pilot is imported the first time it is selected.
+#
+# A pilot module defines 'pilot = PilotClass' and may define 'PILOT_NAME'
+# when the pilot name is not the module name.
 
 # pylint: disable=locally-disabled, missing-docstring, bare-except, broad-except
 
-import sys
 import os
+import ast
 import importlib
 
 import pilot_path
 
-DEFAULT = []
+DEFAULT = {} # pilot name -> module name
 
-for module in os.listdir(os.path.dirname(__file__)):
+def read_metadata(path):
+    # return pilot name if the module defines a pilot, else None
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    name = os.path.basename(path)[:-3]
+    haspilot = False
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+        for target in node.targets:
+            if not isinstance(target, ast.Name):
+                continue
+            if target.id == 'pilot':
+                haspilot = True
+            elif target.id == 'PILOT_NAME':
+                name = ast.literal_eval(node.value)
+    return name if haspilot else None
+
+for module in sorted(os.listdir(os.path.dirname(__file__))):
     if module == '__init__.py' or module[-3:] != '.py' or module.startswith('.'):
         continue
     if module == 'pilot.py':
@@ -20,15 +45,22 @@ for module in os.listdir(os.path.dirname(__file__)):
     #    continue
 
     try:
-        mod = importlib.import_module('pilots.'+module[:-3])
+        pilot_name = read_metadata(os.path.join(os.path.dirname(__file__), module))
+    except Exception as e:
+        print('ERROR reading', module, e)
+        continue
+
+    if pilot_name:
+        DEFAULT[pilot_name] = module[:-3]
+
+def load(name):
+    # import the module of a discovered pilot and return the pilot class
+    module = DEFAULT[name]
+    try:
+        mod = importlib.import_module('pilots.'+module)
     except Exception as e1:
         try:
-            mod = importlib.import_module(module[:-3])
+            mod = importlib.import_module(module)
         except Exception as e2:
-            print('ERROR loading', module, e1, ' ', e2)
-            continue
-
-    try:
-        DEFAULT.append(mod.pilot)
-    except:
-        pass
+            raise ImportError(f'{e1} {e2}') from e2
+    return mod.pilot
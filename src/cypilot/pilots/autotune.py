@@ -15,12 +15,10 @@ import cypilot.pilot_path # pylint: disable=unused-import
 from client import cypilotClient
 from cypilot.pilot_values import RangeProperty
 from pilots.simple import SimplePilot
-from multiprocessing import Process
-from scipy import interpolate
 import pyjson
 import time
-import numpy as np
 import os
+import helpers
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 
@@ -50,16 +48,14 @@ class AutotunePilot(SimplePilot):
         self.n = name
         self.ap_gain("M", 10, 1, 60)
 
-        self.autotune = Autotune(self.n)
-        self.autotune.start()
+        # the autotune process only talks to the server, numpy and scipy are imported there
+        self.autotune = helpers.launch('pilots.autotune', 'autotune_process', (self.n,), name='Autotune')
 
         self.pid.append(self.autotune.pid)
 
-class Autotune(Process):
+class Autotune(object):
 
-    def __init__(self, n, *args, **kwargs):
-        super(Autotune,self).__init__(*args, **kwargs)
-        self.daemon = True
+    def __init__(self, n):
         self.n = n
 
     def initialisation(self):
@@ -138,6 +134,8 @@ class Autotune(Process):
     def create_auto_tune(self):
         """genrate interpolation function for each gain
         """
+        import numpy as np
+        from scipy import interpolate
         # load tune tab
         if not self.load_JSON():
             return
@@ -245,6 +243,9 @@ class Autotune(Process):
                 self.mean_value()
                 self.auto_tune()
 
+def autotune_process(n):
+    Autotune(n).run()
+
 pilot = AutotunePilot
 
 if __name__ == "__main__":
@@ -29,6 +29,7 @@ class AutopilotPilot(object):
         self.ap = ap
         self.gains = {}
         self.pid = []
+        self.values = [] # registered by the autopilot loop when the pilot is selected
         self.counter = 0
         # self.frequency = self.register(RangeProperty, "period", 1, 1, 20)
 
@@ -42,7 +43,10 @@ class AutopilotPilot(object):
 
 
     def register(self, _type, name, *args, **kwargs):
-        return self.ap.client.register(_type(*(['ap.pilot.' + self.name + '.' + name] + list(args)), **kwargs))
+        # pilots may be built on the worker thread, the client only sees values from the loop
+        value = _type(*(['ap.pilot.' + self.name + '.' + name] + list(args)), **kwargs)
+        self.values.append(value)
+        return value
 
     def ap_gain(self, name, default, min_val, max_val, compute=None):
         if compute is None:
@@ -66,21 +70,22 @@ class AutopilotPilot(object):
     def compute_heading(self):
         #to add overlay without break the code, check if ap.mode_overlay.value
         #and compute ap.heading_overlay.set in function
+        #heading is only set when it changes, cmg is recomputed on change (see derived.py)
         ap = self.ap
         compass = ap.boatimu.sensor_values['heading'].value
         gps = ap.sensors.gps.track.value
 
         if ap.mode.value == 'true wind':
-            ap.heading.set(ap.true_wind_angle.value)
+            ap.heading.update(ap.true_wind_angle.value)
         elif ap.mode.value == 'wind':
-            ap.heading.set(ap.wind_angle_smoothed.value)
+            ap.heading.update(ap.wind_angle_smoothed.value)
         elif ap.mode.value == 'gps':
-            ap.heading.set(gps)
+            ap.heading.update(gps)
         elif ap.mode.value == 'compass':
-            ap.heading.set(compass)
+            ap.heading.update(compass)
         elif ap.mode.value == 'rudder angle':
             rudder = ap.client.values.values['rudder.angle'].value
-            ap.heading.set(int(rudder))
+            ap.heading.update(int(rudder))
         #forexemple:
         #if ap.mode_overlay == 'wind':
         #    wind = resolv(ap.wind_compass_offset.value - compass)
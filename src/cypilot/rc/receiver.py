@@ -9,6 +9,7 @@ import adafruit_rfm69
 # from getmac import get_mac_address as gma
 
 import cypilot.pilot_path
+import helpers
 from client import cypilotClient
 from kbhit import KBHit
 
@@ -217,17 +218,19 @@ class RemoteControlClient(RemoteControl):
     RemoteControlClient
     """
     def __init__(self, multi_processing=True, sleep_time=0.2):
-        super(RemoteControlClient, self).__init__()
-
         self.remote = None
         self.radio = None
         self.sleep = sleep_time
+        self.process = None
 
         if multi_processing:
-            import multiprocessing
-            self.process = multiprocessing.Process(target=self.tprocess, daemon=True, name='RemoteControl')
-            self.process.start()
+            # radio and server client are only created in the helper process
+            try:
+                self.process = helpers.launch('rc.receiver', 'remote_process', (sleep_time,), name='RemoteControl')
+            except Exception as e:
+                print('failed to start remote control process', e)
         else:
+            super(RemoteControlClient, self).__init__()
             self.remote = RemoteControl()
             self.radio = RadioControl()
 
@@ -239,7 +242,8 @@ class RemoteControlClient(RemoteControl):
         """
         RC Process
         """
-        self.init()
+        if not self.radio:
+            self.init()
         print('RC Poll Period ', self.sleep)
         while True:
             time.sleep(self.sleep)
@@ -273,6 +277,10 @@ class RemoteControlClient(RemoteControl):
                 self.remote.change_mode()
             del self.radio.order
 
+def remote_process(sleep_time):
+    """ Remote control helper process, launched by RemoteControlClient"""
+    RemoteControlClient(multi_processing=False, sleep_time=sleep_time).tprocess()
+
 def remote_main(sleep_time=0.2):
     """ Main remote"""
     print('Version:', cypilot.pilot_path.STRVERSION)
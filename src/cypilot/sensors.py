@@ -12,20 +12,26 @@
 # Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
 
 import time
+import datetime
+import collections
 import pyjson
 
 import cypilot.pilot_path
 
-from pilot_values import StringValue, SensorValue, RangeSetting, RangeProperty
+from pilot_values import StringValue, SensorValue, JSONValue, RangeSetting, RangeProperty
 from resolv import resolv
 
 from gpsd import gpsd
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 from pilot_path import PILOT_DIR
+from startup_profile import STARTUP
 
 SOURCE_PRIORITY = {}
 
+SAMPLE_AGE_MAX = 2 # seconds, older source timestamps are assumed to come from an unsynchronized clock
+LATENCY_PERIOD = 5 # seconds between publications of sensors.latency
+
 def init_source_priority():
     global SOURCE_PRIORITY
     # favor lower priority sources
@@ -49,14 +55,81 @@ def init_source_priority():
             print('Exception writing default values to sensor source file:', sensorsfilename, ew)
     return SOURCE_PRIORITY
 
+def parse_iso_time(text):
+    """parse_iso_time : time of an ISO 8601 UTC string as sent by gpsd or signalk (2023-06-01T10:00:00.250Z)
+
+    Returns:
+        float: seconds since the Epoch, or None if text is not a valid time
+    """
+    try:
+        return datetime.datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class SampleLatency(object):
+    """SampleLatency : latency statistics of sensor samples per source
+
+    receive : from the reception of a sample by its reader (serial line, gpsd, signalk
+    or tcp message) to Sensor.write, age : from the source timestamp to Sensor.write,
+    for sources giving one
+    """
+    def __init__(self):
+        self.stats = {} # source -> [count, receive sum, receive max, aged count, age sum, age max]
+
+    def add(self, source, sensor):
+        stats = self.stats.setdefault(source, [0, 0, 0, 0, 0, 0])
+        receive = sensor.lastupdate - sensor.receive_time
+        stats[0] += 1
+        stats[1] += receive
+        stats[2] = max(stats[2], receive)
+        if sensor.source_time:
+            age = sensor.lastupdate - sensor.sample_time
+            stats[3] += 1
+            stats[4] += age
+            stats[5] = max(stats[5], age)
+
+    def report(self):
+        """report : statistics since the last report, in milliseconds
+
+        Returns:
+            dict: source -> {'samples', 'receive', 'receive_max', 'age', 'age_max'}
+        """
+        report = {}
+        for source, (count, receive, receive_max, aged, age, age_max) in self.stats.items():
+            report[source] = {'samples': count,
+                              'receive': round(receive / count * 1000, 1), 'receive_max': round(receive_max * 1000, 1)}
+            if aged:
+                report[source]['age'] = round(age / aged * 1000, 1)
+                report[source]['age_max'] = round(age_max * 1000, 1)
+        self.stats = {}
+        return report
+
+
 class Sensor(object):
+    """Sensor : data of a sensor from the best available source
+
+    Samples are dicts of sensor fields and 'device', and optionally
+    'rx' (monotonic time the sample was received by its reader) and
+    'stamp' (source timestamp, seconds since the Epoch).
+    """
     def __init__(self, client, name):
         self.source = client.register(StringValue(name + '.source', 'none'))
         self.lastupdate = 0
+        self.receive_time = 0 # monotonic time the last sample was received
+        self.source_time = None # source timestamp of the last sample, if any
+        self.sample_time = 0 # monotonic time the last sample was measured
         self.device = None
         self.name = name
         self.client = client
         self.data_list = []
+        self.source_listeners = [] # called with the sensor name when source or device changes
+
+    def set_source(self, source, device):
+        self.source.set(source)
+        self.device = device
+        for listener in self.source_listeners:
+            listener(self.name)
 
     def write(self, data, source):
         if SOURCE_PRIORITY[self.source.value] < SOURCE_PRIORITY[source]:
@@ -67,14 +140,22 @@ class Sensor(object):
         if SOURCE_PRIORITY[self.source.value] == SOURCE_PRIORITY[source] and data['device'] != self.device:
             return False
 
-        #timestamp = data['timestamp'] if 'timestamp' in data else time.monotonic()-self.starttime
         self.update(data)
 
         if self.source.value != source:
             print('found', self.name, 'on', source, data['device'])
-            self.source.set(source)
-            self.device = data['device']
-        self.lastupdate = time.monotonic()
+            self.set_source(source, data['device'])
+        t = time.monotonic()
+        self.lastupdate = t
+        self.receive_time = self.sample_time = data.get('rx', t)
+        self.source_time = data.get('stamp')
+        if self.source_time:
+            # source clock converted to monotonic time, if it looks synchronized
+            age = time.time() - self.source_time
+            if 0 <= age < SAMPLE_AGE_MAX:
+                self.sample_time = min(self.receive_time, t - age)
+            else:
+                self.source_time = None
 
         return True
 
@@ -174,7 +255,9 @@ class gps(Sensor):
         self.speed = self.register(SensorValue, 'speed')
         self.lat = self.register(SensorValue, 'lat', fmt='%.11f')
         self.lon = self.register(SensorValue, 'lon', fmt='%.11f')
-        self.data_list = [self.track, self.speed, self.lat, self.lon]
+        self.hacc = self.register(SensorValue, 'hacc') # horizontal accuracy (m), if known
+        self.sacc = self.register(SensorValue, 'sacc') # speed accuracy (knots), if known
+        self.data_list = [self.track, self.speed, self.lat, self.lon, self.hacc, self.sacc]
 
     def update(self, data):
         # CYS +
@@ -187,6 +270,9 @@ class gps(Sensor):
         if 'lat' in data and 'lon' in data:
             self.lat.set(data['lat'])
             self.lon.set(data['lon'])
+        if 'hacc' in data:
+            self.hacc.set(data['hacc'])
+            self.sacc.set(data['sacc'])
 
     def reset(self):
         self.track.set(False)
@@ -219,13 +305,7 @@ class Sensors(object):
         global SOURCE_PRIORITY
         SOURCE_PRIORITY = init_source_priority()
 
-        # services that can receive sensor data
-        self.nmea = Nmea(self)
-        self.signalk = signalk(self)
-        self.gpsd = gpsd(self)
-        self.uwble = uwble(self)
-
-        # actual sensors supported
+        # actual sensors supported, created first as services listen to their source
         self.gps = gps(client)
         self.wind = Wind(client)
         self.rudder = Rudder(client)
@@ -234,38 +314,83 @@ class Sensors(object):
 
         self.sensors = {'gps': self.gps, 'wind': self.wind, 'rudder': self.rudder, 'apb': self.apb, 'sow': self.sow}
 
+        # services that can receive sensor data
+        with STARTUP.section('nmea'):
+            self.nmea = Nmea(self)
+        with STARTUP.section('signalk'):
+            self.signalk = signalk(self)
+        with STARTUP.section('gpsd'):
+            self.gpsd = gpsd(self)
+        with STARTUP.section('uwble'):
+            self.uwble = uwble(self)
+
+        # updates queued by the worker thread, applied by poll
+        self.inputs = collections.deque()
+        self.worker = None
+
+        self.latency = SampleLatency()
+        self.latency_value = client.register(JSONValue('sensors.latency', {}))
+        self.latency_time = time.monotonic()
+
+    def attach_worker(self, worker):
+        # move non realtime processing to the worker thread
+        self.worker = worker
+        worker.add_job(self.background_poll)
+
+    def background_poll(self):
+        t0 = time.monotonic()
+        for sensor, data in self.signalk.receive():
+            self.inputs.append((self.write, (sensor, data, 'signalk')))
+        t1 = time.monotonic()
+        for data in self.gpsd.receive():
+            self.inputs.append((self.gpsd.apply, (data,)))
+        t2 = time.monotonic()
+
+        # timeout sources
+        for __, sensor in self.sensors.items():
+            if sensor.source.value != 'none' and t2 - sensor.lastupdate > 8:
+                self.inputs.append((self.timeout, (sensor,)))
+        t3 = time.monotonic()
+
+        self.nmea.poll_output()
+        t4 = time.monotonic()
+
+        if t4-t0 >= 0.05:
+            print(f"Sensor background overtime {t4-t0:.2f} > 0.05: signalk={t1-t0:.2f}, gpsd={t2-t1:.2f}, timeout={t3-t2:.2f}, nmea={t4-t3:.2f}")
+
     def poll(self):
         t0 = time.monotonic()
         self.nmea.poll()
         t1 = time.monotonic()
-        self.signalk.poll()
-        t2 = time.monotonic()
         self.uwble.poll()
+        t2 = time.monotonic()
+        self.rudder.poll()
         t3 = time.monotonic()
-        self.gpsd.poll()
+        if not self.worker:
+            self.background_poll()
+        while self.inputs:
+            function, args = self.inputs.popleft()
+            function(*args)
         t4 = time.monotonic()
-        self.rudder.poll()
-        t5 = time.monotonic()
+        if t4 - self.latency_time > LATENCY_PERIOD:
+            self.latency_time = t4
+            self.latency_value.set(self.latency.report())
 
-        if t5-t0 >= 0.05:
-            print(f"Sensor overtime {t5-t0:.2f} > 0.05: nmea={t1-t0:.2f}, signalk={t2-t1:.2f}, uwble={t3-t2:.2f}, gpsd={t4-t3:.2f}, rudder={t5-t4:.2f}")
+        if t4-t0 >= 0.05:
+            print(f"Sensor overtime {t4-t0:.2f} > 0.05: nmea={t1-t0:.2f}, uwble={t2-t1:.2f}, rudder={t3-t2:.2f}, inputs={t4-t3:.2f}")
 
-        # timeout sources
-        t = time.monotonic()
-        for __, sensor in self.sensors.items():
-            if sensor.source.value == 'none':
-                continue
-            if t - sensor.lastupdate > 8:
-                self.lostsensor(sensor)
+    def timeout(self, sensor):
+        # the sensor may have been updated since the timeout was queued
+        if sensor.source.value != 'none' and time.monotonic() - sensor.lastupdate > 8:
+            self.lostsensor(sensor)
 
     def lostsensor(self, sensor):
         print('sensor', sensor.name, 'lost',
               sensor.source.value, sensor.device)
-        sensor.source.set('none')
+        sensor.set_source('none', None)
         for item in sensor.data_list:
             item.set(None)
         sensor.reset()
-        sensor.device = None
 
     def lostgpsd(self):
         if self.gps.source.value == 'gpsd':
@@ -275,7 +400,8 @@ class Sensors(object):
         if not sensor in self.sensors:
             print('unknown data parsed!', sensor)
             return
-        self.sensors[sensor].write(data, source)
+        if self.sensors[sensor].write(data, source):
+            self.latency.add(source, self.sensors[sensor])
 
     def lostdevice(self, device):
         # optional routine  useful when a device is
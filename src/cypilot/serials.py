@@ -28,7 +28,7 @@ class SerialDevice:
             output_msgs = []
         self.path = path                    # device path
         self.baudrate = baudrate            # baud rate
-        self.protocol = protocol            # protocol : nmea,gps,servo
+        self.protocol = protocol            # protocol : nmea,ais,gps (gpsd),ubx (direct u-blox),servo
         self.input_filter = input_filter    # list of received messages to be filtered out (empty list : no message)
         self.output_msgs = output_msgs      # list of messages to be transmitted (empty list : no message)
         self.description = description      # description
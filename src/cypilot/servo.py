@@ -31,6 +31,10 @@ PILOT_DIR = cypilot.pilot_path.PILOT_DIR
 TIOCEXCL = 0x540C
 TIOCNXCL = 0x540D
 
+PARAMS_RESYNC = 5 # seconds, driver params are sent again even if unchanged
+# driver counters published as servo values, totals over the driver instances
+DRIVER_COUNTERS = ['short_writes', 'dropped_packets', 'write_errors', 'packet_errors', 'telemetry_overruns']
+
 class ServoFlags(Value):
 
     # Motor Driver Flags values:
@@ -117,6 +121,27 @@ class ServoFlags(Value):
                     & ~ServoFlags.PORT_OVERCURRENT_FAULT)
 
 
+# telemetry records of the driver, see servo_telemetry_record in arduino_servo.h
+TELEMETRY_RECORD = [('time', '<f8'), ('value', '<u2'), ('code', 'u1'), ('reserved', 'u1')]
+TELEMETRY_RECORD_SIZE = 12
+TELEMETRY_RING_SIZE = 4096
+
+# packet codes, see arduino_servo.cpp
+COMMAND_CODE = 0xc7
+ANGLE_CODE = 0xc9
+DISENGAGE_CODE = 0x68
+RESET_CODE = 0xe7
+CURRENT_CODE = 0x1c
+VOLTAGE_CODE = 0xb3
+RUDDER_SENSE_CODE = 0xa7
+FLAGS_CODE = 0x8f
+SENT_CODES = [COMMAND_CODE, ANGLE_CODE, DISENGAGE_CODE, RESET_CODE]
+
+TELEMETRY_GAP = .1 # seconds without packet counted as a gap
+CURRENT_SPIKE = 2 # amps increase between two current packets
+RUDDER_MOVE = .002 # rudder raw change detecting the response to a command
+
+
 class ServoTelemetry(object):
     FLAGS = 1
     CURRENT = 2
@@ -245,6 +270,29 @@ class Servo(object):
         self.controller = self.register(StringValue, 'controller', 'none')
         self.flags = self.register(ServoFlags, 'flags')
 
+        # driver params are only sent when one of these values was set since the last send
+        rudder = self.sensors.rudder
+        self.params_values = [self.max_current, self.max_controller_temp, self.max_motor_temp,
+                              rudder.range, rudder.offset, rudder.scale, rudder.nonlinearity, rudder.calibrated,
+                              self.max_slew_speed, self.max_slew_slow,
+                              self.current.factor, self.current.offset, self.voltage.factor, self.voltage.offset,
+                              self.speed.min, self.speed.max, self.gain, self.brake]
+        self.params_state = None # value generations at last send
+        self.params_time = 0
+        self.params_sent = self.register(Value, 'params_sent', 0)
+
+        # serial output of the driver
+        self.short_writes = self.register(Value, 'short_writes', 0)
+        self.dropped_packets = self.register(Value, 'dropped_packets', 0)
+        self.write_errors = self.register(Value, 'write_errors', 0)
+        self.packet_errors = self.register(Value, 'packet_errors', 0)
+        # telemetry records overwritten in the driver ring before drain() read them
+        self.telemetry_overruns = self.register(Value, 'telemetry_overruns', 0)
+        self.counters_base = dict.fromkeys(DRIVER_COUNTERS, 0) # totals when the driver was opened
+
+        # energy integrated by the driver at the last poll
+        self.driver_amp_hours = self.driver_watt_hours = 0
+
         self.driver = False
         self.raw_command(0)
 
@@ -400,6 +448,14 @@ class Servo(object):
         self.driver = False
 
     def send_driver_params(self, mul=1):
+        t = time.monotonic()
+        state = (mul, self.sensors.rudder.minmax) + tuple(value.generation for value in self.params_values)
+        if state == self.params_state and t - self.params_time < PARAMS_RESYNC:
+            return
+        self.params_state = state
+        self.params_time = t
+        self.params_sent.set(self.params_sent.value + 1)
+
         uncorrected_max_current = max(
             0, self.max_current.value - self.current.offset.value) / self.current.factor.value
         minmax = self.sensors.rudder.minmax
@@ -423,42 +479,50 @@ class Servo(object):
                            self.gain.value,
                            self.brake.value)
 
+    def open_driver(self, device_path, baud):
+        print('servo probe', device_path, baud, time.monotonic())
+        try:
+            device = serial.Serial(device_path, baud)
+        except Exception as e:
+            print('failed to open servo on:', device_path, e)
+            return
+
+        try:
+            device.timeout = 0  # nonblocking
+            fcntl.ioctl(device.fileno(), TIOCEXCL)  # exclusive
+        except Exception as e:
+            print('failed set nonblocking/exclusive', e)
+            device.close()
+            return
+        from arduino_servo.arduino_servo import ArduinoServo
+
+        self.driver = ArduinoServo(device.fileno())
+        self.driver_amp_hours = self.driver_watt_hours = 0
+        # a new driver counts from 0
+        self.counters_base = {name: getattr(self, name).value for name in DRIVER_COUNTERS}
+        self.params_state = None
+        self.send_driver_params()
+        self.device = device
+        self.device.path = device_path
+        self.lastpolltime = time.monotonic()
+
     def poll(self):
         if not self.driver:
             list_serials = serials.list_serials("servo")
             if list_serials:
-                device_path = list_serials[0].path
-                baud = list_serials[0].baudrate
-                print('servo probe', device_path, baud, time.monotonic())
-                try:
-                    device = serial.Serial(device_path, baud)
-                except Exception as e:
-                    print('failed to open servo on:', device_path, e)
-                    return
-
-                try:
-                    device.timeout = 0  # nonblocking
-                    fcntl.ioctl(device.fileno(), TIOCEXCL)  # exclusive
-                except Exception as e:
-                    print('failed set nonblocking/exclusive', e)
-                    device.close()
-                    return
-                from arduino_servo.arduino_servo import ArduinoServo
-
-                self.driver = ArduinoServo(device.fileno())
-                self.send_driver_params()
-                self.device = device
-                self.device.path = device_path
-                self.lastpolltime = time.monotonic()
+                self.open_driver(list_serials[0].path, list_serials[0].baudrate)
 
         if not self.driver:
             return
 
         result = self.driver.poll()
+        for name, base in self.counters_base.items():
+            getattr(self, name).update(base + getattr(self.driver, name))
         if result == -1:
             print('servo lost')
             self.close_driver()
             return
+
         t = time.monotonic()
         if result == 0:
             d = t - self.lastpolltime
@@ -501,15 +565,18 @@ class Servo(object):
                     0, corrected_current + self.current.offset.value)
 
             self.current.set(round(corrected_current, 3))
-            # integrate power consumption
+            # power consumption, integrated by the driver over every current packet
             dt = t - self.current.lasttime
             self.current.lasttime = t
-            if self.current.value:
-                amphours = self.current.value*dt/3600
+            amphours = self.driver.amp_hours - self.driver_amp_hours
+            watthours = self.driver.watt_hours - self.driver_watt_hours
+            self.driver_amp_hours = self.driver.amp_hours
+            self.driver_watt_hours = self.driver.watt_hours
+            if amphours:
                 self.amphours.set(self.amphours.value + amphours)
-            lp = .003*dt  # 5 minute time constant to average wattage
-            self.watts.set((1-lp)*self.watts.value + lp *
-                           self.voltage.value*self.current.value)
+            if dt > 0:
+                lp = min(.003*dt, 1)  # 5 minute time constant to average wattage
+                self.watts.set((1-lp)*self.watts.value + lp*watthours*3600/dt)
 
         if result & ServoTelemetry.FLAGS:
             # self.max_current.set_max(40 if self.driver.flags & ServoFlags.CURRENT_RANGE else 20)
@@ -579,6 +646,101 @@ class Servo(object):
             return False
         return self.driver.fault()
 
+    def drain(self):
+        """drain : packets received and commands sent by the driver since the last drain
+
+        Returns:
+            numpy.ndarray: TELEMETRY_RECORD structured array, oldest first, None without driver
+        """
+        if not self.driver:
+            return None
+        import numpy as np
+        buffer = bytearray(TELEMETRY_RING_SIZE * TELEMETRY_RECORD_SIZE)
+        count = self.driver.drain(buffer)
+        return np.frombuffer(buffer, np.dtype(TELEMETRY_RECORD), count).copy()
+
+
+def servo_telemetry(records):
+    """servo_telemetry : telemetry records decoded per quantity
+
+    Args:
+        records (numpy.ndarray): records from Servo.drain
+
+    Returns:
+        dict: (time, value) numpy arrays for command (-1 to 1), current (A, uncorrected),
+              voltage (V, uncorrected), rudder (raw -0.5 to 0.5, nan without sensor) and flags
+    """
+    import numpy as np
+    def select(code):
+        packets = records[records['code'] == code]
+        return packets['time'], packets['value'].astype(float)
+    t, value = select(RUDDER_SENSE_CODE)
+    rudder = value / 65472.0 - .5
+    rudder[value == 65535] = np.nan
+    command_time, command = select(COMMAND_CODE)
+    current_time, current = select(CURRENT_CODE)
+    voltage_time, voltage = select(VOLTAGE_CODE)
+    flags_time, flags = select(FLAGS_CODE)
+    return {'command': (command_time, (command - 1000) / 1000),
+            'current': (current_time, current / 100), 'voltage': (voltage_time, voltage / 100),
+            'rudder': (t, rudder), 'flags': (flags_time, flags.astype(int))}
+
+def servo_telemetry_stats(records):
+    """servo_telemetry_stats : packet rate and gaps, current spikes and response latency
+    to the motor commands
+
+    The latency of a command starting the motor, or reversing it, is measured to the first
+    current packet above zero and to the first rudder packet moved in the commanded direction.
+
+    Args:
+        records (numpy.ndarray): records from Servo.drain
+
+    Returns:
+        dict: statistics, times in ms
+    """
+    import numpy as np
+    def ms(v):
+        return round(float(v) * 1000, 1)
+    received = records[~np.isin(records['code'], SENT_CODES)]
+    stats = {'packets': len(received)}
+    if len(received) > 1:
+        intervals = np.diff(received['time'])
+        stats.update({'rate': round(len(received) / max(float(received['time'][-1] - received['time'][0]), 1e-3), 1),
+                      'gaps': int((intervals > TELEMETRY_GAP).sum()), 'max_gap': ms(intervals.max())})
+
+    telemetry = servo_telemetry(records)
+    current_time, current = telemetry['current']
+    if len(current):
+        stats.update({'current_max': round(float(current.max()), 2),
+                      'current_spikes': int((np.diff(current) > CURRENT_SPIKE).sum())})
+
+    command_time, command = telemetry['command']
+    rudder_time, rudder = telemetry['rudder']
+    valid = ~np.isnan(rudder)
+    rudder_time, rudder = rudder_time[valid], rudder[valid]
+    direction = np.sign(command)
+    starts = np.nonzero(direction[1:] * (direction[1:] != direction[:-1]))[0] + 1
+    ends = list(command_time[starts[1:]]) + [np.inf] # response before the next start only
+    current_latency, rudder_latency = [], []
+    for i, end in zip(starts, ends):
+        t = command_time[i]
+        j, k = np.searchsorted(current_time, [t, end])
+        drawn = np.nonzero(current[j:k] > 0)[0]
+        if len(drawn):
+            current_latency.append(current_time[j + drawn[0]] - t)
+        j, k = np.searchsorted(rudder_time, [t, end])
+        if j == 0:
+            continue
+        moved = np.nonzero((rudder[j:k] - rudder[j-1]) * direction[i] > RUDDER_MOVE)[0]
+        if len(moved):
+            rudder_latency.append(rudder_time[j + moved[0]] - t)
+    stats['commands'] = len(starts)
+    for name, latency in [('current_latency', current_latency), ('rudder_latency', rudder_latency)]:
+        if latency:
+            stats[name] = ms(np.mean(latency))
+            stats['max_' + name] = ms(np.max(latency))
+    return stats
+
 def test(device_path):
     from arduino_servo.arduino_servo import ArduinoServo
     print('probing arduino servo on', device_path)
@@ -656,6 +818,10 @@ def servo_main():
             elif k == 'e':
                 print('Servo position command out of range : ', 80)
                 servo.position_command.set(80)
+            elif k == 't':
+                records = servo.drain()
+                if records is not None:
+                    print('Telemetry :', servo_telemetry_stats(records))
             elif k == 'q':
                 print('Exiting')
                 break
@@ -669,6 +835,7 @@ def servo_main():
                       'p : set rudder position to +20\n'
                       's : set rudder position to -20\n'
                       'e : set rudder position out of range\n'
+                      't : telemetry statistics since the last t\n'
                       'q : quit\n')
 
         servo.poll()
@@ -11,9 +11,10 @@
 #
 # Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
 
+import sys
 import time
 import socket
-import multiprocessing
+import asyncio
 import requests
 import random
 
@@ -22,7 +23,8 @@ from nonblockingpipe import non_blocking_pipe
 import pyjson
 from client import cypilotClient
 from pilot_values import Property, RangeProperty
-from sensors import init_source_priority
+from sensors import init_source_priority, parse_iso_time
+from helpers import ForkedHelper
 
 from pilot_path import dprint as print # pylint: disable=redefined-builtin
 
@@ -44,10 +46,145 @@ SIGNALK_TABLE = {'wind': {('environment.wind.speedApparent', METERS_S): 'speed',
 
 TOKEN_PATH = cypilot.pilot_path.PILOT_DIR + 'signalk-token'
 
+SIGNALK_CLIENT_PERIOD = .05 # seconds between polls of the cypilot client once connected
+
 def debug(*args):
     #print(*args)
     pass
 
+def compile_signalk_table(table):
+    """compile_signalk_table : index a signalk table once, for both directions
+
+    Returns:
+        tuple: (paths, required, names)
+            paths: signalk path -> (sensor, cypilot field or {signalk key: cypilot field}, conversion)
+            required: sensor -> set of signalk paths needed for a sensor input (paths with a conversion of 1 are optional)
+            names: cypilot value name -> list of (signalk path, signalk key or None, conversion)
+    """
+    paths, required, names = {}, {}, {}
+    for sensor, sensor_table in table.items():
+        required[sensor] = set()
+        for (signalk_path, conversion), cypilot_path in sensor_table.items():
+            paths[signalk_path] = sensor, cypilot_path, conversion
+            if conversion != 1:
+                required[sensor].add(signalk_path)
+            if isinstance(cypilot_path, dict): # single path translates to multiple cypilot
+                for signalk_key, cypilot_key in cypilot_path.items():
+                    names.setdefault(sensor + '.' + cypilot_key, []).append((signalk_path, signalk_key, conversion))
+            else:
+                names.setdefault(sensor + '.' + cypilot_path, []).append((signalk_path, None, conversion))
+    return paths, required, names
+
+
+class SignalKTranslator(object):
+    """SignalKTranslator : translate signalk deltas to sensor inputs and cypilot values
+    to batched signalk updates, using the compiled SIGNALK_TABLE
+    """
+    def __init__(self, table=None):
+        self.paths, self.required, self.names = compile_signalk_table(table or SIGNALK_TABLE)
+        self.inputs = {} # (source, sensor) -> (data, signalk paths received)
+        self.last_msg_time = {} # signalk path -> timestamp of last delta
+        self.updates = {} # signalk path -> value, sent with the next batch
+        self.composite = {} # signalk path -> {signalk key: value} until all keys are known
+
+    def sensor_paths(self, sensor):
+        return [path for path, (s, __, __) in self.paths.items() if s == sensor]
+
+    def receive(self, msg, t):
+        """receive : translate a signalk delta message
+
+        Args:
+            msg (string): delta message
+            t (float): monotonic time the message was received
+
+        Returns:
+            list: (sensor, data) of each sensor input completed by this delta
+        """
+        try:
+            delta = pyjson.loads(msg)
+        except Exception:
+            print('signalk failed to parse msg:', msg)
+            return []
+
+        inputs = []
+        for update in delta.get('updates', []):
+            source = 'unknown'
+            if 'source' in update:
+                source = update['source'].get('talker', source)
+            elif '$source' in update:
+                source = update['$source']
+            timestamp = update.get('timestamp')
+            for value in update.get('values', []):
+                path = value.get('path')
+                if path not in self.paths:
+                    continue
+                if path not in self.last_msg_time:
+                    debug('signalk skip initial message', source, path, timestamp)
+                    self.last_msg_time[path] = timestamp
+                    continue
+                if self.last_msg_time[path] == timestamp:
+                    debug('signalk skip duplicate timestamp', source, path, timestamp)
+                    continue
+                self.last_msg_time[path] = timestamp
+
+                sensor, cypilot_path, conversion = self.paths[path]
+                key = source, sensor
+                if key not in self.inputs:
+                    self.inputs[key] = {}, set()
+                data, received = self.inputs[key]
+                try:
+                    if isinstance(cypilot_path, dict):
+                        for signalk_key, cypilot_key in cypilot_path.items():
+                            data[cypilot_key] = value['value'][signalk_key] / conversion
+                    else:
+                        data[cypilot_path] = value['value'] / conversion
+                except Exception as e:
+                    print('Exception converting signalk->cypilot', e, value)
+                    continue
+                received.add(path)
+                if self.required[sensor] <= received:
+                    # all needed sensor data is found
+                    del self.inputs[key]
+                    data['device'] = source
+                    data['rx'] = t
+                    stamp = parse_iso_time(timestamp)
+                    if stamp:
+                        data['stamp'] = stamp
+                    inputs.append((sensor, data))
+        return inputs
+
+    def value(self, name, value):
+        # translate a cypilot value, multiple keys paths are sent once all keys are known
+        for signalk_path, signalk_key, conversion in self.names.get(name, []):
+            if signalk_key is None:
+                self.updates[signalk_path] = value * conversion
+                continue
+            keys = self.composite.setdefault(signalk_path, {})
+            keys[signalk_key] = value * conversion
+            if len(keys) == len(self.paths[signalk_path][1]):
+                self.updates[signalk_path] = keys
+                del self.composite[signalk_path]
+
+    def forget(self, sensor):
+        # remove pending values of a sensor
+        for path in self.sensor_paths(sensor):
+            self.updates.pop(path, None)
+            self.composite.pop(path, None)
+
+    def flush(self):
+        """flush : batch of pending updates
+
+        Returns:
+            string: signalk updates message, or None if there is nothing to send
+        """
+        if not self.updates:
+            return None
+        values = [{'path': path, 'value': value} for path, value in self.updates.items()]
+        self.updates = {}
+        msg = {'updates': [{'$source': 'cypilot', 'values': values}]}
+        debug('signalk updates', msg)
+        return pyjson.dumps(msg) + '\n'
+
 class signalk(object):
     def __init__(self, sensors=False):
         self.active = False
@@ -76,9 +213,6 @@ class signalk(object):
         self.last_access_request_time = 0
 
         self.token = None
-        self.last_values = {}
-        self.signalk_msgs = {}
-        self.signalk_msgs_skip = {}
         self.period = None
         self.uid = None
         self.signalk_host_port = False
@@ -87,18 +221,15 @@ class signalk(object):
 
         self.subscribed = {}
         self.subscriptions = []
-        self.signalk_values = {}
-
-        self.signalk_last_msg_time = {}
+        self.control = [] # subscription messages to send
+        self.send_updates = False
+        self.translator = SignalKTranslator()
         self.last_sources = {}
 
-        # store certain values across parsing invocations to ensure
-        # all of the keys are filled with the latest data
-        self.last_values_keys = {}
-
+        self.sensors_pipe = None
         if self.sensors:
             self.sensors_pipe, self.sensors_pipe_out = non_blocking_pipe('signalk pipe')
-            self.process = multiprocessing.Process(target=self.signalk_process, daemon=True, name='signalk')
+            self.process = ForkedHelper(target=self.signalk_process, daemon=True, name='signalk')
             self.process.start()
 
     def setup(self):
@@ -121,21 +252,8 @@ class signalk(object):
             time.sleep(20)
             return
 
-        self.last_values = {}
         self.last_sources = {}
-        self.signalk_last_msg_time = {}
-
-        # store certain values across parsing invocations to ensure
-        # all of the keys are filled with the latest data
-        self.last_values_keys = {}
-        for __, sensor_table in SIGNALK_TABLE.items():
-            for signalk_path_conversion, cypilot_path in sensor_table.items():
-                signalk_path, __ = signalk_path_conversion
-                if isinstance(cypilot_path, type({})): # single path translates to multiple cypilot
-                    self.last_values_keys[signalk_path] = {}
-
-        self.period = self.client.register(RangeProperty('signalk.period', .5, .1, 2, persistent=True))
-        self.uid = self.client.register(Property('signalk.uid', 'cypilot', persistent=True))
+        self.register_values()
 
         self.signalk_host_port = False
         self.signalk_ws_url = False
@@ -149,8 +267,7 @@ class signalk(object):
             def remove_service(self, zeroconf, type_, name):
                 print('signalk zeroconf service removed', name, type_)
                 if self.name_type == (name, type_):
-                    self.signalk.signalk_host_port = False
-                    self.signalk.disconnect_signalk()
+                    self.signalk.signalk_host_port = False # closes the connection
                     print('signalk server lost')
 
             def add_service(self, zeroconf, type_, name):
@@ -181,6 +298,11 @@ class signalk(object):
             print('signalk server not found, using localhost server')
         self.initialized = True
 
+    def register_values(self):
+        if not self.period:
+            self.period = self.client.register(RangeProperty('signalk.period', .5, .1, 2, persistent=True))
+            self.uid = self.client.register(Property('signalk.uid', 'cypilot', persistent=True))
+
     def probe_signalk(self):
         print('signalk probe...', self.signalk_host_port)
 
@@ -242,12 +364,12 @@ class signalk(object):
             print('signalk error requesting access', e)
             self.signalk_ws_url = False
 
-    def connect_signalk(self):
+    async def connect_signalk(self):
         try:
-            from websocket import create_connection
+            import websockets
         except Exception as e:
             print('signalk cannot create connection:', e)
-            print('try pip3 install websocket-client or apt install python3-websocket')
+            print('try pip3 install websockets or apt install python3-websockets')
             self.signalk_host_port = False
             return
 
@@ -255,217 +377,152 @@ class signalk(object):
         for sensor in list(SIGNALK_TABLE):
             self.subscribed[sensor] = False
         self.subscriptions = []  # track signalk subscriptions
-        self.signalk_values = {}
+        self.control = []
+        self.send_updates = False
+        self.translator = SignalKTranslator()
         try:
-            self.ws_ = create_connection(self.signalk_ws_url, header={'Authorization': 'JWT ' + self.token})
-            self.ws_.settimeout(0)  # nonblocking
+            self.ws_ = await websockets.connect(self.signalk_ws_url, extra_headers={'Authorization': 'JWT ' + self.token})
         except Exception as e:
             print('signalk failed to connect', e)
+            self.ws_ = False
             self.token = False
 
-    def poll(self):
+    def receive(self):
+        # drain the pipe from the signalk process, may be called from the worker thread
+        msgs = []
         if self.active:
             msg = self.sensors_pipe_out.recv()
             while msg:
-                sensor, data = msg
-                self.sensors.write(sensor, data, 'signalk')
+                msgs.append(msg)
                 msg = self.sensors_pipe_out.recv()
-        
+        return msgs
+
+    def poll(self):
+        for sensor, data in self.receive():
+            self.sensors.write(sensor, data, 'signalk')
+
     def signalk_process(self):
         time.sleep(6)
+        asyncio.run(self.signalk_loop())
+
+    async def signalk_loop(self):
+        # discovery and access requests block, they run in the default executor
+        loop = asyncio.get_running_loop()
         while True:
-            time.sleep(.1)
+            await asyncio.sleep(.1)
             if not self.active:
                 continue
 
             if not self.initialized:
-                self.setup()
+                await loop.run_in_executor(None, self.setup)
                 continue
 
-            self.client.poll(1)
+            self.client.poll()
             if not self.signalk_host_port:
                 continue # waiting for signalk to detect
 
             if not self.signalk_ws_url:
-                self.probe_signalk()
+                await loop.run_in_executor(None, self.probe_signalk)
                 continue
 
             if not self.token:
-                self.request_access()
+                await loop.run_in_executor(None, self.request_access)
                 continue
 
+            await self.connect_signalk()
             if not self.ws_:
-                self.connect_signalk()
-                if not self.ws_:
-                    continue
-                print('signalk connected to', self.signalk_ws_url)
-                # setup cypilot watches
-                watches = ['imu.heading', 'imu.roll', 'imu.pitch', 'timestamp']
-                for watch in watches:
-                    self.client.watch(watch, self.period.value)
-                for sensor in SIGNALK_TABLE:
-                    self.client.watch(sensor+'.source')
                 continue
+            print('signalk connected to', self.signalk_ws_url)
+            # setup cypilot watches
+            watches = ['imu.heading', 'imu.roll', 'imu.pitch', 'timestamp']
+            for watch in watches:
+                self.client.watch(watch, self.period.value)
+            for sensor in SIGNALK_TABLE:
+                self.client.watch(sensor+'.source')
+            await self.run_connection()
+
+    async def run_connection(self):
+        # signalk deltas are handled as they arrive, cypilot values are polled
+        reader = asyncio.ensure_future(self.read_signalk())
+        try:
+            while not reader.done() and self.signalk_host_port:
+                self.poll_cypilot()
+                await self.flush_signalk()
+                await asyncio.wait([reader], timeout=SIGNALK_CLIENT_PERIOD)
+        except Exception as e:
+            print('signalk failed to send', e)
+        reader.cancel()
+        await self.disconnect_signalk()
 
-            # at this point we have a connection
-            # read all messages from cypilot
-            while True:
-                msg = self.client.receive_single()
-                if not msg:
-                    break
-                debug('signalk cypilot msg', msg)
-                name, value = msg
-                if name == 'timestamp':
-                    self.send_signalk()
-                    self.last_values = {}
-
-                if name.endswith('.source'):
-                    # update sources
-                    for sensor in SIGNALK_TABLE:
-                        source_name = sensor + '.source'
-                        if name == source_name:
-                            self.update_sensor_source(sensor, value)
-                        self.last_sources[name[:-7]] = value
-                else:
-                    self.last_values[name] = value
-
-            while True:
-                try:
-                    msg = self.ws_.recv()
-                    # print('signalk received', msg)
-                except:
-                    break
-                self.receive_signalk(msg)
-
-            # convert received signalk values into sensor inputs if possible
-            for sensor, sensor_table in SIGNALK_TABLE.items():
-                for source, values in self.signalk_values.items():
-                    data = {}
-                    for signalk_path_conversion, cypilot_path in sensor_table.items():
-                        signalk_path, signalk_conversion = signalk_path_conversion
-                        if signalk_path in values:
-                            try:
-                                value = values[signalk_path]
-                                if isinstance(cypilot_path, type({})): # single path translates to multiple cypilot
-                                    for signalk_key, cypilot_key in cypilot_path.items():
-                                        data[cypilot_key] = value[signalk_key] / signalk_conversion
-                                else:
-                                    data[cypilot_path] = value / signalk_conversion
-                            except Exception as e:
-                                print('Exception converting signalk->cypilot', e, self.signalk_values)
-                                break
-                        elif signalk_conversion != 1: # don't require fields with conversion of 1
-                            break  # missing fields?  skip input this iteration
+    async def read_signalk(self):
+        try:
+            async for msg in self.ws_:
+                for sensor, data in self.translator.receive(msg, time.monotonic()):
+                    if self.sensors_pipe:
+                        self.sensors_pipe.send([sensor, data])
                     else:
-                        for signalk_path_conversion in sensor_table:
-                            signalk_path, signalk_conversion = signalk_path_conversion
-                            if signalk_path in values:
-                                del values[signalk_path]
-                        # all needed sensor data is found
-                        data['device'] = source
-                        if self.sensors_pipe:
-                            self.sensors_pipe.send([sensor, data])
-                        else:
-                            print('signalk received', sensor, data)
-                        break
-
-    def send_signalk(self):
-        # see if we can produce any signalk output from the data we have read
-        updates = []
-        for sensor, sensor_table in SIGNALK_TABLE.items():
-            if sensor != 'imu' and (not sensor in self.last_sources or SOURCE_PRIORITY[self.last_sources[sensor]] >= SIGNALK_PRIORITY):
-                #debug('signalk skip send from priority', sensor)
-                continue
+                        print('signalk received', sensor, data)
+        except Exception as e:
+            print('signalk connection lost', e)
 
-            for signalk_path_conversion, cypilot_path in sensor_table.items():
-                signalk_path, signalk_conversion = signalk_path_conversion
-                if isinstance(cypilot_path, type({})):  # single path translates to multiple cypilot
-                    keys = self.last_values_keys[signalk_path]
-                    # store keys we need for this signalk path in dictionary
-                    for signalk_key, cypilot_key in cypilot_path.items():
-                        key = sensor+'.'+cypilot_key
-                        if key in self.last_values:
-                            keys[key] = self.last_values[key]
-
-                    # see if we have the keys needed
-                    v = {}
-                    for signalk_key, cypilot_key in cypilot_path.items():
-                        key = sensor+'.'+cypilot_key
-                        if not key in keys:
-                            break
-                        v[signalk_key] = keys[key]*signalk_conversion
-                    else:
-                        updates.append({'path': signalk_path, 'value': v})
-                        self.last_values_keys[signalk_path] = {}
-                else:
-                    key = sensor+'.'+cypilot_path
-                    if key in self.last_values:
-                        v = self.last_values[key]*signalk_conversion
-                        updates.append({'path': signalk_path, 'value': v})
-
-        if updates:
-            # send signalk updates
-            msg = {'updates': [{'$source': 'cypilot', 'values': updates}]}
-            debug('signalk updates', msg)
+    def poll_cypilot(self):
+        # read all messages from cypilot
+        self.client.poll()
+        while True:
+            msg = self.client.receive_single()
+            if not msg:
+                break
+            debug('signalk cypilot msg', msg)
+            name, value = msg
+            if name == 'timestamp':
+                self.send_updates = True
+            elif name.endswith('.source'):
+                sensor = name[:-7]
+                self.last_sources[sensor] = value
+                if sensor in SIGNALK_TABLE:
+                    self.update_sensor_source(sensor, value)
+            elif self.publish(name.split('.')[0]):
+                self.translator.value(name, value)
+
+    def publish(self, sensor):
+        # translate from cypilot -> signalk if cypilot has a better source than signalk
+        if sensor == 'imu':
+            return True
+        return sensor in self.last_sources and SOURCE_PRIORITY[self.last_sources[sensor]] < SIGNALK_PRIORITY
+
+    async def flush_signalk(self):
+        msgs = self.control
+        self.control = []
+        if self.send_updates:
+            self.send_updates = False
+            msg = self.translator.flush()
+            if msg:
+                msgs.append(msg)
+        for msg in msgs:
+            await self.ws_.send(msg)
+
+    async def disconnect_signalk(self):
+        if self.ws_:
             try:
-                self.ws_.send(pyjson.dumps(msg)+'\n')
+                await self.ws_.close()
             except Exception as e:
-                print('signalk failed to send', e)
-                self.disconnect_signalk()
-
-    def disconnect_signalk(self):
-        if self.ws_:
-            self.ws_.close()
+                print('signalk failed to close', e)
         self.ws_ = False
         self.client.clear_watches()  # don't need to receive cypilot data
 
-    def receive_signalk(self, msg):
-        try:
-            data = pyjson.loads(msg)
-        except:
-            print('signalk failed to parse msg:', msg)
-            return
-        if 'updates' in data:
-            updates = data['updates']
-            for update in updates:
-                source = 'unknown'
-                if 'source' in update:
-                    source = update['source']['talker']
-                elif '$source' in update:
-                    source = update['$source']
-                if 'timestamp' in update:
-                    timestamp = update['timestamp']
-                if not source in self.signalk_values:
-                    self.signalk_values[source] = {}
-                for value in update['values']:
-                    path = value['path']
-                    if path in self.signalk_last_msg_time:
-                        if self.signalk_last_msg_time[path] == timestamp:
-                            debug('signalk skip duplicate timestamp', source, path, timestamp)
-                            continue
-                        self.signalk_values[source][path] = value['value']
-                    else:
-                        debug('signalk skip initial message', source, path, timestamp)
-                    self.signalk_last_msg_time[path] = timestamp
-
     def update_sensor_source(self, sensor, source):
         priority = SOURCE_PRIORITY[source]
         watch = priority < SIGNALK_PRIORITY # translate from cypilot -> signalk
         if watch:
             watch = self.period.value
-        for signalk_path_conversion, cypilot_path in SIGNALK_TABLE[sensor].items():
-            if isinstance(cypilot_path, type({})):
+        # remove any last values from this sensor
+        self.translator.forget(sensor)
+        for cypilot_path in SIGNALK_TABLE[sensor].values():
+            if isinstance(cypilot_path, dict):
                 for __, cypilot_key in cypilot_path.items():
-                    cypilot_path = sensor + '.' + cypilot_key
-                    if cypilot_path in self.last_values:
-                        del self.last_values[cypilot_path]
-                    self.client.watch(cypilot_path, watch)
+                    self.client.watch(sensor + '.' + cypilot_key, watch)
             else:
-                # remove any last values from this sensor
-                cypilot_path = sensor + '.' + cypilot_path
-                if cypilot_path in self.last_values:
-                    del self.last_values[cypilot_path]
-                self.client.watch(cypilot_path, watch)
+                self.client.watch(sensor + '.' + cypilot_path, watch)
         subscribe = priority >= SIGNALK_PRIORITY
 
         # prevent duplicating subscriptions
@@ -477,41 +534,85 @@ class signalk(object):
             # signalk can't unsubscribe by path!?!?!
             subscription = {'context': '*', 'unsubscribe': [{'path': '*'}]}
             debug('signalk unsubscribe', subscription)
-            self.ws_.send(pyjson.dumps(subscription)+'\n')
+            self.control.append(pyjson.dumps(subscription)+'\n')
 
-        signalk_sensor = SIGNALK_TABLE[sensor]
+        signalk_paths = self.translator.sensor_paths(sensor)
         if subscribe: # translate from signalk -> cypilot
             subscriptions = []
-            for signalk_path_conversion in signalk_sensor:
-                signalk_path, __ = signalk_path_conversion
-                if signalk_path in self.signalk_last_msg_time:
-                    del self.signalk_last_msg_time[signalk_path]
+            for signalk_path in signalk_paths:
+                self.translator.last_msg_time.pop(signalk_path, None)
                 subscriptions.append(
                     {'path': signalk_path, 'minPeriod': self.period.value*1000, 'format': 'delta', 'policy': 'instant'})
             self.subscriptions += subscriptions
         else:
             # remove this subscription and resend all subscriptions
-            debug('signalk remove subs', signalk_sensor, self.subscriptions)
-            subscriptions = []
-            for subscription in self.subscriptions:
-                for signalk_path_conversion in signalk_sensor:
-                    signalk_path, __ = signalk_path_conversion
-                    if subscription['path'] == signalk_path:
-                        break
-                else:
-                    subscriptions.append(subscription)
+            debug('signalk remove subs', signalk_paths, self.subscriptions)
+            subscriptions = [subscription for subscription in self.subscriptions if subscription['path'] not in signalk_paths]
             self.subscriptions = subscriptions
-            self.signalk_last_msg_time = {}
+            self.translator.last_msg_time = {}
 
         subscription = {'context': 'vessels.self'}
         subscription['subscribe'] = subscriptions
         debug('signalk subscribe', subscription)
-        self.ws_.send(pyjson.dumps(subscription)+'\n')
+        self.control.append(pyjson.dumps(subscription)+'\n')
+
+
+async def signalk_stub(port, period=.1):
+    """signalk_stub : local signalk websocket server for tests, sends wind, gps
+    and attitude deltas and prints the messages received from cypilot
+    """
+    import websockets
+
+    async def handler(ws, path=None):
+        print('signalk stub client connected')
+
+        async def receive():
+            async for msg in ws:
+                print('signalk stub received', msg.rstrip())
+        receiver = asyncio.ensure_future(receive())
+
+        n = 0
+        try:
+            while not receiver.done():
+                timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + f'.{n % 1000:03d}Z'
+                values = [{'path': 'environment.wind.speedApparent', 'value': 5 + n % 10 * .1},
+                          {'path': 'environment.wind.angleApparent', 'value': .5},
+                          {'path': 'navigation.courseOverGroundTrue', 'value': 1.5},
+                          {'path': 'navigation.speedOverGround', 'value': 3},
+                          {'path': 'navigation.position', 'value': {'latitude': 47.5, 'longitude': -4.5}},
+                          {'path': 'navigation.attitude', 'value': {'pitch': .01, 'roll': .1, 'yaw': 1.6}}]
+                await ws.send(pyjson.dumps({'context': 'vessels.self',
+                                            'updates': [{'$source': 'stub', 'timestamp': timestamp, 'values': values}]}))
+                n += 1
+                await asyncio.sleep(period)
+        except Exception as e:
+            print('signalk stub client lost', e)
+        receiver.cancel()
+
+    async with websockets.serve(handler, '127.0.0.1', port):
+        print('signalk stub listening on', f'ws://127.0.0.1:{port}/signalk/v1/stream')
+        await asyncio.Future()
 
 def signalk_main():
+    """
+        python signalk.py             discover a signalk server and print sensor inputs
+        python signalk.py stub [PORT] run a local signalk websocket stub
+        python signalk.py URL         connect directly to a signalk websocket url
+    """
     print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) > 1 and sys.argv[1] == 'stub':
+        asyncio.run(signalk_stub(int(sys.argv[2]) if len(sys.argv) > 2 else 3000))
+        return
+
     sk = signalk()
-    sk.signalk_process()
+    if len(sys.argv) > 1:
+        # no discovery nor access request
+        sk.register_values()
+        sk.signalk_host_port = 'direct'
+        sk.signalk_ws_url = sys.argv[1]
+        sk.token = 'none'
+        sk.initialized = True
+    asyncio.run(sk.signalk_loop())
 
 if __name__ == '__main__':
     signalk_main()
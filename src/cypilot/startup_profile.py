@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""startup profiling : wall time per import and per subsystem constructor
+
+    cypilot --profile-startup[=report_file]
+
+Runs the autopilot initialisation only, writes a report (default
+~/.cypilot/cypilot_startup_profile.txt) and exits with status 1 if the
+budget defined in ~/.cypilot/cypilot_startup.conf is exceeded, 0 otherwise.
+"""
+
+import os
+import sys
+import time
+import json
+import builtins
+
+import cypilot.pilot_path
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+from pilot_path import PILOT_DIR
+
+PROFILE_OPTION = '--profile-startup'
+DEFAULT_REPORT = PILOT_DIR + 'cypilot_startup_profile.txt'
+
+def read_budget():
+    """read_budget : read startup budget (seconds) from configuration file
+
+    Returns:
+        dict: 'total' and 'imports' budgets, and budgets per 'sections'
+    """
+    budgetfilename = PILOT_DIR + 'cypilot_startup.conf'
+    budget = {'total': 30, 'imports': 10, 'sections': {}}
+    try:
+        file = open(budgetfilename)
+        budget.update(json.load(file))
+        file.close()
+    except Exception as e: # pylint: disable=broad-except
+        print('failed to read startup budget file:', budgetfilename, e)
+        try:
+            file = open(budgetfilename, 'w')
+            file.write(json.dumps(budget, indent=4) + '\n')
+            file.close()
+        except Exception as ew: # pylint: disable=broad-except
+            print('Exception writing default values to startup budget file:', budgetfilename, ew)
+    return budget
+
+
+class Section(object):
+    """Section : context manager recording wall time of a startup step
+    """
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.t0 = 0
+
+    def __enter__(self):
+        self.profile.path.append(self.name)
+        self.t0 = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        dt = time.monotonic() - self.t0
+        self.profile.sections.append(('.'.join(self.profile.path), dt))
+        self.profile.path.pop()
+        return False
+
+
+class StartupProfile(object):
+    """StartupProfile : startup timings, sections are always recorded (cheap),
+    imports only when profiling is enabled
+    """
+    def __init__(self):
+        self.enabled = False
+        self.report_path = DEFAULT_REPORT
+        self.starttime = time.monotonic()
+        self.sections = [] # (name, seconds) in completion order
+        self.path = []
+        self.imports = {} # module -> (inclusive, self) seconds
+        self.import_stack = []
+        self.original_import = None
+
+    def start(self, argv):
+        """start : enable profiling if requested on command line
+
+        Args:
+            argv (list): command line arguments
+        """
+        for arg in argv:
+            if arg == PROFILE_OPTION or arg.startswith(PROFILE_OPTION + '='):
+                self.enabled = True
+                if '=' in arg:
+                    self.report_path = arg.split('=', 1)[1]
+        if self.enabled and not self.original_import:
+            self.starttime = time.monotonic()
+            self.original_import = builtins.__import__
+            builtins.__import__ = self.timed_import
+
+    def stop(self):
+        if self.original_import:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0): # pylint: disable=redefined-builtin
+        if level or name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        t0 = time.monotonic()
+        self.import_stack.append(0)
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            dt = time.monotonic() - t0
+            children = self.import_stack.pop()
+            if self.import_stack:
+                self.import_stack[-1] += dt
+            if name not in self.imports:
+                self.imports[name] = (dt, dt - children)
+
+    def section(self, name):
+        """section : time a startup step
+
+            with STARTUP.section('servo'):
+                self.servo = servo.Servo(...)
+
+        Args:
+            name (string): step name, nested sections are joined with '.'
+        """
+        return Section(self, name)
+
+    def finish(self):
+        """finish : write report and check budget
+
+        Returns:
+            bool: True if startup is within budget
+        """
+        self.stop()
+        total = time.monotonic() - self.starttime
+        budget = read_budget()
+
+        # self times do not overlap, their sum is the time spent importing
+        imports_total = sum(dself for __, dself in self.imports.values())
+
+        failures = []
+        if total > budget['total']:
+            failures.append(f'total {total:.2f}s > {budget["total"]:.2f}s')
+        if imports_total > budget['imports']:
+            failures.append(f'imports {imports_total:.2f}s > {budget["imports"]:.2f}s')
+        for name, dt in self.sections:
+            if name in budget['sections'] and dt > budget['sections'][name]:
+                failures.append(f'{name} {dt:.2f}s > {budget["sections"][name]:.2f}s')
+
+        lines = [f'cypilot {cypilot.pilot_path.STRVERSION} startup profile, pid {os.getpid()}',
+                 f'total {total:.3f}s, imports {imports_total:.3f}s', '',
+                 'sections (seconds):']
+        for name, dt in self.sections:
+            lines.append(f'  {dt:8.3f}  {name}')
+        lines += ['', 'imports (inclusive, self seconds):']
+        for name, (dt, dself) in sorted(self.imports.items(), key=lambda item: -item[1][1]):
+            lines.append(f'  {dt:8.3f}  {dself:8.3f}  {name}')
+        lines += ['', 'budget: ' + ('FAILED ' + ', '.join(failures) if failures else 'OK')]
+
+        try:
+            with open(self.report_path, 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+            print('startup profile written to', self.report_path)
+        except Exception as e: # pylint: disable=broad-except
+            print('failed to write startup profile', self.report_path, e)
+
+        print(f'startup total {total:.2f}s, imports {imports_total:.2f}s')
+        for failure in failures:
+            print('startup budget exceeded:', failure)
+        return not failures
+
+
+STARTUP = StartupProfile()
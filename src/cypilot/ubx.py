@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""direct u-blox GPS driver, without gpsd
+
+Used instead of gpsd when a serial device is configured with the "ubx" protocol
+in cypilot_serial.conf. The receiver is configured for NAV-PVT messages at the
+gps.rate navigation rate, the binary frames are read by the gps process and sent
+to the autopilot like gpsd fixes, with the horizontal position and speed accuracies.
+
+    python ubx.py record DEVICE FILE [SECONDS]  record raw receiver output
+    python ubx.py replay FILE                   feed a capture through a pty to the driver
+"""
+
+import os
+import sys
+import time
+import struct
+import select
+import calendar
+import threading
+import serial
+
+import cypilot.pilot_path # pylint: disable=unused-import
+from nonblockingpipe import non_blocking_pipe
+from helpers import ForkedHelper
+import serials
+from gpsd import UBX_PRT_USB1
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+UBX_SYNC = b'\xB5\x62'
+UBX_MAX_PAYLOAD = 1024
+
+UBX_ACK = 0x05
+UBX_NAV = 0x01
+UBX_CFG = 0x06
+UBX_NAV_PVT = 0x07
+UBX_CFG_MSG = 0x01
+UBX_CFG_RATE = 0x08
+
+UBX_RATES = [1, 5, 10] # Hz
+UBX_NO_DATA_TIMEOUT = 5 # seconds without any UBX frame before the receiver is reopened
+
+# NAV-PVT payload up to pDOP, see u-blox protocol specification
+NAV_PVT = struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIH')
+NAV_PVT_LEN = 92
+MM_S_TO_KNOTS = 1.943844e-3
+
+
+def ubx_checksum(data):
+    """ubx_checksum : 8-bit Fletcher checksum over class, id, length and payload
+    """
+    ck_a = ck_b = 0
+    for b in data:
+        ck_a = (ck_a + b) & 0xff
+        ck_b = (ck_b + ck_a) & 0xff
+    return bytes([ck_a, ck_b])
+
+def ubx_frame(cls, msgid, payload=b''):
+    body = struct.pack('<BBH', cls, msgid, len(payload)) + payload
+    return UBX_SYNC + body + ubx_checksum(body)
+
+def ubx_cfg_rate(rate):
+    # measurement period in ms, one navigation solution per measurement, GPS time
+    return ubx_frame(UBX_CFG, UBX_CFG_RATE, struct.pack('<HHH', int(1000 / rate), 1, 1))
+
+def ubx_cfg_nav_pvt(rate=1):
+    # NAV-PVT on every navigation solution of the current port
+    return ubx_frame(UBX_CFG, UBX_CFG_MSG, struct.pack('<BBB', UBX_NAV, UBX_NAV_PVT, rate))
+
+
+class UbxParser(object):
+    """UbxParser : extract UBX frames from a byte stream, NMEA or garbage in between
+    is skipped, frames with an invalid checksum are counted and dropped
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.errors = 0
+
+    def feed(self, data):
+        """feed : add received bytes
+
+        Returns:
+            list: (class, id, payload) of each complete valid frame
+        """
+        self.buffer += data
+        frames = []
+        buf = self.buffer
+        pos = 0
+        while True:
+            pos = buf.find(UBX_SYNC, pos)
+            if pos < 0:
+                pos = max(len(buf) - 1, 0) # keep a possible first sync byte
+                break
+            if len(buf) - pos < 6:
+                break
+            length = buf[pos+4] | buf[pos+5] << 8
+            if length > UBX_MAX_PAYLOAD:
+                self.errors += 1
+                pos += 2
+                continue
+            end = pos + 8 + length
+            if len(buf) < end:
+                break
+            if ubx_checksum(buf[pos+2:end-2]) != buf[end-2:end]:
+                self.errors += 1
+                pos += 2
+                continue
+            frames.append((buf[pos+2], buf[pos+3], bytes(buf[pos+6:end-2])))
+            self.frames += 1
+            pos = end
+        del buf[:pos]
+        return frames
+
+
+def decode_nav_pvt(payload, device):
+    """decode_nav_pvt : gps fix from a NAV-PVT payload
+
+    Returns:
+        dict: fix in the gpsd format with stamp, hacc (m) and sacc (knots), or None without 3D fix
+    """
+    if len(payload) < NAV_PVT_LEN:
+        return None
+    (__, year, month, day, hour, minute, second, valid, __, nano, fixtype, flags, __, __,
+     lon, lat, __, __, hacc, __, __, __, __, gspeed, headmot, sacc, __, __) = NAV_PVT.unpack_from(payload)
+    if fixtype not in [3, 4] or not flags & 1: # 3D or GNSS + dead reckoning, gnssFixOK
+        return None
+
+    fix = {'lat': lat * 1e-7, 'lon': lon * 1e-7,
+           'speed': gspeed * MM_S_TO_KNOTS, 'track': headmot * 1e-5,
+           'hacc': hacc * 1e-3, 'sacc': sacc * MM_S_TO_KNOTS, 'device': device}
+    if valid & 3 == 3: # valid date and time
+        fix['stamp'] = calendar.timegm((year, month, day, hour, minute, second)) + nano * 1e-9
+    return fix
+
+
+class UbxGPS(object):
+    """UbxGPS : u-blox receiver on a serial port
+
+    Args:
+        path (string): serial device
+        baudrate (int): baud rate
+    """
+    def __init__(self, path, baudrate):
+        self.path = path
+        self.device = serial.Serial(path, baudrate, timeout=0)
+        self.parser = UbxParser()
+        self.acks = 0
+        self.naks = 0
+        self.fixes = 0
+
+    def fileno(self):
+        return self.device.fileno()
+
+    def close(self):
+        self.device.close()
+
+    def configure(self, rate):
+        # acknowledges are counted by read(), never waited for
+        if rate not in UBX_RATES:
+            print('ubx: unsupported rate', rate)
+            rate = UBX_RATES[1]
+        self.device.write(UBX_PRT_USB1 + ubx_cfg_rate(rate) + ubx_cfg_nav_pvt())
+        print('ubx: configured', self.path, 'for NAV-PVT at', rate, 'Hz')
+
+    def read(self):
+        """read : read available data
+
+        Returns:
+            list: gps fixes
+        """
+        try:
+            data = os.read(self.device.fileno(), 4096)
+        except BlockingIOError:
+            return []
+        fixes = []
+        for cls, msgid, payload in self.parser.feed(data):
+            if cls == UBX_NAV and msgid == UBX_NAV_PVT:
+                fix = decode_nav_pvt(payload, self.path)
+                if fix:
+                    fixes.append(fix)
+            elif cls == UBX_ACK:
+                if msgid == 1:
+                    self.acks += 1
+                else:
+                    self.naks += 1
+        self.fixes += len(fixes)
+        return fixes
+
+
+class ubxProcess(ForkedHelper):
+    """ubxProcess : gps process using UbxGPS, same pipe messages as gpsProcess
+    """
+    def __init__(self, serial_device, rate):
+        self.pipe, pipe = non_blocking_pipe('gps_pipe')
+        super(ubxProcess, self).__init__(target=self.ubx_process, args=(pipe,), daemon=True)
+        self.path = serial_device.path
+        self.baudrate = serial_device.baudrate
+        self.rate = rate
+
+    def ubx_process(self, pipe):
+        print('ubx gps process', os.getpid())
+        gps = None
+        devices = []
+        poller = select.poll()
+        last_data = time.monotonic()
+        while True:
+            msg = pipe.recv()
+            while msg:
+                if 'rate' in msg and msg['rate'] != self.rate:
+                    self.rate = msg['rate']
+                    if gps:
+                        gps.configure(self.rate)
+                msg = pipe.recv()
+
+            if not gps:
+                try:
+                    gps = UbxGPS(self.path, self.baudrate)
+                    gps.configure(self.rate)
+                    poller.register(gps.fileno(), select.POLLIN)
+                    last_data = time.monotonic()
+                except Exception as e:
+                    print('ubx: failed to open', self.path, e)
+                    gps = None
+                    time.sleep(5)
+                    continue
+
+            events = poller.poll(1000)
+            t = time.monotonic()
+            if events and events[0][1] & select.POLLIN:
+                frames = gps.parser.frames
+                fixes = gps.read()
+                if gps.parser.frames != frames:
+                    # the receiver is alive, it may still be acquiring satellites
+                    last_data = t
+                if fixes:
+                    if not devices:
+                        devices = [self.path]
+                        pipe.send({'devices': devices})
+                for fix in fixes:
+                    fix['rx'] = t
+                    pipe.send(fix, False)
+            if t - last_data > UBX_NO_DATA_TIMEOUT or (events and events[0][1] & (select.POLLHUP | select.POLLERR)):
+                print('ubx: no data from', self.path, 'acks', gps.acks, 'naks', gps.naks, 'checksum errors', gps.parser.errors)
+                poller.unregister(gps.fileno())
+                gps.close()
+                gps = None
+                if devices:
+                    devices = []
+                    pipe.send({'devices': devices})
+
+
+def ubx_record(path, filename, duration=60, rate=5):
+    # at the baud rate of the device in cypilot_serial.conf
+    baudrates = {device.path: device.baudrate for device in serials.list_serials('ubx') + serials.list_serials('gps')}
+    if path not in baudrates:
+        print('ubx:', path, 'is not configured as a ubx or gps device')
+        return
+    gps = UbxGPS(path, baudrates[path])
+    gps.configure(rate)
+    with open(filename, 'wb') as f:
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < duration:
+            select.select([gps.fileno()], [], [], 1)
+            try:
+                f.write(os.read(gps.fileno(), 4096))
+            except BlockingIOError:
+                pass
+    print('recorded', filename)
+
+def ubx_replay(filename, chunk=256, period=.01):
+    """ubx_replay : feed a capture to the driver through a pty
+
+    Returns:
+        UbxGPS: the driver, with its counters
+    """
+    master, slave = os.openpty()
+    with open(filename, 'rb') as f:
+        capture = f.read()
+
+    def feed():
+        for i in range(0, len(capture), chunk):
+            os.write(master, capture[i:i+chunk])
+            time.sleep(period)
+    writer = threading.Thread(target=feed, daemon=True)
+
+    gps = UbxGPS(os.ttyname(slave), 115200)
+    writer.start()
+    t0, first, last = time.monotonic(), None, None
+    while writer.is_alive() or select.select([gps.fileno()], [], [], .1)[0]:
+        if not select.select([gps.fileno()], [], [], .1)[0]:
+            continue
+        for fix in gps.read():
+            first = first or fix
+            last = fix
+            print(f"lat {fix['lat']:.7f} lon {fix['lon']:.7f} speed {fix['speed']:.2f} track {fix['track']:.1f} hacc {fix['hacc']:.2f} sacc {fix['sacc']:.2f}")
+    print('frames', gps.parser.frames, 'checksum errors', gps.parser.errors, 'fixes', gps.fixes,
+          f'in {time.monotonic() - t0:.1f}s')
+    if first and last and 'stamp' in first and 'stamp' in last and gps.fixes > 1:
+        print(f"navigation rate {(gps.fixes - 1) / max(last['stamp'] - first['stamp'], 1e-3):.1f} Hz")
+    gps.close()
+    os.close(master)
+    return gps
+
+def ubx_main():
+    print('Version:', cypilot.pilot_path.STRVERSION)
+    if len(sys.argv) >= 4 and sys.argv[1] == 'record':
+        ubx_record(sys.argv[2], sys.argv[3], float(sys.argv[4]) if len(sys.argv) > 4 else 60)
+    elif len(sys.argv) == 3 and sys.argv[1] == 'replay':
+        ubx_replay(sys.argv[2])
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    ubx_main()
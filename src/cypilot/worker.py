@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# (C) 2023 JF/ED for Cybele Services (cf@cybele-sailing.com)
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Tested with CysBOX/CysPWR hardware fitted with Pi4-4GB/OS64b
+
+"""background worker thread of the autopilot process
+
+The autopilot process runs with realtime priority : only IMU read, pilot and servo
+should remain in the realtime loop. Everything which may block on a serial port,
+a pipe or a device (NMEA output, sensor bookkeeping, watchdog) is moved to a
+worker thread running with normal priority.
+
+The realtime thread and the worker only exchange data through deques: append()
+and popleft() are atomic, so neither side ever waits for the other.
+"""
+
+import os
+import time
+import threading
+import collections
+
+import cypilot.pilot_path # pylint: disable=unused-import
+
+from pilot_path import dprint as print # pylint: disable=redefined-builtin
+
+
+class BackgroundWorker(threading.Thread):
+    """BackgroundWorker : low priority thread polling jobs periodically
+
+    Args:
+        name (string): thread name
+        period (float): polling period in seconds
+    """
+    def __init__(self, name='worker', period=.05):
+        super(BackgroundWorker, self).__init__(name=name, daemon=True)
+        self.period = period
+        self.jobs = []
+        self.calls = collections.deque() # one shot calls queued by the realtime thread
+        self.overtime = 0
+
+    def add_job(self, job):
+        """add_job : add a function called on each worker period
+
+        Args:
+            job (function): function called without argument
+        """
+        self.jobs.append(job)
+
+    def call(self, function, *args):
+        """call : queue a function to be called once by the worker
+
+        Args:
+            function (function): function to call
+            args: function arguments
+        """
+        self.calls.append((function, args))
+
+    def run(self):
+        # threads inherit the scheduling policy of their creator, leave realtime
+        try:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        except Exception as e:
+            print('worker failed to leave realtime scheduling', e)
+
+        print('worker thread', threading.get_native_id())
+        while True:
+            t0 = time.monotonic()
+            while self.calls:
+                function, args = self.calls.popleft()
+                try:
+                    function(*args)
+                except Exception as e:
+                    print('worker call failed', function, e)
+
+            for job in self.jobs:
+                try:
+                    job()
+                except Exception as e:
+                    print('worker job failed', job, e)
+
+            dt = time.monotonic() - t0
+            if dt > self.period:
+                self.overtime += 1
+            else:
+                time.sleep(self.period - dt)